@@ -5,24 +5,102 @@
 
 
 import argparse
+import json
 
 # Imports for typing
-from dataclasses import dataclass
+from dataclasses import dataclass, field
 import os
 from pathlib import Path
-from typing import Optional
+import sys
+from typing import Iterable, Iterator, Optional, TextIO
 
-from rsnapshot_docker_compose_backup.structure.container import Container
+from rsnapshot_docker_compose_backup.cache import (
+    DiscoveryCache,
+    open_atomic,
+    root_cache_name,
+    write_atomic,
+)
 
 # Other imports
-from rsnapshot_docker_compose_backup.global_values import set_folder, set_config_file
-from rsnapshot_docker_compose_backup.docker import docker_compose
+from rsnapshot_docker_compose_backup.global_values import (
+    set_folder,
+    set_config_file,
+    set_docker_backend,
+    set_discovery,
+)
+from rsnapshot_docker_compose_backup.docker import docker, docker_compose
+from rsnapshot_docker_compose_backup.docker.host import DockerHost, parse_host
+from rsnapshot_docker_compose_backup import (
+    changes,
+    excludes,
+    hosts,
+    metrics,
+    scheduler,
+    shards,
+    sizing,
+    throttle,
+    volume_index,
+    watch,
+)
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.executor import Executor
+from rsnapshot_docker_compose_backup.history import History, default_database
+from rsnapshot_docker_compose_backup.hosts import DEFAULT_HOST_TIMEOUT
+from rsnapshot_docker_compose_backup.scanner import ScanOptions
+from rsnapshot_docker_compose_backup.structure.container import Container
 
 
 @dataclass
 class ProgramArgs:
     folder: Path
     config: Optional[Path]
+    docker_backend: str = "auto"
+    discovery: str = "labels"
+    cache: bool = True
+    refresh_cache: bool = False
+    cache_stats: bool = False
+    jobs: int = docker_compose.DEFAULT_JOBS
+    output: Optional[Path] = None
+    profile: Optional[str] = None
+    trace: Optional[Path] = None
+    max_depth: Optional[int] = None
+    exclude: list[str] = field(default_factory=list)
+    nested: bool = False
+    scan_threads: int = 1
+    watch: bool = False
+    socket: Optional[Path] = None
+    hosts: list[DockerHost] = field(default_factory=list)
+    host_timeout: float = DEFAULT_HOST_TIMEOUT
+    schedule: str = "container"
+    execute: Optional[Path] = None
+    lanes: int = 1
+    execute_log: Optional[Path] = None
+    rsync: str = "rsync"
+    history: Optional[Path] = None
+    shards: int = 0
+    volume_sizes: str = "scan"
+    size_threads: int = sizing.DEFAULT_THREADS
+    skip_unchanged: bool = False
+    full_every: int = changes.DEFAULT_FULL_EVERY
+    shared_volumes: str = "copy"
+    explain: bool = False
+    commit_changes: Optional[Path] = None
+
+
+def positive_int(value: str) -> int:
+    """An argparse type for counts that have to be at least 1"""
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError("{} is less than 1".format(value))
+    return number
+
+
+def non_negative_int(value: str) -> int:
+    """An argparse type for limits where 0 has a meaning"""
+    number = int(value)
+    if number < 0:
+        raise argparse.ArgumentTypeError("{} is negative".format(value))
+    return number
 
 
 def parse_arguments() -> ProgramArgs:
@@ -41,29 +119,638 @@ def parse_arguments() -> ProgramArgs:
         help="Path to the root config file, if it isn't in the root docker-compose folder",
         default=None,
     )
+    ap.add_argument(
+        "--docker-backend",
+        required=False,
+        choices=["auto", "api", "cli"],
+        help="Query docker over the Engine API socket or with the docker cli. "
+        "auto uses the socket if it is reachable and falls back to the cli",
+        default="auto",
+    )
+    ap.add_argument(
+        "--discovery",
+        required=False,
+        choices=["labels", "compose"],
+        help="Find the services of a project by the labels of its containers or "
+        "by asking docker compose. labels only asks docker compose for projects "
+        "without containers",
+        default="labels",
+    )
+    ap.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="Don't read or write the discovery cache",
+    )
+    ap.add_argument(
+        "--refresh",
+        action="store_true",
+        help="Ignore the cached discovery results and replace them",
+    )
+    ap.add_argument(
+        "--cache-stats",
+        action="store_true",
+        help="Print the hits and misses of the discovery cache to stderr",
+    )
+    ap.add_argument(
+        "-j",
+        "--jobs",
+        required=False,
+        type=positive_int,
+        help="How many docker commands can run at the same time during the discovery",
+        default=docker_compose.DEFAULT_JOBS,
+    )
+    ap.add_argument(
+        "-o",
+        "--output",
+        required=False,
+        help="Write the config to this file instead of stdout. The file is "
+        "replaced at the end, so it is never read while it is half written",
+        default=None,
+    )
+    ap.add_argument(
+        "--profile",
+        nargs="?",
+        const="text",
+        choices=["text", "json"],
+        help="Print the time of every phase, project and the slowest docker "
+        "commands to stderr",
+        default=None,
+    )
+    ap.add_argument(
+        "--trace",
+        required=False,
+        help="Write the timings as a Chrome trace file (chrome://tracing, Perfetto)",
+        default=None,
+    )
+    ap.add_argument(
+        "--max-depth",
+        required=False,
+        type=non_negative_int,
+        help="How many levels below the root folder are searched for projects",
+        default=None,
+    )
+    ap.add_argument(
+        "--exclude",
+        action="append",
+        help="Glob of dirs that aren't searched for projects, relative to the "
+        "root folder or a dir name. Can be given more than once, dirs can also "
+        "be excluded with a .backupignore file",
+        default=[],
+    )
+    ap.add_argument(
+        "--nested",
+        action="store_true",
+        help="Also search for projects in the dirs of other projects",
+    )
+    ap.add_argument(
+        "--scan-threads",
+        required=False,
+        type=positive_int,
+        help="How many threads search for projects",
+        default=1,
+    )
+    ap.add_argument(
+        "--watch",
+        action="store_true",
+        help="Keep running and update the config whenever docker reports changed "
+        "containers or volumes. Needs --output or --socket",
+    )
+    ap.add_argument(
+        "--socket",
+        required=False,
+        help="With --watch the current config is served on this unix socket. "
+        "Without --watch the config is read from the socket if a watcher runs",
+        default=None,
+    )
+    ap.add_argument(
+        "--host",
+        action="append",
+        help="A docker host whose projects are backed up, as comma separated "
+        "key=value pairs: name, root (the compose root on the host) and context "
+        "or docker_host. Can be given more than once, the hosts are discovered "
+        "at the same time and the backups of every host go to a dir with its name",
+        default=[],
+    )
+    ap.add_argument(
+        "--host-timeout",
+        required=False,
+        type=float,
+        help="Seconds until the discovery of a host is given up, "
+        "the other hosts are still backed up",
+        default=DEFAULT_HOST_TIMEOUT,
+    )
+    ap.add_argument(
+        "--schedule",
+        required=False,
+        choices=["container", "project"],
+        help="container backs up one container after the other. project runs "
+        "the runtime backups of all projects first and then stops every project "
+        "once for all its services, the shortest stop windows first",
+        default="container",
+    )
+    ap.add_argument(
+        "--execute",
+        required=False,
+        help="Run the backup into this dir instead of writing the config. "
+        "Every project is stopped, backed up and restarted on its own lane",
+        default=None,
+    )
+    ap.add_argument(
+        "--lanes",
+        required=False,
+        type=positive_int,
+        help="How many projects are backed up at the same time with --execute",
+        default=1,
+    )
+    ap.add_argument(
+        "--execute-log",
+        required=False,
+        help="Write the timing of every step of --execute to this file as json "
+        "lines instead of stderr",
+        default=None,
+    )
+    ap.add_argument(
+        "--rsync",
+        required=False,
+        help="The rsync executable that --execute uses",
+        default="rsync",
+    )
+    ap.add_argument(
+        "--history",
+        nargs="?",
+        const=str(default_database()),
+        help="Use the durations of earlier runs (see rsnapshot-docker-compose-history) "
+        "to order the projects and report steps that got much slower",
+        default=None,
+    )
+    ap.add_argument(
+        "--shards",
+        required=False,
+        type=positive_int,
+        help="Split the projects into this many configs with about the same "
+        "amount of data, that are written next to --output (e.g. docker.0.conf)",
+        default=0,
+    )
+    ap.add_argument(
+        "--volume-sizes",
+        required=False,
+        choices=["scan", "docker"],
+        help="Measure the volumes for --shards by scanning their dirs or ask "
+        "docker system df",
+        default="scan",
+    )
+    ap.add_argument(
+        "--size-threads",
+        required=False,
+        type=positive_int,
+        help="How many threads scan the volumes for --shards and --skip-unchanged",
+        default=sizing.DEFAULT_THREADS,
+    )
+    ap.add_argument(
+        "--skip-unchanged",
+        action="store_true",
+        help="Don't stop and back up containers whose volumes didn't change since "
+        "the last run, the volumes are compared by a fingerprint of their files",
+    )
+    ap.add_argument(
+        "--full-every",
+        required=False,
+        type=non_negative_int,
+        help="With --skip-unchanged all containers are backed up every this many "
+        "runs, 0 never forces a full backup",
+        default=changes.DEFAULT_FULL_EVERY,
+    )
+    ap.add_argument(
+        "--shared-volumes",
+        required=False,
+        choices=volume_index.POLICIES,
+        help="How a volume that several services mount is backed up. copy backs "
+        "it up with every service, first only with the first service and project "
+        "with the service of the project that created it, the other services "
+        "reference it. Volumes inside other volumes are reported",
+        default="copy",
+    )
+    ap.add_argument(
+        "--explain",
+        action="store_true",
+        help="Print how many bytes every exclude rule of the volumes leaves out "
+        "of the backup to stderr",
+    )
+    ap.add_argument(
+        "--commit-changes",
+        required=False,
+        help="Mark the volumes of a --skip-unchanged run as backed up, the last "
+        "line of the config runs this with the pending fingerprints",
+        default=None,
+    )
     args = vars(ap.parse_args())
+    if args["watch"] and args["output"] is None and args["socket"] is None:
+        ap.error("--watch needs --output or --socket")
+    if args["watch"] and args["host"]:
+        ap.error("--watch can't be used with --host")
+    if args["execute"] is not None and (args["watch"] or args["host"]):
+        ap.error("--execute can't be used with --watch or --host")
+    if args["shards"] and args["output"] is None:
+        ap.error("--shards needs --output")
+    if args["shards"] and (args["watch"] or args["host"] or args["execute"]):
+        ap.error("--shards can't be used with --watch, --host or --execute")
+    if args["skip_unchanged"] and (args["watch"] or args["host"]):
+        ap.error("--skip-unchanged can't be used with --watch or --host")
+    if args["shared_volumes"] != "copy" and (args["watch"] or args["host"]):
+        ap.error("--shared-volumes can't be used with --watch or --host")
+    if args["explain"] and (args["watch"] or args["host"]):
+        ap.error("--explain can't be used with --watch or --host")
+    if args["watch"] and args["schedule"] != "container":
+        ap.error("--watch can't be used with --schedule {}".format(args["schedule"]))
+    try:
+        docker_hosts = [parse_host(spec) for spec in args["host"]]
+    except Exception as e:  # pylint: disable=broad-except
+        ap.error(str(e))
     if args["config"] is not None:
         config_file = Path(args["config"])
     else:
         config_file = None
-    return ProgramArgs(folder=Path(args["folder"]), config=config_file)
+    return ProgramArgs(
+        folder=Path(args["folder"]),
+        config=config_file,
+        docker_backend=args["docker_backend"],
+        discovery=args["discovery"],
+        cache=not args["no_cache"],
+        refresh_cache=args["refresh"],
+        cache_stats=args["cache_stats"],
+        jobs=args["jobs"],
+        output=Path(args["output"]) if args["output"] is not None else None,
+        profile=args["profile"],
+        trace=Path(args["trace"]) if args["trace"] is not None else None,
+        max_depth=args["max_depth"],
+        exclude=args["exclude"],
+        nested=args["nested"],
+        scan_threads=args["scan_threads"],
+        watch=args["watch"],
+        socket=Path(args["socket"]) if args["socket"] is not None else None,
+        hosts=docker_hosts,
+        host_timeout=args["host_timeout"],
+        schedule=args["schedule"],
+        execute=Path(args["execute"]) if args["execute"] is not None else None,
+        lanes=args["lanes"],
+        execute_log=(
+            Path(args["execute_log"]) if args["execute_log"] is not None else None
+        ),
+        rsync=args["rsync"],
+        history=Path(args["history"]) if args["history"] is not None else None,
+        shards=args["shards"],
+        volume_sizes=args["volume_sizes"],
+        size_threads=args["size_threads"],
+        skip_unchanged=args["skip_unchanged"],
+        full_every=args["full_every"],
+        shared_volumes=args["shared_volumes"],
+        explain=args["explain"],
+        commit_changes=(
+            Path(args["commit_changes"]) if args["commit_changes"] is not None else None
+        ),
+    )
 
 
 def run(args: ProgramArgs) -> str:
+    return "\n".join(iter_lines(args))
+
+
+def prepare(
+    args: ProgramArgs,
+) -> tuple[Optional[DiscoveryCache], Optional[DiscoveryCache], ScanOptions]:
+    """Applies the global settings of the args.
+    :returns: the discovery cache, the dir index and the scan options"""
     set_folder(args.folder)
     set_config_file(args.config)
-    docker_container: list[Container] = docker_compose.find_container(args.folder)
-    result: list[str] = []
-    for container in docker_container:
-        container_result = container.backup()
-        if container_result:
-            result.append(container_result)
-    return "\n".join(result)
+    set_docker_backend(args.docker_backend)
+    set_discovery(args.discovery)
+    docker.reset_api()
+    docker.reset_fleet()
+    changes.use(
+        changes.ChangeDetector(
+            root_cache_name("changes", args.folder),
+            args.full_every,
+            args.size_threads,
+        )
+        if args.skip_unchanged
+        else None
+    )
+    budget = throttle.parse_budget(DefaultConfig.get_instance().throttle_options)
+    throttle.use(
+        throttle.Throttle(budget, _concurrency(args, budget))
+        if budget.limited
+        else None
+    )
+    cache: Optional[DiscoveryCache] = None
+    dir_index: Optional[DiscoveryCache] = None
+    if args.cache:
+        cache = DiscoveryCache(
+            root_cache_name("discovery", args.folder), refresh=args.refresh_cache
+        )
+        dir_index = DiscoveryCache(
+            root_cache_name("dirs", args.folder), refresh=args.refresh_cache
+        )
+    scan_options = ScanOptions(
+        max_depth=args.max_depth,
+        excludes=args.exclude,
+        nested=args.nested,
+        threads=args.scan_threads,
+    )
+    return cache, dir_index, scan_options
+
+
+def _concurrency(args: ProgramArgs, budget: throttle.Budget) -> int:
+    """How many projects are backed up at the same time: the lanes of
+    --execute, capped by the budget, or the shards that rsnapshot runs"""
+    if args.execute is not None:
+        if budget.concurrency is not None:
+            return min(args.lanes, budget.concurrency)
+        return args.lanes
+    return max(args.shards, 1)
+
+
+def iter_lines(args: ProgramArgs) -> Iterator[str]:
+    """Yields the lines of the config while the containers are created, so the
+    config doesn't have to be kept in memory"""
+    registry = metrics.reset(enabled=args.profile is not None or args.trace is not None)
+    cache, dir_index, scan_options = prepare(args)
+    windows = _estimates(args, scheduler.STOPPED_STEPS)
+    if args.hosts:
+        host_caches = _host_caches(args)
+        yield from hosts.iter_lines(
+            args.hosts,
+            host_caches,
+            args.jobs,
+            args.host_timeout,
+            scan_options,
+            args.schedule,
+        )
+        for name, caches in host_caches.items():
+            _save_caches(args, caches.discovery, caches.dir_index, name)
+    else:
+        containers = _discover(args, cache, dir_index, scan_options)
+        if args.explain:
+            containers = _explained(containers)
+        if args.schedule == "project":
+            yield from scheduler.iter_schedule(containers, windows)
+        else:
+            for container in containers:
+                yield from container.iter_backup()
+        _save_caches(args, cache, dir_index)
+        detector = changes.current()
+        if detector is not None:
+            yield changes.commit_line(detector.save_pending())
+    if args.profile == "json":
+        print(json.dumps(registry.report(), indent=2), file=sys.stderr)
+    elif args.profile == "text":
+        print(registry.text_report(), file=sys.stderr)
+    if args.trace is not None:
+        write_atomic(args.trace, json.dumps(registry.chrome_trace()))
+
+
+def _discover(
+    args: ProgramArgs,
+    cache: Optional[DiscoveryCache],
+    dir_index: Optional[DiscoveryCache],
+    scan_options: ScanOptions,
+) -> Iterable[Container]:
+    """The containers of all projects. If the volumes are shared, all
+    containers are discovered before the first one is returned."""
+    containers = docker_compose.iter_container(
+        args.folder, cache, args.jobs, scan_options, dir_index
+    )
+    if args.shared_volumes == "copy":
+        return containers
+    return volume_index.share_volumes(containers, args.shared_volumes)
+
+
+def _explained(
+    containers: Iterable[Container], log: Optional[TextIO] = None
+) -> Iterator[Container]:
+    """Reports the bytes that the exclude rules of every container leave out,
+    after the container was rendered"""
+    log = log if log is not None else sys.stderr
+    total = 0
+    for container in containers:
+        yield container
+        if container.config.skipped():
+            continue
+        for volume, rules in container.config.volume_rules().values():
+            for rule, size in excludes.explain(volume.path, rules).items():
+                total += size
+                print(
+                    "Volume {} of {}/{}: {} leaves out {} ({})".format(
+                        volume.name,
+                        container.project_name,
+                        container.service_name,
+                        rule.option(),
+                        sizing.format_size(size),
+                        rule.source,
+                    ),
+                    file=log,
+                )
+    print("The excludes leave out {}".format(sizing.format_size(total)), file=log)
+
+
+def _estimates(
+    args: ProgramArgs, steps: Optional[list[str]] = None
+) -> Optional[dict[str, float]]:
+    """The seconds of the steps of every project in earlier runs, steps that got
+    much slower are reported"""
+    if args.history is None:
+        return None
+    history = History(args.history)
+    try:
+        for regression in history.regressions():
+            print("Slower than usual: {}".format(regression), file=sys.stderr)
+        return history.estimates(steps)
+    finally:
+        history.close()
+
+
+def _host_caches(args: ProgramArgs) -> dict[str, hosts.HostCaches]:
+    """Every host has its own caches, their roots can have the same path"""
+    if not args.cache:
+        return {}
+    return {
+        docker_host.name: hosts.HostCaches(
+            DiscoveryCache(
+                root_cache_name(
+                    "discovery-{}".format(docker_host.name), docker_host.root
+                ),
+                refresh=args.refresh_cache,
+            ),
+            DiscoveryCache(
+                root_cache_name("dirs-{}".format(docker_host.name), docker_host.root),
+                refresh=args.refresh_cache,
+            ),
+        )
+        for docker_host in args.hosts
+    }
+
+
+def _save_caches(
+    args: ProgramArgs,
+    cache: Optional[DiscoveryCache],
+    dir_index: Optional[DiscoveryCache],
+    host_name: Optional[str] = None,
+) -> None:
+    if cache is None or dir_index is None:
+        return
+    cache.save()
+    dir_index.save()
+    if args.cache_stats:
+        prefix = "Host {}: ".format(host_name) if host_name is not None else ""
+        print("{}Discovery cache: {}".format(prefix, cache.stats), file=sys.stderr)
+        print("{}Directory index: {}".format(prefix, dir_index.stats), file=sys.stderr)
+
+
+def write_lines(lines: Iterable[str], output: TextIO) -> None:
+    for line in lines:
+        output.write(line)
+        output.write("\n")
+
+
+def execute(args: ProgramArgs, log: Optional[TextIO] = None) -> bool:
+    """Runs the backup of all projects, in the order of the project schedule.
+    :returns: if every project was backed up without errors"""
+    assert args.execute is not None
+    cache, dir_index, scan_options = prepare(args)
+    containers = list(_discover(args, cache, dir_index, scan_options))
+    lanes = args.lanes
+    wrapper: list[str] = []
+    current = throttle.current()
+    if current is not None:
+        lanes = current.concurrency
+        wrapper = current.wrapper()
+        # The budget is divided by the size of the projects on the lanes
+        if lanes > 1 and current.budget.total is not None:
+            running = [c for c in containers if not c.config.skipped()]
+            _measure(args, running)
+            current.assign(shards.project_sizes(running))
+    # The longest projects start first, so the lanes finish at the same time
+    plans = scheduler.order_projects(
+        scheduler.plan_projects(containers), _estimates(args), longest_first=True
+    )
+    _save_caches(args, cache, dir_index)
+    success = Executor(args.execute, lanes, log, args.rsync, wrapper).run(plans)
+    # A failed backup is tried again in the next run
+    detector = changes.current()
+    if success and detector is not None:
+        detector.save()
+    return success
+
+
+def write_shards(args: ProgramArgs) -> list[shards.Shard]:
+    """Writes the config of every shard next to the output file"""
+    assert args.output is not None
+    cache, dir_index, scan_options = prepare(args)
+    windows = _estimates(args, scheduler.STOPPED_STEPS)
+    containers = [
+        container
+        for container in _discover(args, cache, dir_index, scan_options)
+        if not container.config.skipped()
+    ]
+    _save_caches(args, cache, dir_index)
+    _measure(args, containers)
+    current = throttle.current()
+    if current is not None:
+        current.assign(shards.project_sizes(containers))
+    result = shards.pack(containers, args.shards)
+    detector = changes.current()
+    for shard in result:
+        with open_atomic(shards.shard_file(args.output, shard.index)) as output:
+            if args.schedule == "project":
+                write_lines(scheduler.iter_schedule(shard.containers, windows), output)
+            else:
+                write_lines(
+                    (line for c in shard.containers for line in c.iter_backup()),
+                    output,
+                )
+            if detector is not None:
+                # Every shard commits the volumes that it backed up
+                paths = [v.path for c in shard.containers for v in c.volumes]
+                pending = detector.save_pending(paths, shard.index)
+                write_lines([changes.commit_line(pending)], output)
+    # rsnapshot would still run the shards that aren't written anymore
+    for stale in shards.stale_files(args.output, args.shards):
+        stale.unlink()
+        print("Removed {} of an earlier run".format(stale), file=sys.stderr)
+    return result
+
+
+def _measure(args: ProgramArgs, containers: list[Container]) -> None:
+    """Sets the sizes of the volumes of the containers"""
+    size_index = DiscoveryCache("volume-sizes") if args.cache else None
+    with metrics.span("sizing"):
+        sizing.measure(
+            [v for container in containers for v in container.config.owned_volumes()],
+            args.volume_sizes,
+            size_index,
+            args.size_threads,
+        )
+    if size_index is not None:
+        size_index.save()
+
+
+def watch_main(args: ProgramArgs) -> None:
+    cache, dir_index, scan_options = prepare(args)
+    watcher = watch.Watcher(
+        args.folder, args.output, cache, args.jobs, scan_options, dir_index
+    )
+    server: Optional[watch.PlanServer] = None
+    watcher.build()
+    if args.socket is not None:
+        server = watch.PlanServer(args.socket, watcher)
+        server.start()
+    try:
+        watcher.follow(watch.DockerEventSource())
+    finally:
+        if server is not None:
+            server.stop()
 
 
 def main() -> None:
     args: ProgramArgs = parse_arguments()
-    print(run(args))
+    if args.commit_changes is not None:
+        changes.commit(args.commit_changes)
+        return
+    if args.watch:
+        watch_main(args)
+        return
+    if args.execute is not None:
+        if args.execute_log is None:
+            success = execute(args, sys.stderr)
+        else:
+            with open(args.execute_log, "a", encoding="UTF-8") as log:
+                success = execute(args, log)
+        sys.exit(0 if success else 1)
+    if args.shards:
+        for shard in write_shards(args):
+            print(
+                "Shard {}: {} projects, {}".format(
+                    shard.index, len(shard.projects), sizing.format_size(shard.size)
+                ),
+                file=sys.stderr,
+            )
+        return
+    if args.socket is not None:
+        try:
+            plan = watch.fetch_plan(args.socket)
+        except OSError:
+            # No watcher is running, so the config is created normally
+            pass
+        else:
+            if args.output is None:
+                sys.stdout.write(plan)
+            else:
+                write_atomic(args.output, plan)
+            return
+    if args.output is None:
+        write_lines(iter_lines(args), sys.stdout)
+    else:
+        with open_atomic(args.output) as output:
+            write_lines(iter_lines(args), output)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,129 @@
+import contextlib
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import stat
+import tempfile
+from typing import Any, Iterator, Optional, TextIO
+
+CACHE_VERSION = 1
+
+
+def cache_dir() -> Path:
+    base = os.environ.get("XDG_CACHE_HOME") or os.path.join(
+        os.path.expanduser("~"), ".cache"
+    )
+    return Path(base) / "rsnapshot-docker-compose-backup"
+
+
+def hash_files(files: list[Path], extra: Optional[list[str]] = None) -> str:
+    """Hashes the content of all files (missing files are hashed as missing)
+    together with the extra strings"""
+    digest = hashlib.sha256()
+    for file in files:
+        digest.update(str(file).encode())
+        try:
+            digest.update(file.read_bytes())
+        except FileNotFoundError:
+            digest.update(b"\0missing")
+        digest.update(b"\0")
+    for value in extra or []:
+        digest.update(value.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+def write_atomic(file: Path, content: str) -> None:
+    """Writes the file to a temp file first and renames it afterwards,
+    so readers never see a half written file"""
+    with open_atomic(file) as atomic_file:
+        atomic_file.write(content)
+
+
+@contextlib.contextmanager
+def open_atomic(file: Path) -> Iterator[TextIO]:
+    """Opens a temp file next to the file, that replaces the file when the
+    context exits. If the context raises, the file isn't changed."""
+    file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=file.parent, prefix=".{}.".format(file.name))
+    try:
+        with os.fdopen(fd, "w", encoding="UTF-8") as tmp_file:
+            yield tmp_file
+        os.chmod(tmp_name, _file_mode(file))
+        os.replace(tmp_name, file)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
+
+
+def _file_mode(file: Path) -> int:
+    """The mode of the existing file or the default mode of new files,
+    because temp files are only readable by the owner"""
+    try:
+        return stat.S_IMODE(os.stat(file).st_mode)
+    except FileNotFoundError:
+        umask = os.umask(0)
+        os.umask(umask)
+        return 0o666 & ~umask
+
+
+@dataclass
+class CacheStats:
+    hits: int = 0
+    misses: int = 0
+
+    def __str__(self) -> str:
+        return "{} hits, {} misses".format(self.hits, self.misses)
+
+
+def root_cache_name(prefix: str, root_folder: Path) -> str:
+    """Every root folder gets its own cache file"""
+    root_hash = hashlib.sha256(os.path.realpath(root_folder).encode()).hexdigest()
+    return "{}-{}".format(prefix, root_hash[:16])
+
+
+class DiscoveryCache:
+    """On disk cache for the discovery results of the compose projects.
+    Every entry is stored with a key and is only returned if the key is the same,
+    so the key has to change whenever the cached value could change."""
+
+    def __init__(self, name: str, refresh: bool = False):
+        self.file = cache_dir() / "{}.json".format(name)
+        self.stats = CacheStats()
+        self._entries: dict[str, Any] = {}
+        self._used: dict[str, Any] = {}
+        if not refresh:
+            self._entries = self._load()
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            with open(self.file, encoding="UTF-8") as cache_file:
+                content = json.load(cache_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(content, dict) or content.get("version") != CACHE_VERSION:
+            return {}
+        entries: dict[str, Any] = content.get("entries", {})
+        return entries
+
+    def get(self, name: str, key: str) -> Optional[Any]:
+        entry = self._entries.get(name)
+        if entry is not None and entry["key"] == key:
+            self.stats.hits += 1
+            self._used[name] = entry
+            return entry["value"]
+        self.stats.misses += 1
+        return None
+
+    def put(self, name: str, key: str, value: Any) -> None:
+        self._used[name] = {"key": key, "value": value}
+
+    def save(self) -> None:
+        """Saves all entries that were used in this run, entries of projects
+        that don't exist anymore are dropped"""
+        write_atomic(
+            self.file,
+            json.dumps({"version": CACHE_VERSION, "entries": self._used}),
+        )
@@ -0,0 +1,217 @@
+"""Skips the backup of containers whose volumes didn't change since the last run.
+Every volume dir gets a fingerprint, a digest of the names, modes, sizes and
+times of everything below it, the dirs are listed by sizing.walk_levels. The
+fingerprints are kept between runs and a container whose volumes all still
+have the fingerprint of the last run isn't stopped, backed up and restarted. Every few runs all containers are backed up anyway.
+
+The fingerprints of a run are only pending until the backup is done. The
+config ends with a backup_exec line that commits them, so a run that fails
+or is aborted before its end doesn't mark the changed volumes as backed up."""
+
+import hashlib
+import json
+import os
+from pathlib import Path
+import shlex
+import sys
+from typing import Any, Iterable, Optional, TextIO
+
+from rsnapshot_docker_compose_backup.cache import cache_dir, write_atomic
+from rsnapshot_docker_compose_backup.sizing import DEFAULT_THREADS, walk_levels
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+STATE_VERSION = 1
+# The program that commits the pending fingerprints at the end of the backup
+COMMIT_COMMAND = "rsnapshot-docker-compose-backup --commit-changes"
+# Every this many runs all containers are backed up, 0 never forces a full pass
+DEFAULT_FULL_EVERY = 7
+# The steps of a container that are left out if its volumes didn't change
+SKIPPED_STEPS = [
+    "pre_stop",
+    "stop",
+    "pre_backup",
+    "backup",
+    "post_backup",
+    "restart",
+    "post_restart",
+]
+
+
+def fingerprints(
+    paths: Iterable[str], threads: int = DEFAULT_THREADS
+) -> dict[str, Optional[str]]:
+    """:returns: the fingerprint of every path, None if it can't be read"""
+    listings = walk_levels(paths, list_entries, threads)
+    result: dict[str, Optional[str]] = {}
+    for root, listing in listings.items():
+        if listing is None:
+            result[root] = None
+            continue
+        digest = hashlib.sha256()
+        for line in sorted("{}\0{}".format(*entry) for entry in listing):
+            digest.update(line.encode("UTF-8", "surrogateescape"))
+            digest.update(b"\n")
+        result[root] = digest.hexdigest()
+    return result
+
+
+def list_entries(directory: str) -> Optional[tuple[str, list[str]]]:
+    """:returns: the digest of the entries of the dir and the names of its subdirs,
+    None if the dir can't be read"""
+    entries: list[str] = []
+    subdirs: list[str] = []
+    try:
+        with os.scandir(directory) as dir_entries:
+            for entry in dir_entries:
+                stat = entry.stat(follow_symlinks=False)
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                # The ctime also changes if a file is written and its mtime
+                # is set back afterwards
+                entries.append(
+                    "{}\0{}\0{}\0{}\0{}".format(
+                        entry.name,
+                        stat.st_mode,
+                        stat.st_size,
+                        stat.st_mtime_ns,
+                        stat.st_ctime_ns,
+                    )
+                )
+    except OSError:
+        return None
+    digest = hashlib.sha256()
+    for line in sorted(entries):
+        digest.update(line.encode("UTF-8", "surrogateescape"))
+        digest.update(b"\n")
+    return digest.hexdigest(), subdirs
+
+
+class ChangeDetector:
+    """Compares the fingerprints of the volumes with the ones of the last run.
+    The new fingerprints are only stored by save() or by the commit of
+    save_pending(), so a run that is given up doesn't mark anything as
+    backed up."""
+
+    def __init__(
+        self,
+        name: str,
+        full_every: int = DEFAULT_FULL_EVERY,
+        threads: int = DEFAULT_THREADS,
+        log: Optional[TextIO] = None,
+    ):
+        self.file = cache_dir() / "{}.json".format(name)
+        self.threads = threads
+        self.log = log if log is not None else sys.stderr
+        state = self._load()
+        self.previous: dict[str, str] = state.get("volumes", {})
+        self.since_full: int = state.get("since_full", 0)
+        # The first run has no fingerprints, so it is a full pass anyway
+        self.full = full_every > 0 and self.since_full + 1 >= full_every
+        self.current: dict[str, str] = {}
+        self.skipped: list[str] = []
+
+    def _load(self) -> dict[str, Any]:
+        try:
+            with open(self.file, encoding="UTF-8") as state_file:
+                content = json.load(state_file)
+        except (OSError, ValueError):
+            return {}
+        if not isinstance(content, dict) or content.get("version") != STATE_VERSION:
+            return {}
+        return content
+
+    def skip_reason(self, label: str, volumes: list[Volume]) -> Optional[str]:
+        """:returns: why the backup of the volumes can be skipped,
+        None if they have to be backed up"""
+        if not volumes:
+            return None
+        paths = [volume.path for volume in volumes]
+        missing = [path for path in paths if path not in self.current]
+        for path, fingerprint in fingerprints(missing, self.threads).items():
+            if fingerprint is not None:
+                self.current[path] = fingerprint
+        if self.full:
+            return None
+        for path in paths:
+            if path not in self.current or self.current[path] != self.previous.get(
+                path
+            ):
+                return None
+        reason = "{} volume{} didn't change since the last run".format(
+            len(paths), "" if len(paths) == 1 else "s"
+        )
+        self.skipped.append(label)
+        print("Skipping the backup of {}: {}".format(label, reason), file=self.log)
+        return reason
+
+    def _state(self, paths: Optional[Iterable[str]] = None) -> dict[str, Any]:
+        volumes = self.current
+        if paths is not None:
+            volumes = {p: self.current[p] for p in paths if p in self.current}
+        return {
+            "version": STATE_VERSION,
+            "since_full": 0 if self.full else self.since_full + 1,
+            "volumes": volumes,
+            # Only the volumes of a part of the run replace the stored ones
+            "merge": paths is not None,
+        }
+
+    def save(self) -> None:
+        """Stores the fingerprints of the volumes of this run, volumes that
+        weren't seen are dropped"""
+        write_atomic(self.file, json.dumps(self._state()))
+
+    def save_pending(
+        self, paths: Optional[Iterable[str]] = None, part: Optional[int] = None
+    ) -> Path:
+        """Stores the fingerprints of this run until commit() is called with
+        the returned file, e.g. by the last line of the config.
+        :param paths: only these volumes are committed, e.g. of one shard
+        :param part: the number of the part of the run that they belong to"""
+        suffix = ".pending" if part is None else ".pending.{}".format(part)
+        pending = self.file.with_name(self.file.stem + suffix + self.file.suffix)
+        write_atomic(pending, json.dumps(self._state(paths)))
+        return pending
+
+
+def commit(pending: Path) -> None:
+    """Replaces the stored fingerprints with the pending ones of a backup
+    that succeeded"""
+    state_file = pending.with_name(pending.name.split(".pending", 1)[0] + ".json")
+    with open(pending, encoding="UTF-8") as pending_file:
+        state = json.load(pending_file)
+    if state.pop("merge", False):
+        try:
+            with open(state_file, encoding="UTF-8") as stored_file:
+                stored = json.load(stored_file)
+        except (OSError, ValueError):
+            stored = {}
+        if isinstance(stored, dict) and stored.get("version") == STATE_VERSION:
+            state["volumes"] = {**stored.get("volumes", {}), **state["volumes"]}
+    write_atomic(state_file, json.dumps(state))
+    os.unlink(pending)
+
+
+def commit_line(pending: Path) -> str:
+    """The backup_exec line that commits the pending fingerprints"""
+    return "backup_exec\t{} {}".format(COMMIT_COMMAND, shlex.quote(str(pending)))
+
+
+_detector: Optional[ChangeDetector] = None
+
+
+def use(detector: Optional[ChangeDetector]) -> None:
+    # pylint: disable=global-statement
+    global _detector
+    _detector = detector
+
+
+def current() -> Optional[ChangeDetector]:
+    return _detector
+
+
+def skip_reason(label: str, volumes: list[Volume]) -> Optional[str]:
+    """:returns: why the backup can be skipped, None without a detector"""
+    if _detector is None:
+        return None
+    return _detector.skip_reason(label, volumes)
@@ -1,13 +1,12 @@
-import configparser
 from importlib import resources
 import os
 from pathlib import Path
-import re
-from typing import Optional
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
 
-from rsnapshot_docker_compose_backup import global_values
+from rsnapshot_docker_compose_backup import global_values, throttle
 from rsnapshot_docker_compose_backup.config.abstract_config import AbstractConfig
-from rsnapshot_docker_compose_backup.utils import CaseInsensitiveRe
+from rsnapshot_docker_compose_backup.config.parsed_config import load_config
 
 
 class DefaultConfig(AbstractConfig):
@@ -18,13 +17,11 @@ class DefaultConfig(AbstractConfig):
     actionSection = "actions"
 
     # Settings
-    settings = {
+    defaultSettings = {
         "logTime": True,
         "onlyRunning": True,
     }
 
-    actions: dict[str, dict[str, str]] = {}
-
     @staticmethod
     def get_instance() -> "DefaultConfig":
         # print(f"Get Default Config, {DefaultConfig.__instance}")
@@ -45,6 +42,11 @@ class DefaultConfig(AbstractConfig):
             self.filename = global_values.folder / Path(
                 self.defaultConfigName,
             )
+        self.settings: dict[str, bool] = dict(self.defaultSettings)
+        # The options of the I/O budget, see throttle
+        self.throttle_options: dict[str, str] = {}
+        self.actions: dict[str, dict[str, str]] = {}
+        self._merged_steps: dict[Any, Mapping[str, str]] = {}
         if not os.path.isfile(self.filename):
             self._create_default_config()
         super().__init__(self.filename, self.defaultConfig)
@@ -70,34 +72,53 @@ class DefaultConfig(AbstractConfig):
         return self.backup_steps.get(step, "")
 
     def _load_actions(self) -> None:
-        config_file = configparser.ConfigParser(allow_no_value=True)
-        config_file.SECTCRE = CaseInsensitiveRe(
-            re.compile(r"\[ *(?P<header>[^]]+?) *]")
-        )  # type: ignore
-        config_file.read(self.filename)
-        for section in config_file.sections():
+        config_file = load_config(self.filename)
+        for section in config_file.sections:
             if section.startswith(self.actionSection):
                 action_name = section[len(self.actionSection + ".") :]
-                commands = {}
-                for step in self.backup_steps:
-                    if config_file.has_option(section.lower(), step):
-                        commands[step] = config_file.get(section, step).strip() + "\n"
+                commands = config_file.steps(section, self.backup_steps)
                 if commands:
                     self.actions[action_name] = commands
 
     def _load_settings(self) -> None:
-        config_file = configparser.ConfigParser(allow_no_value=True)
-        config_file.SECTCRE = CaseInsensitiveRe(
-            re.compile(r"\[ *(?P<header>[^]]+?) *]")
-        )  # type: ignore
-        config_file.read(self.filename)
-        # print(f"filename {self.filename}")
+        config_file = load_config(self.filename)
         for setting in self.settings:
             if config_file.has_option(self.settingsSection, setting):
                 self.settings[setting] = config_file.getboolean(
                     self.settingsSection, setting
                 )
-                # print(f"{setting} is set to {self.settings[setting]}")
+        for option, value in config_file.section(self.settingsSection).items():
+            if option.split(".", 1)[0] in throttle.OPTIONS:
+                self.throttle_options[option] = (value or "").strip()
 
     def get_action(self, name: str) -> dict[str, str]:
         return self.actions[name]
+
+    def merged_steps(
+        self, backup_steps: dict[str, str], enabled_actions: dict[str, bool]
+    ) -> Mapping[str, str]:
+        """Returns the steps of a service with the commands of all enabled actions.
+        Steps that the service doesn't set are taken from the default config.
+        The result is shared by all services with the same overrides."""
+        key = (
+            tuple(backup_steps.items()),
+            tuple(sorted(enabled_actions.items())),
+        )
+        merged = self._merged_steps.get(key)
+        if merged is None:
+            enabled = self.enabled_actions.copy()
+            enabled.update(enabled_actions)
+            steps = dict(backup_steps)
+            for action, use in sorted(enabled.items()):
+                if use:
+                    commands = self.get_action(action)
+                    for step in commands:
+                        steps[step] = (
+                            steps.get(step, "") + commands[step].strip() + "\n"
+                        )
+            for step in self.backupOrder:
+                if not steps.get(step, ""):
+                    steps[step] = self.get_step(step)
+            merged = MappingProxyType(steps)
+            self._merged_steps[key] = merged
+        return merged
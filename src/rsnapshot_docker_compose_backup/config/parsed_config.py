@@ -0,0 +1,95 @@
+"""Config files that are parsed once and shared by all configs that use them.
+A file is only parsed again if its modification time or size changed."""
+
+import configparser
+from dataclasses import dataclass
+import os
+from pathlib import Path
+import re
+from stat import S_ISREG
+from types import MappingProxyType
+from typing import Iterable, Mapping, Optional
+
+from rsnapshot_docker_compose_backup.utils import CaseInsensitiveRe
+
+_EMPTY: Mapping[str, Optional[str]] = MappingProxyType({})
+_EMPTY_FILE: Mapping[str, Mapping[str, Optional[str]]] = MappingProxyType({})
+
+
+@dataclass(frozen=True)
+class ParsedConfig:
+    path: Path
+    # Section and option names are lower case
+    sections: Mapping[str, Mapping[str, Optional[str]]]
+
+    def section(self, name: str) -> Mapping[str, Optional[str]]:
+        return self.sections.get(name.lower(), _EMPTY)
+
+    def has_option(self, section: str, option: str) -> bool:
+        return option.lower() in self.section(section)
+
+    def get(self, section: str, option: str) -> Optional[str]:
+        return self.section(section).get(option.lower())
+
+    def getboolean(self, section: str, option: str) -> bool:
+        value = self.get(section, option)
+        if (
+            value is None
+            or value.lower() not in configparser.ConfigParser.BOOLEAN_STATES
+        ):
+            raise ValueError("Not a boolean: {}".format(value))
+        return configparser.ConfigParser.BOOLEAN_STATES[value.lower()]
+
+    def steps(self, section: str, steps: Iterable[str]) -> dict[str, str]:
+        """The commands of the steps that are set in the section"""
+        return {
+            step: (self.get(section, step) or "").strip() + "\n"
+            for step in steps
+            if self.has_option(section, step)
+        }
+
+    def enabled_actions(self, section: str) -> dict[str, bool]:
+        """Actions without a value are enabled"""
+        return {
+            action: val is None or val.lower() in {"true"}
+            for action, val in self.section(section).items()
+        }
+
+
+_cache: dict[Path, tuple[Optional[tuple[int, int]], ParsedConfig]] = {}
+
+
+def load_config(path: Path) -> ParsedConfig:
+    """Returns the parsed config file, a missing file has no sections"""
+    version: Optional[tuple[int, int]] = None
+    try:
+        stat = os.stat(path)
+        if S_ISREG(stat.st_mode):
+            version = (stat.st_mtime_ns, stat.st_size)
+    except FileNotFoundError:
+        pass
+    cached = _cache.get(path)
+    if cached is not None and cached[0] == version:
+        return cached[1]
+    parsed = _parse(path) if version is not None else ParsedConfig(path, _EMPTY_FILE)
+    _cache[path] = (version, parsed)
+    return parsed
+
+
+def clear_cache() -> None:
+    _cache.clear()
+
+
+def _parse(path: Path) -> ParsedConfig:
+    config_file = configparser.ConfigParser(allow_no_value=True)
+    config_file.SECTCRE = CaseInsensitiveRe(
+        re.compile(r"\[ *(?P<header>[^]]+?) *]")
+    )  # type: ignore
+    config_file.read(path)
+    if not config_file.sections():
+        raise Exception("The Config for {} has no Sections".format(path))
+    sections = {
+        section: MappingProxyType(dict(config_file.items(section)))
+        for section in config_file.sections()
+    }
+    return ParsedConfig(path, MappingProxyType(sections))
@@ -0,0 +1,148 @@
+"""Compiled templates for the commands in the config files.
+A command is split into literal text and variable references once and can then
+be rendered for every container in a single pass."""
+
+from dataclasses import dataclass
+import functools
+import re
+from typing import Any, Iterable, Mapping, Pattern, Union
+
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+# How often variables in the values of other variables are resolved
+MAX_VAR_DEPTH = 10
+
+
+@dataclass(frozen=True)
+class VarRef:
+    name: str
+    # ".name" or ".path" as it is written in the command, or ""
+    attribute: str
+    text: str
+
+
+class Template:
+    def __init__(self, parts: tuple[Union[str, VarRef], ...]):
+        self.parts = parts
+        self.variables: frozenset[str] = frozenset(
+            p.name for p in parts if isinstance(p, VarRef)
+        )
+
+    def render(self, values: Mapping[str, Any]) -> str:
+        """Renders the template with the values of prepare_values.
+        Lines with a list variable are repeated for every element of the list,
+        every repetition ends with a newline."""
+        for part in self.parts:
+            if isinstance(part, VarRef) and isinstance(values[part.name], list):
+                bound = dict(values)
+                result: list[str] = []
+                for item in values[part.name]:
+                    bound[part.name] = item
+                    result.append(self.render(bound) + "\n")
+                return "".join(result)
+        return "".join(_render_part(part, values) for part in self.parts)
+
+    def render_scalars(self, values: Mapping[str, Any]) -> str:
+        """Renders the template, but keeps references to list variables"""
+        return "".join(
+            (
+                part.text
+                if isinstance(part, VarRef) and isinstance(values[part.name], list)
+                else _render_part(part, values)
+            )
+            for part in self.parts
+        )
+
+
+def _render_part(part: Union[str, VarRef], values: Mapping[str, Any]) -> str:
+    if isinstance(part, str):
+        return part
+    value = values[part.name]
+    if isinstance(value, Volume):
+        if part.attribute.lower() == ".name":
+            return value.name
+        return value.path
+    if isinstance(value, str):
+        return value + part.attribute
+    raise Exception("Illegal Type")
+
+
+@functools.lru_cache(maxsize=None)
+def _pattern(names: tuple[str, ...]) -> Pattern[str]:
+    # Longer names first, so that $tmpFolder isn't matched as $tmp
+    alternatives = "|".join(re.escape(n) for n in sorted(names, key=len, reverse=True))
+    return re.compile(
+        r"(?P<var>{})(?P<attribute>\.name|\.path)?".format(alternatives),
+        re.IGNORECASE,
+    )
+
+
+@functools.lru_cache(maxsize=4096)
+def compile_template(text: str, names: tuple[str, ...]) -> Template:
+    """Splits the text into literal parts and references to the variables.
+    :param names: the lower case names of all variables, including the $"""
+    if not names:
+        return Template((text,))
+    parts: list[Union[str, VarRef]] = []
+    position = 0
+    for match in _pattern(names).finditer(text):
+        if match.start() > position:
+            parts.append(text[position : match.start()])
+        parts.append(
+            VarRef(
+                match.group("var").lower(),
+                match.group("attribute") or "",
+                match.group(0),
+            )
+        )
+        position = match.end()
+    if position < len(text):
+        parts.append(text[position:])
+    return Template(tuple(parts))
+
+
+def prepare_values(variables: Mapping[str, Any]) -> dict[str, Any]:
+    """Returns the variables with lower case names, as they are used by the
+    templates. If names only differ in their case, the first one is used.
+    Variables in the values of other variables are resolved."""
+    values: dict[str, Any] = {}
+    for name, value in variables.items():
+        values.setdefault(name.lower(), value)
+    names = names_of(values)
+    for _ in range(MAX_VAR_DEPTH):
+        changed = False
+        for name, value in values.items():
+            if isinstance(value, str) and "$" in value:
+                template = compile_template(value, names)
+                if template.variables:
+                    resolved = template.render_scalars(values)
+                    changed = changed or resolved != value
+                    values[name] = resolved
+        if not changed:
+            break
+    return values
+
+
+def used_variables(
+    texts: Iterable[str], variables: Mapping[str, Any]
+) -> frozenset[str]:
+    """The lower case names of the variables that the texts use, directly or
+    in the values of other variables that they use"""
+    values: dict[str, Any] = {}
+    for name, value in variables.items():
+        values.setdefault(name.lower(), value)
+    names = names_of(values)
+    used: set[str] = set()
+    pending = list(texts)
+    while pending:
+        for name in compile_template(pending.pop(), names).variables:
+            if name not in used:
+                used.add(name)
+                value = values[name]
+                if isinstance(value, str) and "$" in value:
+                    pending.append(value)
+    return frozenset(used)
+
+
+def names_of(values: Mapping[str, Any]) -> tuple[str, ...]:
+    return tuple(sorted(values))
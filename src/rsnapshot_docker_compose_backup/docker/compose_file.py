@@ -0,0 +1,353 @@
+"""Reads compose projects directly from their files, so that the services and
+container names are known without starting docker compose.
+This needs PyYAML, without it every function raises a ComposeFileError and the
+caller has to fall back to the compose cli."""
+
+from dataclasses import dataclass, field
+import importlib
+import os
+from pathlib import Path
+import re
+from typing import Any, Mapping, Optional
+
+try:
+    yaml: Any = importlib.import_module("yaml")
+except ImportError:
+    yaml = None
+
+COMPOSE_FILES = [
+    "compose.yaml",
+    "compose.yml",
+    "docker-compose.yaml",
+    "docker-compose.yml",
+]
+COMPOSE_OVERRIDE_FILES = [
+    "compose.override.yaml",
+    "compose.override.yml",
+    "docker-compose.override.yaml",
+    "docker-compose.override.yml",
+]
+
+_NAME = re.compile(r"[A-Za-z_][A-Za-z0-9_]*")
+_INVALID_PROJECT_CHARS = re.compile(r"[^-_a-z0-9]+")
+
+
+class ComposeFileError(Exception):
+    pass
+
+
+@dataclass
+class ComposeService:
+    name: str
+    container_name: str
+    definition: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class ComposeProject:
+    name: str
+    directory: Path
+    services: dict[str, ComposeService]
+    # The resolved paths of all files that were read, also the included and
+    # extended ones
+    files: list[Path] = field(default_factory=list)
+
+
+def available() -> bool:
+    return yaml is not None
+
+
+def load_project(
+    directory: Path, environ: Optional[Mapping[str, str]] = None
+) -> ComposeProject:
+    """Loads the compose project in the directory like ``docker compose config``.
+    Only the services of active profiles are returned."""
+    if yaml is None:
+        raise ComposeFileError("PyYAML is not installed")
+    if environ is None:
+        environ = os.environ
+    env = parse_env_file(directory / ".env", environ)
+    env.update(environ)
+    model: dict[str, Any] = {}
+    read: list[Path] = []
+    for file in _project_files(directory, env):
+        model = merge(model, _load_file(file, env, [], read))
+    name = env.get("COMPOSE_PROJECT_NAME") or model.get("name")
+    if not name:
+        name = normalize_project_name(directory.resolve().name)
+    profiles = {p for p in env.get("COMPOSE_PROFILES", "").split(",") if p}
+    services: dict[str, ComposeService] = {}
+    for service_name, service in (model.get("services") or {}).items():
+        service = service or {}
+        service_profiles = service.get("profiles") or []
+        if service_profiles and not profiles.intersection(service_profiles):
+            continue
+        container_name = service.get("container_name") or "{}-{}-1".format(
+            name, service_name
+        )
+        services[service_name] = ComposeService(
+            service_name, str(container_name), service
+        )
+    return ComposeProject(str(name), directory, services, list(dict.fromkeys(read)))
+
+
+def normalize_project_name(name: str) -> str:
+    return _INVALID_PROJECT_CHARS.sub("", name.lower()).lstrip("-_")
+
+
+def _project_files(directory: Path, env: Mapping[str, str]) -> list[Path]:
+    if env.get("COMPOSE_FILE"):
+        separator = env.get("COMPOSE_PATH_SEPARATOR", os.pathsep)
+        return [directory / f for f in env["COMPOSE_FILE"].split(separator) if f]
+    files: list[Path] = []
+    for candidates in (COMPOSE_FILES, COMPOSE_OVERRIDE_FILES):
+        for candidate in candidates:
+            if (directory / candidate).is_file():
+                files.append(directory / candidate)
+                break
+    if not files:
+        raise ComposeFileError("No compose file in {}".format(directory))
+    return files
+
+
+def _read_yaml(file: Path, read: list[Path]) -> dict[str, Any]:
+    read.append(file.resolve())
+    try:
+        with open(file, encoding="UTF-8") as yaml_file:
+            content = yaml.safe_load(yaml_file)
+    except OSError as e:
+        raise ComposeFileError("Can't read {}: {}".format(file, e)) from e
+    except yaml.YAMLError as e:
+        raise ComposeFileError("Invalid yaml in {}: {}".format(file, e)) from e
+    if content is None:
+        return {}
+    if not isinstance(content, dict):
+        raise ComposeFileError("{} isn't a compose file".format(file))
+    return content
+
+
+def _load_file(
+    file: Path, env: Mapping[str, str], include_stack: list[Path], read: list[Path]
+) -> dict[str, Any]:
+    file = file.resolve()
+    if file in include_stack:
+        raise ComposeFileError("Include cycle with {}".format(file))
+    model: dict[str, Any] = interpolate_tree(_read_yaml(file, read), env)
+    services: dict[str, Any] = model.get("services") or {}
+    for service_name in list(services):
+        services[service_name] = _resolve_extends(
+            file, services, service_name, env, [], read
+        )
+    for include in model.pop("include", None) or []:
+        included = _load_include(file, include, env, include_stack + [file], read)
+        for service_name, service in (included.get("services") or {}).items():
+            if service_name in services:
+                raise ComposeFileError(
+                    "Service {} from an include conflicts in {}".format(
+                        service_name, file
+                    )
+                )
+            services[service_name] = service
+    model["services"] = services
+    return model
+
+
+def _load_include(
+    file: Path,
+    include: Any,
+    env: Mapping[str, str],
+    include_stack: list[Path],
+    read: list[Path],
+) -> dict[str, Any]:
+    if isinstance(include, str):
+        include = {"path": include}
+    paths = include.get("path")
+    if isinstance(paths, str):
+        paths = [paths]
+    if not paths:
+        raise ComposeFileError("Include without path in {}".format(file))
+    paths = [file.parent / p for p in paths]
+    project_directory = file.parent / include.get("project_directory", paths[0].parent)
+    env_files = include.get("env_file") or [project_directory / ".env"]
+    if isinstance(env_files, str):
+        env_files = [env_files]
+    # Variables of the including project take precedence
+    include_env: dict[str, str] = {}
+    for env_file in env_files:
+        read.append((file.parent / env_file).resolve())
+        include_env.update(parse_env_file(file.parent / env_file, env))
+    include_env.update(env)
+    model: dict[str, Any] = {}
+    for path in paths:
+        model = merge(model, _load_file(path, include_env, include_stack, read))
+    return model
+
+
+def _resolve_extends(
+    file: Path,
+    services: dict[str, Any],
+    service_name: str,
+    env: Mapping[str, str],
+    stack: list[tuple[Path, str]],
+    read: list[Path],
+) -> dict[str, Any]:
+    if service_name not in services:
+        raise ComposeFileError(
+            "Extended service {} doesn't exist in {}".format(service_name, file)
+        )
+    service: dict[str, Any] = services[service_name] or {}
+    extends = service.get("extends")
+    if extends is None:
+        return service
+    if (file, service_name) in stack:
+        raise ComposeFileError("Extends cycle with {}".format(service_name))
+    if isinstance(extends, str):
+        extends = {"service": extends}
+    base_file = file
+    base_services = services
+    if "file" in extends:
+        base_file = (file.parent / extends["file"]).resolve()
+        base_services = (
+            interpolate_tree(_read_yaml(base_file, read), env).get("services") or {}
+        )
+    base = _resolve_extends(
+        base_file,
+        base_services,
+        extends["service"],
+        env,
+        stack + [(file, service_name)],
+        read,
+    )
+    extended = {k: v for k, v in service.items() if k != "extends"}
+    return merge(base, extended)
+
+
+def merge(base: dict[str, Any], override: dict[str, Any]) -> dict[str, Any]:
+    """Merges two compose models: mappings are merged recursively and all other
+    values are replaced by the value of the override"""
+    result = dict(base)
+    for key, value in override.items():
+        if isinstance(value, dict) and isinstance(result.get(key), dict):
+            result[key] = merge(result[key], value)
+        else:
+            result[key] = value
+    return result
+
+
+def parse_env_file(file: Path, environ: Mapping[str, str]) -> dict[str, str]:
+    """Parses a .env file, the values can use the variables of the environment
+    and the variables that are defined before them"""
+    result: dict[str, str] = {}
+    if not file.is_file():
+        return result
+    with open(file, encoding="UTF-8") as env_file:
+        for line in env_file:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("export "):
+                line = line[len("export ") :].lstrip()
+            if "=" not in line:
+                continue
+            key, value = line.split("=", 1)
+            key = key.strip()
+            value = value.strip()
+            # Like in compose the environment takes precedence over the file
+            lookup = dict(result)
+            lookup.update(environ)
+            if len(value) >= 2 and value[0] == value[-1] == "'":
+                result[key] = value[1:-1]
+            elif len(value) >= 2 and value[0] == value[-1] == '"':
+                result[key] = interpolate(_unescape(value[1:-1]), lookup)
+            else:
+                if " #" in value:
+                    value = value[: value.index(" #")].rstrip()
+                result[key] = interpolate(value, lookup)
+    return result
+
+
+def _unescape(value: str) -> str:
+    escapes = {"n": "\n", "t": "\t", "r": "\r", '"': '"', "\\": "\\"}
+    return re.sub(r"\\(.)", lambda m: escapes.get(m.group(1), m.group(0)), value)
+
+
+def interpolate_tree(value: Any, env: Mapping[str, str]) -> Any:
+    if isinstance(value, str):
+        return interpolate(value, env)
+    if isinstance(value, dict):
+        return {k: interpolate_tree(v, env) for k, v in value.items()}
+    if isinstance(value, list):
+        return [interpolate_tree(v, env) for v in value]
+    return value
+
+
+def interpolate(value: str, env: Mapping[str, str]) -> str:
+    """Replaces $VAR and ${VAR} with the modifiers that compose supports
+    (:-, -, :+, +, :?, ?). $$ is an escaped $."""
+    result: list[str] = []
+    index = 0
+    while index < len(value):
+        char = value[index]
+        if char != "$":
+            result.append(char)
+            index += 1
+        elif value.startswith("$$", index):
+            result.append("$")
+            index += 2
+        elif value.startswith("${", index):
+            end = _closing_brace(value, index + 2)
+            result.append(_substitute(value[index + 2 : end], env))
+            index = end + 1
+        else:
+            name = _NAME.match(value, index + 1)
+            if name:
+                result.append(env.get(name.group(0), ""))
+                index = name.end()
+            else:
+                result.append(char)
+                index += 1
+    return "".join(result)
+
+
+def _closing_brace(value: str, start: int) -> int:
+    depth = 1
+    index = start
+    while index < len(value):
+        if value.startswith("${", index):
+            depth += 1
+            index += 2
+            continue
+        if value[index] == "}":
+            depth -= 1
+            if depth == 0:
+                return index
+        index += 1
+    raise ComposeFileError("Invalid interpolation format in {}".format(value))
+
+
+def _substitute(expression: str, env: Mapping[str, str]) -> str:
+    name_match = _NAME.match(expression)
+    if not name_match:
+        raise ComposeFileError(
+            "Invalid interpolation format ${{{}}}".format(expression)
+        )
+    name = name_match.group(0)
+    rest = expression[name_match.end() :]
+    value = env.get(name)
+    if not rest:
+        return value or ""
+    for operator in (":-", "-", ":+", "+", ":?", "?"):
+        if not rest.startswith(operator):
+            continue
+        argument = interpolate(rest[len(operator) :], env)
+        unset = value is None or (operator.startswith(":") and value == "")
+        if operator.endswith("-"):
+            return argument if unset else str(value)
+        if operator.endswith("+"):
+            return "" if unset else argument
+        if unset:
+            raise ComposeFileError(
+                "Required variable {} is missing a value: {}".format(name, argument)
+            )
+        return str(value)
+    raise ComposeFileError("Invalid interpolation format ${{{}}}".format(expression))
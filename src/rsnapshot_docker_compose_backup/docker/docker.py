@@ -1,21 +1,331 @@
+import asyncio
+from dataclasses import dataclass, field
+import http.client
 import json
 import re
 from typing import Any, Optional
 
-from rsnapshot_docker_compose_backup.utils import command
+from rsnapshot_docker_compose_backup import global_values
+from rsnapshot_docker_compose_backup.docker import engine_api, host
+from rsnapshot_docker_compose_backup.docker.engine_api import (
+    EngineApiClient,
+    EngineApiError,
+)
+from rsnapshot_docker_compose_backup.utils import async_command, command
 from rsnapshot_docker_compose_backup.structure.volume import Volume
 
+COMPOSE_PROJECT_LABEL = "com.docker.compose.project"
+COMPOSE_SERVICE_LABEL = "com.docker.compose.service"
+COMPOSE_WORKING_DIR_LABEL = "com.docker.compose.project.working_dir"
+COMPOSE_CONTAINER_NUMBER_LABEL = "com.docker.compose.container-number"
+COMPOSE_ONEOFF_LABEL = "com.docker.compose.oneoff"
+COMPOSE_LABELS = [
+    COMPOSE_PROJECT_LABEL,
+    COMPOSE_SERVICE_LABEL,
+    COMPOSE_WORKING_DIR_LABEL,
+    COMPOSE_CONTAINER_NUMBER_LABEL,
+    COMPOSE_ONEOFF_LABEL,
+]
+
+# "{{json .}}" would return the labels as one comma separated string,
+# so the needed labels are queried one by one
+PS_FORMAT = (
+    '{"ID":{{json .ID}},"Names":{{json .Names}},"Image":{{json .Image}},'
+    '"Status":{{json .Status}},"State":{{json .State}},'
+    '"CreatedAt":{{json .CreatedAt}},"Labels":{'
+    + ",".join(
+        '"{0}":{{{{json (.Label "{0}")}}}}'.format(label) for label in COMPOSE_LABELS
+    )
+    + "}}"
+)
+
+
+PS_COMMAND = [
+    "docker",
+    "ps",
+    "-a",
+    "--no-trunc",
+    "--filter",
+    "label={}".format(COMPOSE_PROJECT_LABEL),
+    "--format",
+    PS_FORMAT,
+]
+
+
+@dataclass
+class ContainerState:
+    container_id: str
+    name: str
+    image: str
+    status: str
+    state: str = ""
+    created: str = ""
+    labels: dict[str, str] = field(default_factory=dict)
+    info: Any = None
+
+    @property
+    def running(self) -> bool:
+        return not self.status.startswith("Exited")
+
+
+class Fleet:
+    """Index of all compose containers on the host, built from one ``docker ps``
+    call (or the same query over the Engine API), so that per container queries
+    don't need to start the docker cli again.
+    The inspect data is only loaded when it is needed, with one batched
+    ``docker inspect`` call for all containers."""
+
+    short_id_length = 12
+
+    def __init__(self, containers: list[ContainerState]):
+        self.containers: dict[str, ContainerState] = {}
+        self._short_ids: dict[str, ContainerState] = {}
+        # If the fleet replaced one that missed a container, it isn't
+        # reloaded again then
+        self.reloaded = False
+        # The ids that aren't in the fleet
+        self.misses: set[str] = set()
+        for container in containers:
+            self.containers[container.container_id] = container
+            self._short_ids[container.container_id[: self.short_id_length]] = container
+
+    def get(self, container_id: str) -> Optional[ContainerState]:
+        if container_id in self.containers:
+            return self.containers[container_id]
+        container = self._short_ids.get(container_id[: self.short_id_length])
+        if container and container.container_id.startswith(container_id):
+            return container
+        return None
+
+    def info(self, container_id: str) -> Any:
+        container = self.get(container_id)
+        if container is None:
+            return None
+        if container.info is None:
+            # Stopped containers are usually skipped, so running containers
+            # are inspected without them and the other way round
+            self._inspect_all(container.running)
+        return container.info
+
+    def pending(self, running: Optional[bool] = None) -> list[ContainerState]:
+        """All containers that weren't inspected yet, or only the running or
+        the stopped ones"""
+        return [
+            c
+            for c in self.containers.values()
+            if c.info is None and (running is None or c.running == running)
+        ]
+
+    def _inspect_all(self, running: Optional[bool] = None) -> None:
+        pending = self.pending(running)
+        if not pending or self._inspect_with_api(pending):
+            return
+        self._apply_inspect(
+            pending,
+            command(["docker", "inspect", *[c.container_id for c in pending]]).stdout,
+        )
+
+    async def inspect_async(self, limit: Optional[asyncio.Semaphore] = None) -> None:
+        pending = self.pending()
+        if not pending or self._inspect_with_api(pending):
+            return
+        result = await async_command(
+            ["docker", "inspect", *[c.container_id for c in pending]], limit=limit
+        )
+        self._apply_inspect(pending, result.stdout)
+
+    @staticmethod
+    def _inspect_with_api(pending: list[ContainerState]) -> bool:
+        client = api()
+        if client is None:
+            return False
+        for container in pending:
+            try:
+                container.info = client.inspect(container.container_id)
+            except EngineApiError as e:
+                # The container was removed after it was listed
+                if e.status != 404:
+                    raise
+        return True
+
+    @staticmethod
+    def _apply_inspect(pending: list[ContainerState], stdout: str) -> None:
+        inspected: dict[str, Any] = {}
+        for info in json.loads(stdout or "[]"):
+            inspected[info["Id"]] = info
+        for container in pending:
+            container.info = inspected.get(container.container_id)
+
+    @staticmethod
+    def load() -> "Fleet":
+        fleet_from_api = Fleet._try_load_from_api()
+        if fleet_from_api is not None:
+            return fleet_from_api
+        return Fleet._from_ps(command(PS_COMMAND).stdout)
+
+    @staticmethod
+    async def load_async(limit: Optional[asyncio.Semaphore] = None) -> "Fleet":
+        fleet_from_api = Fleet._try_load_from_api()
+        if fleet_from_api is not None:
+            return fleet_from_api
+        return Fleet._from_ps((await async_command(PS_COMMAND, limit=limit)).stdout)
+
+    @staticmethod
+    def _try_load_from_api() -> Optional["Fleet"]:
+        client = api()
+        if client is None:
+            return None
+        try:
+            return Fleet._load_from_api(client)
+        except (OSError, http.client.HTTPException, EngineApiError):
+            if global_values.docker_backend == "api":
+                raise
+            _disable_api()
+        return None
+
+    @staticmethod
+    def _from_ps(stdout: str) -> "Fleet":
+        containers: list[ContainerState] = []
+        for line in stdout.splitlines():
+            if not line.strip():
+                continue
+            entry = json.loads(line)
+            containers.append(
+                ContainerState(
+                    container_id=entry["ID"],
+                    name=entry["Names"].split(",")[0],
+                    image=entry["Image"],
+                    status=entry["Status"],
+                    state=entry["State"],
+                    created=entry["CreatedAt"],
+                    labels={k: v for k, v in entry["Labels"].items() if v},
+                )
+            )
+        return Fleet(containers)
+
+    @staticmethod
+    def _load_from_api(client: EngineApiClient) -> "Fleet":
+        containers: list[ContainerState] = []
+        for entry in client.containers(labels=[COMPOSE_PROJECT_LABEL]):
+            containers.append(
+                ContainerState(
+                    container_id=entry["Id"],
+                    name=entry["Names"][0].lstrip("/"),
+                    image=entry["Image"],
+                    status=entry["Status"],
+                    state=entry["State"],
+                    created=str(entry["Created"]),
+                    labels=entry.get("Labels") or {},
+                )
+            )
+        return Fleet(containers)
+
+
+@dataclass
+class _HostState:
+    fleet: Optional[Fleet] = None
+    api_client: Optional[EngineApiClient] = None
+    api_available: Optional[bool] = None
+
+
+# The state of every docker host, the default host has the key None
+_states: dict[Optional[str], _HostState] = {}
+
+
+def _state() -> _HostState:
+    return _states.setdefault(host.key(), _HostState())
+
+
+def api() -> Optional[EngineApiClient]:
+    """Returns the shared Engine API client or None if the cli should be used"""
+    state = _state()
+    if global_values.docker_backend == "cli" or state.api_available is False:
+        return None
+    if state.api_client is None:
+        path = engine_api.socket_path(host.environment())
+        if path is None:
+            if global_values.docker_backend == "api":
+                raise Exception("The Docker Engine API is only supported for sockets")
+            state.api_available = False
+            return None
+        state.api_client = EngineApiClient(path)
+    if state.api_available is None:
+        state.api_available = state.api_client.ping()
+        if not state.api_available and global_values.docker_backend == "api":
+            raise Exception(
+                "Can't connect to the docker socket {}".format(
+                    state.api_client.socket_path
+                )
+            )
+    return state.api_client if state.api_available else None
+
+
+def _disable_api() -> None:
+    _state().api_available = False
+
+
+def reset_api() -> None:
+    state = _state()
+    if state.api_client is not None:
+        state.api_client.close()
+    state.api_client = None
+    state.api_available = None
+
+
+def fleet() -> Fleet:
+    state = _state()
+    if state.fleet is None:
+        state.fleet = Fleet.load()
+    return state.fleet
+
+
+async def fleet_async(limit: Optional[asyncio.Semaphore] = None) -> Fleet:
+    state = _state()
+    if state.fleet is None:
+        state.fleet = await Fleet.load_async(limit)
+    return state.fleet
+
+
+def reset_fleet() -> None:
+    _state().fleet = None
+
+
+def container_state(container_id: str) -> Optional[ContainerState]:
+    current = fleet()
+    if container_id in current.misses:
+        return None
+    state = current.get(container_id)
+    if state is None and not current.reloaded:
+        # The container could have been created after the snapshot was taken,
+        # the fleet is reloaded once for all missing containers
+        reset_fleet()
+        current = fleet()
+        current.reloaded = True
+        state = current.get(container_id)
+    if state is None:
+        current.misses.add(container_id)
+    return state
+
 
 def inspect(container: str) -> Any:
+    state = container_state(container)
+    if state is not None:
+        info = fleet().info(state.container_id)
+        if info is not None:
+            return info
+    client = api()
+    if client is not None:
+        return client.inspect(container)
     # converts docker inspect to json and return only first container,
     # because this works only with one container
     return json.loads(command("docker inspect {}".format(container)).stdout)[0]
 
 
 def ps(container_id: Optional[str] = None) -> str:
+    # The table output only exists in the cli, so this always uses it
     result = command("docker ps -a").stdout
     if container_id:
-        for line in ps().splitlines():
+        for line in result.splitlines():
             if line.startswith(container_id[:11]):
                 return line
         return ""
@@ -36,5 +346,23 @@ def get_column(column_nr: int, input_str: str) -> str:
 
 
 def image(container_id: str) -> str:
+    state = container_state(container_id)
+    if state is not None:
+        return state.image
+    client = api()
+    if client is not None:
+        return str(client.inspect(container_id)["Config"]["Image"])
     container_info: str = ps(container_id)
     return get_column(1, container_info)
+
+
+def image_id(container_id: str) -> str:
+    """The id of the image of the container, the hex digest of its config"""
+    return str(inspect(container_id)["Image"]).split(":", 1)[-1]
+
+
+def running(container_id: str) -> bool:
+    state = container_state(container_id)
+    if state is None:
+        return False
+    return state.running
@@ -1,17 +1,43 @@
 #!/usr/bin/env python3
 
+import asyncio
 from dataclasses import dataclass
 import os
 from pathlib import Path
 import re
-from concurrent import futures
+import functools
 import json
-from typing import Optional
+from typing import Any, Iterator, Optional, Union
 
+from rsnapshot_docker_compose_backup import global_values, metrics
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache, hash_files
+from rsnapshot_docker_compose_backup.docker import compose_file, docker
+from rsnapshot_docker_compose_backup.docker.compose_file import (
+    COMPOSE_FILES,
+    COMPOSE_OVERRIDE_FILES,
+)
+from rsnapshot_docker_compose_backup.scanner import ScanOptions, find_compose_dirs
 from rsnapshot_docker_compose_backup.structure.container import Container
-from rsnapshot_docker_compose_backup.utils import command
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+from rsnapshot_docker_compose_backup.utils import async_command, command
 
+# How many docker commands can run at the same time during the discovery
+DEFAULT_JOBS = 8
+# Compose files that mention these can depend on files outside of the project
+REFERENCE_KEYWORDS = [b"include", b"extends"]
 
+
+@dataclass
+class ContainerInfo:
+    service_name: str
+    container_name: str
+    container_id: str
+    image: Optional[str] = None
+    volumes: Optional[list[Volume]] = None
+    image_id: Optional[str] = None
+
+
+@functools.lru_cache(maxsize=None)
 def get_binary() -> str:
     if command("docker compose").returncode == 0:
         return "docker compose"
@@ -21,95 +47,379 @@ def get_binary() -> str:
     raise Exception("Docker Compose is not installed")
 
 
-def get_container_id(service_name: str, path: Path) -> str:
-    return command(
-        "{} ps --all -q {}".format(get_binary(), service_name), path=path
-    ).stdout[:12]
+async def get_container_id(
+    service_name: str, path: Path, limit: Optional[asyncio.Semaphore] = None
+) -> str:
+    result = await async_command(
+        "{} ps --all -q {}".format(get_binary(), service_name), path=path, limit=limit
+    )
+    return result.stdout[:12]
 
 
-def get_container_name(service_name: str, path: Path) -> str:
-    stdout = command(
+async def get_container_name(
+    service_name: str, path: Path, limit: Optional[asyncio.Semaphore] = None
+) -> str:
+    result = await async_command(
         "{} config --format json {}".format(get_binary(), service_name),
         path=path,
-    ).stdout
-    # print(f"stdout: {stdout} (End)")
-    return str(json.loads(stdout)["services"][service_name]["container_name"])
+        limit=limit,
+    )
+    return str(json.loads(result.stdout)["services"][service_name]["container_name"])
 
 
 def container_stopped(container_id: str) -> bool:
-    status = command(
-        [
-            "docker",
-            "ps",
-            "-a",
-            "--format",
-            "{{ .Status }}",
-            "-f",
-            f"id={container_id}",
-        ]
-    )
-    # print(status.stdout)
-    return status.stdout.startswith("Exited")
-
-
-def find_container(root_folder: Path) -> list[Container]:
-    all_container: list[Container] = []
-    docker_dirs: list[Path] = find_docker_dirs(root_folder)
-    with futures.ProcessPoolExecutor() as pool:
-        for service_list, directory in pool.map(get_services, docker_dirs):
-            # container_list: list[str] = get_services(output)
-            for container_info in service_list:
-                if container_info.container_id:
-                    all_container.append(
-                        Container(
-                            folder=directory,
-                            service_name=container_info.service_name,
-                            container_name=container_info.container_name,
-                            container_id=container_info.container_id,
-                            running=not container_stopped(container_info.container_id),
-                        )
-                    )
-    return all_container
+    return not docker.running(container_id)
 
 
 @dataclass
-class ContainerInfo:
-    service_name: str
-    container_name: str
-    container_id: str
+class ProjectInfo:
+    directory: Path
+    services: list[ContainerInfo]
+    # The key for the cache, if the services weren't read from it
+    cache_key: Optional[str] = None
 
 
-def get_services(path: Path) -> tuple[list[ContainerInfo], Path]:
-    service_name: list[str] = command(
-        "{} config --services".format(get_binary()), path=path
-    ).stdout.splitlines()
-    # Docker doesn't return it always in the same order
-    service_name.sort()
-    # print(service_name)
+def find_container(
+    root_folder: Path,
+    cache: Optional[DiscoveryCache] = None,
+    jobs: int = DEFAULT_JOBS,
+    scan_options: Optional[ScanOptions] = None,
+    dir_index: Optional[DiscoveryCache] = None,
+) -> list[Container]:
+    return list(iter_container(root_folder, cache, jobs, scan_options, dir_index))
+
+
+def iter_container(
+    root_folder: Path,
+    cache: Optional[DiscoveryCache] = None,
+    jobs: int = DEFAULT_JOBS,
+    scan_options: Optional[ScanOptions] = None,
+    dir_index: Optional[DiscoveryCache] = None,
+) -> Iterator[Container]:
+    """Yields the containers below the root folder one by one, in the order of
+    the docker dirs and services. The discovery itself needs only a few docker
+    calls and runs first, the containers are created while they are consumed."""
+    with metrics.span("discovery"):
+        projects = asyncio.run(
+            discover_projects_async(root_folder, cache, jobs, scan_options, dir_index)
+        )
+    for project in projects:
+        yield from project_containers(project, cache)
+
+
+def project_containers(
+    project: ProjectInfo, cache: Optional[DiscoveryCache] = None
+) -> Iterator[Container]:
+    """Yields the containers of the project and caches its services"""
+    project_container: list[Container] = []
+    for container_info in project.services:
+        if container_info.container_id:
+            with metrics.span("container", project=str(project.directory)):
+                container = Container(
+                    folder=project.directory,
+                    service_name=container_info.service_name,
+                    container_name=container_info.container_name,
+                    container_id=container_info.container_id,
+                    running=not container_stopped(container_info.container_id),
+                    image=container_info.image,
+                    volumes=container_info.volumes,
+                    image_id=container_info.image_id,
+                )
+            project_container.append(container)
+            yield container
+    if cache is not None and project.cache_key is not None:
+        cache.put(
+            str(project.directory),
+            project.cache_key,
+            _services_to_cache(project.services, project_container),
+        )
+
+
+async def discover_projects_async(
+    root_folder: Path,
+    cache: Optional[DiscoveryCache] = None,
+    jobs: int = DEFAULT_JOBS,
+    scan_options: Optional[ScanOptions] = None,
+    dir_index: Optional[DiscoveryCache] = None,
+) -> list[ProjectInfo]:
+    """Discovers the services of all projects below the root folder.
+    Independent steps run concurrently, but at most jobs commands at once.
+    The projects are returned in the order of the docker dirs."""
+    limit = asyncio.Semaphore(jobs)
+    loop = asyncio.get_running_loop()
+    docker_dirs, _ = await asyncio.gather(
+        loop.run_in_executor(
+            None, find_docker_dirs, root_folder, scan_options, dir_index
+        ),
+        docker.fleet_async(limit),
+    )
+    return await discover_dirs_async(docker_dirs, cache, limit)
+
+
+async def discover_dirs_async(
+    docker_dirs: list[Path],
+    cache: Optional[DiscoveryCache] = None,
+    limit: Optional[asyncio.Semaphore] = None,
+) -> list[ProjectInfo]:
+    """Discovers the services of the docker dirs, in their order"""
+    await docker.fleet_async(limit)
+    keys: dict[Path, str] = {}
+    cached: dict[Path, list[ContainerInfo]] = {}
+    if cache is not None:
+        for directory in docker_dirs:
+            keys[directory] = project_fingerprint(directory)
+            entry = cache.get(str(directory), keys[directory])
+            if entry is not None:
+                cached[directory] = [_info_from_cache(info) for info in entry]
+    discovered = await discover_services_async(
+        [d for d in docker_dirs if d not in cached], limit
+    )
+    projects: list[ProjectInfo] = []
+    for directory in docker_dirs:
+        if directory in cached:
+            projects.append(ProjectInfo(directory, cached[directory]))
+        else:
+            projects.append(
+                ProjectInfo(directory, discovered[directory], keys.get(directory))
+            )
+    return projects
+
+
+def project_fingerprint(directory: Path) -> str:
+    """The key of the cached discovery results of a project.
+    It changes if one of the files that define the project changes, also the
+    included and extended ones, or if a container of the project is recreated
+    or changes its state."""
+    containers = sorted(
+        "{} {} {}".format(state.container_id, state.created, state.state)
+        for state in docker.fleet().containers.values()
+        if _project_key(state.labels.get(docker.COMPOSE_WORKING_DIR_LABEL, ""))
+        == _project_key(directory)
+    )
+    files = [
+        directory / name
+        for name in COMPOSE_FILES + COMPOSE_OVERRIDE_FILES + [".env", "backup.ini"]
+    ]
+    return hash_files(files + referenced_files(directory, files), containers)
+
+
+def referenced_files(directory: Path, files: list[Path]) -> list[Path]:
+    """The files that the compose files of the project include or extend and
+    that aren't in the files already. Only compose files that mention include
+    or extends are parsed, the references can't be found without PyYAML."""
+    names = COMPOSE_FILES + COMPOSE_OVERRIDE_FILES
+    if not any(_has_references(f) for f in files if f.name in names):
+        return []
+    try:
+        project = compose_file.load_project(directory)
+    except compose_file.ComposeFileError:
+        return []
+    known = {file.resolve() for file in files}
+    return sorted(file for file in project.files if file not in known)
+
+
+def _has_references(file: Path) -> bool:
+    try:
+        content = file.read_bytes()
+    except OSError:
+        return False
+    return any(keyword in content for keyword in REFERENCE_KEYWORDS)
+
+
+def _services_to_cache(
+    service_list: list[ContainerInfo], project_container: list[Container]
+) -> list[dict[str, Any]]:
+    container_by_id = {c.container_id: c for c in project_container}
+    result: list[dict[str, Any]] = []
+    for info in service_list:
+        entry: dict[str, Any] = {
+            "service_name": info.service_name,
+            "container_name": info.container_name,
+            "container_id": info.container_id,
+        }
+        container = container_by_id.get(info.container_id)
+        # Only the results that were looked up are cached, the others are
+        # looked up when a later run needs them
+        if container is not None and container.loaded_image is not None:
+            entry["image"] = container.loaded_image
+        if container is not None and container.loaded_volumes is not None:
+            entry["volumes"] = [[v.name, v.path] for v in container.loaded_volumes]
+        if container is not None and container.image_id is not None:
+            entry["image_id"] = container.image_id
+        result.append(entry)
+    return result
+
+
+def _info_from_cache(entry: dict[str, Any]) -> ContainerInfo:
+    volumes: Optional[list[Volume]] = None
+    if "volumes" in entry:
+        volumes = [Volume(name, path) for name, path in entry["volumes"]]
+    return ContainerInfo(
+        entry["service_name"],
+        entry["container_name"],
+        entry["container_id"],
+        image=entry.get("image"),
+        volumes=volumes,
+        image_id=entry.get("image_id"),
+    )
+
+
+async def discover_services_async(
+    docker_dirs: list[Path], limit: Optional[asyncio.Semaphore] = None
+) -> dict[Path, list[ContainerInfo]]:
+    """Returns the services of all docker dirs.
+    In the labels discovery mode the services are read from the compose files
+    and the containers are found by their labels. If the compose files can't be
+    read, the services are read from the labels of the existing containers.
+    The compose cli is only used for projects that can't be read in either way."""
+    result: dict[Path, list[ContainerInfo]] = {}
+    cli_dirs: list[Path] = []
+    loop = asyncio.get_running_loop()
+    if global_values.discovery == "labels" and docker_dirs:
+        labelled = get_labelled_services()
+        by_project = _group_containers(docker.COMPOSE_PROJECT_LABEL)
+        parsed = await asyncio.gather(
+            *[
+                loop.run_in_executor(None, get_parsed_services, d, by_project)
+                for d in docker_dirs
+            ]
+        )
+        for directory, services in zip(docker_dirs, parsed):
+            if services is None:
+                services = labelled.get(_project_key(directory))
+            if services is None:
+                cli_dirs.append(directory)
+            else:
+                result[directory] = services
+    else:
+        cli_dirs = docker_dirs
+    if cli_dirs:
+        # Find the compose binary once before the projects are queried in parallel
+        await loop.run_in_executor(None, get_binary)
+        for service_list, directory in await asyncio.gather(
+            *[get_services(d, limit) for d in cli_dirs]
+        ):
+            result[directory] = service_list
+    return result
+
+
+def get_parsed_services(
+    path: Path, by_project: dict[str, dict[str, docker.ContainerState]]
+) -> Optional[list[ContainerInfo]]:
+    """Reads the services from the compose files of the project.
+    :returns: the services or None if the compose files can't be read"""
+    if not compose_file.available():
+        return None
+    try:
+        with metrics.span("parse_compose", project=str(path)):
+            project = compose_file.load_project(path)
+    except compose_file.ComposeFileError:
+        return None
+    containers = by_project.get(project.name, {})
+    services: list[ContainerInfo] = []
+    for service_name in sorted(project.services):
+        container_id = ""
+        if service_name in containers:
+            container_id = containers[service_name].container_id[
+                : docker.Fleet.short_id_length
+            ]
+        services.append(
+            ContainerInfo(
+                service_name,
+                project.services[service_name].container_name,
+                container_id,
+            )
+        )
+    return services
+
+
+def get_labelled_services() -> dict[str, list[ContainerInfo]]:
+    """Groups all compose containers by the working dir of their project and
+    their service, using only the labels that compose adds to the containers.
+    :returns: the services of every project, keyed by the resolved working dir"""
+    return {
+        key: _container_infos(project)
+        for key, project in _group_containers(docker.COMPOSE_WORKING_DIR_LABEL).items()
+    }
+
+
+def _container_infos(project: dict[str, docker.ContainerState]) -> list[ContainerInfo]:
+    return [
+        ContainerInfo(
+            name,
+            project[name].name,
+            project[name].container_id[: docker.Fleet.short_id_length],
+        )
+        for name in sorted(project)
+    ]
+
+
+def _group_containers(
+    project_label: str,
+) -> dict[str, dict[str, docker.ContainerState]]:
+    """Groups the compose containers by the value of the project label and
+    their service. Working dirs are resolved, so that they can be compared."""
+    projects: dict[str, dict[str, docker.ContainerState]] = {}
+    numbers: dict[str, int] = {}
+    for state in docker.fleet().containers.values():
+        labels = state.labels
+        if project_label not in labels or docker.COMPOSE_SERVICE_LABEL not in labels:
+            continue
+        if labels.get(docker.COMPOSE_ONEOFF_LABEL, "False") == "True":
+            # Containers of "docker compose run" aren't part of the service
+            continue
+        project_key = labels[project_label]
+        if project_label == docker.COMPOSE_WORKING_DIR_LABEL:
+            project_key = _project_key(project_key)
+        project = projects.setdefault(project_key, {})
+        service_name = labels[docker.COMPOSE_SERVICE_LABEL]
+        number = int(labels.get(docker.COMPOSE_CONTAINER_NUMBER_LABEL, "1") or "1")
+        if (
+            service_name in project
+            and numbers[project[service_name].container_id] <= number
+        ):
+            # Scaled services are represented by their first container
+            continue
+        project[service_name] = state
+        numbers[state.container_id] = number
+    return projects
+
+
+def _project_key(path: Union[Path, str]) -> str:
+    return os.path.realpath(path)
+
+
+async def get_services(
+    path: Path, limit: Optional[asyncio.Semaphore] = None
+) -> tuple[list[ContainerInfo], Path]:
+    with metrics.span("get_services", concurrent=True, project=str(path)):
+        result = await async_command(
+            "{} config --services".format(get_binary()), path=path, limit=limit
+        )
+        service_name: list[str] = result.stdout.splitlines()
+        # Docker doesn't return it always in the same order
+        service_name.sort()
+        container_ids, container_names = await asyncio.gather(
+            asyncio.gather(*[get_container_id(s, path, limit) for s in service_name]),
+            asyncio.gather(*[get_container_name(s, path, limit) for s in service_name]),
+        )
     services: list[ContainerInfo] = []
-    for service in service_name:
-        container_id = get_container_id(service, path)
-        container_name = get_container_name(service, path)
+    for service, container_id, container_name in zip(
+        service_name, container_ids, container_names
+    ):
         services.append(ContainerInfo(service, container_name, container_id))
     return services, path
 
 
-def find_docker_dirs(root_folder: Path = Path(os.getcwd())) -> list[Path]:
+def find_docker_dirs(
+    root_folder: Path = Path(os.getcwd()),
+    options: Optional[ScanOptions] = None,
+    index: Optional[DiscoveryCache] = None,
+) -> list[Path]:
     """Finds all docker-compose dirs in current sub folder
-    :returns: a list of all folders"""
-    dirs: list[Path] = []
-    docker_compose_files = [
-        "compose.yaml",
-        "compose.yml",
-        "docker-compose.yaml",
-        "docker-compose.yml",
-    ]
-    for tree_element in os.walk(root_folder):
-        for docker_compose_file in docker_compose_files:
-            if docker_compose_file in tree_element[2]:
-                dirs.append(Path(tree_element[0]))
-                break
-    return dirs
+    :returns: a sorted list of all folders"""
+    with metrics.span("find_docker_dirs"):
+        return find_compose_dirs(root_folder, options, index)
 
 
 def get_running_container(ps_out: str) -> list[str]:
@@ -0,0 +1,93 @@
+import http.client
+import json
+import os
+import socket
+from typing import Any, Mapping, Optional
+from urllib.parse import quote, urlencode
+
+DEFAULT_SOCKET = "/var/run/docker.sock"
+
+
+class EngineApiError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__("Docker Engine API returned {}: {}".format(status, message))
+        self.status = status
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """HTTP connection that talks to a unix socket instead of a tcp port"""
+
+    def __init__(self, socket_path: str, timeout: float = 60):
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self) -> None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.settimeout(self.timeout)
+        sock.connect(self.socket_path)
+        self.sock = sock
+
+
+class EngineApiClient:
+    """Minimal client for the Docker Engine API.
+    The connection is kept alive and reused for all requests."""
+
+    def __init__(self, socket_path: str = DEFAULT_SOCKET, timeout: float = 60):
+        self.socket_path = socket_path
+        self._connection = UnixHTTPConnection(socket_path, timeout=timeout)
+
+    def get(self, path: str, query: Optional[dict[str, str]] = None) -> Any:
+        url = path
+        if query:
+            url += "?" + urlencode(query)
+        try:
+            response = self._request(url)
+        except (http.client.RemoteDisconnected, BrokenPipeError, ConnectionResetError):
+            # The daemon closed the idle keep-alive connection, retry once
+            self._connection.close()
+            response = self._request(url)
+        body = response.read()
+        if response.status != 200:
+            raise EngineApiError(response.status, body.decode(errors="replace"))
+        return json.loads(body)
+
+    def ping(self) -> bool:
+        try:
+            response = self._request("/_ping")
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self._connection.close()
+            return False
+        return response.status == 200
+
+    def _request(self, url: str) -> http.client.HTTPResponse:
+        self._connection.request("GET", url, headers={"Connection": "keep-alive"})
+        return self._connection.getresponse()
+
+    def containers(self, labels: Optional[list[str]] = None) -> list[Any]:
+        query = {"all": "1"}
+        if labels:
+            query["filters"] = json.dumps({"label": labels})
+        result: list[Any] = self.get("/containers/json", query)
+        return result
+
+    def inspect(self, container: str) -> Any:
+        return self.get("/containers/{}/json".format(quote(container, safe="")))
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def socket_path(environment: Optional[Mapping[str, str]] = None) -> Optional[str]:
+    """Returns the socket of the local daemon or None if the docker cli is
+    configured to talk to another daemon (e.g. with DOCKER_HOST or a context)"""
+    if environment is None:
+        environment = os.environ
+    if environment.get("DOCKER_CONTEXT"):
+        return None
+    host = environment.get("DOCKER_HOST")
+    if host is None:
+        return DEFAULT_SOCKET
+    if host.startswith("unix://"):
+        return host[len("unix://") :]
+    return None
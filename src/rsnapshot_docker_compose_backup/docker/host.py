@@ -0,0 +1,113 @@
+"""The docker host that the docker commands of the current task talk to.
+Without a host the docker cli uses its own configuration, e.g. DOCKER_HOST or
+the current context. The host is kept in a context variable, so concurrent
+asyncio tasks can each discover another host."""
+
+import contextlib
+import contextvars
+from dataclasses import dataclass
+import os
+from pathlib import Path
+from typing import Iterator, Optional
+from urllib.parse import urlparse
+
+
+@dataclass(frozen=True)
+class DockerHost:
+    name: str
+    # The compose root on that host
+    root: Path
+    # A docker context or a DOCKER_HOST url, without both the cli default is used
+    context: Optional[str] = None
+    docker_host: Optional[str] = None
+    # user@host for rsync, backup sources on this host are read over ssh
+    ssh: Optional[str] = None
+
+    def environment(self) -> dict[str, str]:
+        """The environment of the docker commands for this host"""
+        environment = dict(os.environ)
+        if self.context is not None:
+            environment.pop("DOCKER_HOST", None)
+            environment["DOCKER_CONTEXT"] = self.context
+        elif self.docker_host is not None:
+            environment.pop("DOCKER_CONTEXT", None)
+            environment["DOCKER_HOST"] = self.docker_host
+        return environment
+
+
+_current: "contextvars.ContextVar[Optional[DockerHost]]" = contextvars.ContextVar(
+    "docker_host", default=None
+)
+
+
+def parse_host(spec: str) -> DockerHost:
+    """Parses a host given as comma separated key=value pairs, e.g.
+    ``name=web,context=web,root=/srv`` or ``docker_host=ssh://root@db,root=/srv``.
+    The name defaults to the context or the host name of the url, the ssh
+    target to the user and host of an ssh url."""
+    values: dict[str, str] = {}
+    for part in spec.split(","):
+        key, separator, value = part.partition("=")
+        key = key.strip().replace("-", "_")
+        if not separator or key not in (
+            "name",
+            "root",
+            "context",
+            "docker_host",
+            "ssh",
+        ):
+            raise Exception("Invalid host {}: unknown option {}".format(spec, part))
+        values[key] = value.strip()
+    if "root" not in values:
+        raise Exception("Invalid host {}: the root is missing".format(spec))
+    if "context" in values and "docker_host" in values:
+        raise Exception("Invalid host {}: give a context or a docker_host".format(spec))
+    url = urlparse(values.get("docker_host", ""))
+    name = values.get("name") or values.get("context") or url.hostname
+    if not name:
+        raise Exception("Invalid host {}: the name is missing".format(spec))
+    ssh = values.get("ssh")
+    if ssh is None and url.scheme == "ssh" and url.hostname:
+        ssh = url.hostname
+        if url.username is not None:
+            ssh = "{}@{}".format(url.username, url.hostname)
+    return DockerHost(
+        name=name,
+        root=Path(values["root"]),
+        context=values.get("context"),
+        docker_host=values.get("docker_host"),
+        ssh=ssh,
+    )
+
+
+def current() -> Optional[DockerHost]:
+    return _current.get()
+
+
+def key() -> Optional[str]:
+    """Separates the state of the hosts, None is the default host"""
+    host = _current.get()
+    return host.name if host is not None else None
+
+
+def environment() -> Optional[dict[str, str]]:
+    """The environment of docker commands, None keeps the own environment"""
+    host = _current.get()
+    if host is None:
+        return None
+    return host.environment()
+
+
+@contextlib.contextmanager
+def use(host: Optional[DockerHost]) -> Iterator[None]:
+    """Docker commands in the block talk to the host"""
+    token = _current.set(host)
+    try:
+        yield
+    finally:
+        _current.reset(token)
+
+
+def select(host: Optional[DockerHost]) -> None:
+    """Sets the host for the rest of the current task"""
+    _current.set(host)
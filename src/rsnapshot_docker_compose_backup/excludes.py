@@ -0,0 +1,255 @@
+"""Rules that leave the disposable files of the volumes out of the backup.
+The rules are set in the excludes section of the global config or of a
+service and are added to the backup lines of the volumes as
+``+rsync_long_args=--exclude=...``. Detectors look for well known dirs whose
+files can be recreated (caches, dependencies, previews) below the volume
+roots and exclude them too::
+
+    [service.excludes]
+    # Patterns like the ones of rsync, for all volumes of the service
+    exclude = tmp/ *.tmp
+    # For one volume, by its name with or without the project prefix
+    exclude.db_data = pg_stat_tmp/
+    include = tmp/keep/
+    # Detectors that look for disposable dirs, all or none
+    detect = cachedir_tag dot_cache
+    detect_depth = 3
+
+Includes are added before the excludes, so they win like in rsync."""
+
+from abc import ABC, abstractmethod
+from dataclasses import dataclass
+import fnmatch
+import os
+import re
+from typing import Iterable, Mapping, Optional
+
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+from rsnapshot_docker_compose_backup.utils import add_long_args
+
+DEFAULT_DETECT_DEPTH = 3
+# https://bford.info/cachedir/
+CACHEDIR_TAG = "CACHEDIR.TAG"
+CACHEDIR_SIGNATURE = b"Signature: 8a477f597d28d172789f06886806bc55"
+# rsnapshot splits the options of a backup line at commas and rsync splits
+# its long args at whitespace, so these are matched with ? in paths
+_UNSAFE = re.compile(r"[\s,*?\[\\]")
+
+
+@dataclass(frozen=True)
+class Rule:
+    pattern: str
+    include: bool = False
+    # The config or the detector that found the dir
+    source: str = "config"
+
+    def option(self) -> str:
+        return "--{}={}".format("include" if self.include else "exclude", self.pattern)
+
+
+class Detector(ABC):
+    """Decides if a dir below a volume root only holds files that can be
+    recreated, the dir is excluded then"""
+
+    @abstractmethod
+    def disposable(self, path: str, names: frozenset[str]) -> bool:
+        """:param names: the names of the entries of the dir"""
+
+
+class CacheDirTag(Detector):
+    """Dirs that are tagged as caches by the program that writes them"""
+
+    def disposable(self, path: str, names: frozenset[str]) -> bool:
+        if CACHEDIR_TAG not in names:
+            return False
+        try:
+            with open(os.path.join(path, CACHEDIR_TAG), "rb") as tag:
+                return tag.read(len(CACHEDIR_SIGNATURE)) == CACHEDIR_SIGNATURE
+        except OSError:
+            return False
+
+
+class DirName(Detector):
+    def __init__(self, *dir_names: str):
+        self.dir_names = frozenset(dir_names)
+
+    def disposable(self, path: str, names: frozenset[str]) -> bool:
+        return os.path.basename(path) in self.dir_names
+
+
+DETECTORS: dict[str, Detector] = {
+    "cachedir_tag": CacheDirTag(),
+    "dot_cache": DirName(".cache"),
+    "node_modules": DirName("node_modules"),
+    # The thumbnails of Nextcloud and similar apps
+    "preview": DirName("preview"),
+}
+
+
+def register_detector(name: str, detector: Detector) -> None:
+    DETECTORS[name] = detector
+
+
+def configured(options: Mapping[str, str]) -> bool:
+    """If the options add any rules, otherwise the volumes aren't looked at"""
+    return any(
+        name.split(".", 1)[0] in ["exclude", "include"]
+        or (name == "detect" and _detector_names(value))
+        for name, value in options.items()
+    )
+
+
+def volume_rules(
+    volume: Volume, options: Mapping[str, str], project_name: str
+) -> list[Rule]:
+    """The rules of a volume, the includes first"""
+    names = {volume.name.lower()}
+    prefix = project_name.lower() + "_"
+    if volume.name.lower().startswith(prefix):
+        names.add(volume.name.lower()[len(prefix) :])
+    rules: list[Rule] = []
+    for include in [True, False]:
+        kind = "include" if include else "exclude"
+        for name, value in options.items():
+            if name == kind or (
+                name.startswith(kind + ".") and name[len(kind) + 1 :] in names
+            ):
+                for pattern in value.split():
+                    if "," in pattern:
+                        raise Exception(
+                            "The pattern {} of {} can't contain a comma".format(
+                                pattern, volume.name
+                            )
+                        )
+                    rules.append(Rule(pattern, include))
+    detectors = [
+        (name, DETECTORS[name]) for name in _detector_names(options.get("detect", ""))
+    ]
+    if detectors:
+        depth = int(options.get("detect_depth", DEFAULT_DETECT_DEPTH))
+        includes = [rule for rule in rules if rule.include]
+        for rule in detect(volume.path, detectors, depth):
+            # A dir that is included explicitly is kept
+            if first_match(includes, rule.pattern.strip("/"), True) is None:
+                rules.append(rule)
+    return rules
+
+
+def _detector_names(value: str) -> list[str]:
+    names = value.lower().split()
+    if names in [[], ["none"]]:
+        return []
+    if names == ["all"]:
+        return sorted(DETECTORS)
+    for name in names:
+        if name not in DETECTORS:
+            raise Exception(
+                "Unknown detector {}, use one of {}".format(
+                    name, ", ".join(sorted(DETECTORS))
+                )
+            )
+    return names
+
+
+def detect(root: str, detectors: list[tuple[str, Detector]], depth: int) -> list[Rule]:
+    """Looks for disposable dirs down to depth levels below the root, the
+    dirs below a disposable dir aren't looked at"""
+    rules: list[Rule] = []
+    level = [""]
+    for _ in range(depth):
+        next_level: list[str] = []
+        for relative in level:
+            for name in _subdirs(os.path.join(root, relative)):
+                path = os.path.join(root, relative, name)
+                try:
+                    names = frozenset(os.listdir(path))
+                except OSError:
+                    continue
+                found = next(
+                    (n for n, d in detectors if d.disposable(path, names)), None
+                )
+                if found is None:
+                    next_level.append(os.path.join(relative, name))
+                else:
+                    anchored = "/{}/".format(os.path.join(relative, name))
+                    rules.append(Rule(_UNSAFE.sub("?", anchored), source=found))
+        level = next_level
+    return rules
+
+
+def _subdirs(directory: str) -> list[str]:
+    try:
+        with os.scandir(directory) as entries:
+            return sorted(e.name for e in entries if e.is_dir(follow_symlinks=False))
+    except OSError:
+        return []
+
+
+def matches(pattern: str, relative: str, is_dir: bool) -> bool:
+    """Matches a path relative to the volume root like rsync: a pattern that
+    ends with / only matches dirs, one that starts with / is anchored at the
+    root and one without / matches the name at any level"""
+    if pattern.endswith("/"):
+        if not is_dir:
+            return False
+        pattern = pattern.rstrip("/")
+    if pattern.startswith("/"):
+        return fnmatch.fnmatchcase(relative, pattern[1:])
+    if "/" in pattern:
+        return fnmatch.fnmatchcase(relative, pattern) or fnmatch.fnmatchcase(
+            relative, "*/" + pattern
+        )
+    return fnmatch.fnmatchcase(os.path.basename(relative), pattern)
+
+
+def first_match(rules: Iterable[Rule], relative: str, is_dir: bool) -> Optional[Rule]:
+    for rule in rules:
+        if matches(rule.pattern, relative, is_dir):
+            return rule
+    return None
+
+
+def add_args(line: str, rules: list[Rule]) -> str:
+    """Adds the rules to the options of a backup line"""
+    return add_long_args(line, [rule.option() for rule in rules])
+
+
+def explain(root: str, rules: list[Rule]) -> dict[Rule, int]:
+    """:returns: the bytes that every exclude leaves out of the backup of the
+    volume, the first rule that matches a path wins"""
+    saved = {rule: 0 for rule in rules if not rule.include}
+    pending = [""]
+    while pending:
+        relative = pending.pop()
+        try:
+            with os.scandir(os.path.join(root, relative)) as entries:
+                listing = list(entries)
+        except OSError:
+            continue
+        for entry in listing:
+            is_dir = entry.is_dir(follow_symlinks=False)
+            path = os.path.join(relative, entry.name)
+            rule = first_match(rules, path, is_dir)
+            if rule is not None and not rule.include:
+                saved[rule] += _size(entry.path) if is_dir else _file_size(entry)
+            elif is_dir:
+                pending.append(path)
+    return saved
+
+
+def _file_size(entry: os.DirEntry[str]) -> int:
+    try:
+        return entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        return 0
+
+
+def _size(directory: str) -> int:
+    size = 0
+    for dir_path, _, files in os.walk(directory):
+        for name in files:
+            try:
+                size += os.lstat(os.path.join(dir_path, name)).st_size
+            except OSError:
+                pass
+    return size
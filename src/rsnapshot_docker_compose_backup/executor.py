@@ -0,0 +1,188 @@
+"""Runs the plan itself instead of writing it for rsnapshot.
+Every project is a pipeline from its runtime backup over the stop and the
+backups to the restart. The pipelines run in parallel lanes, each lane with
+its own rsync processes. A failed step skips the rest of the backups of its
+project, but the project is always restarted. How long every step took is
+written to a log with one json object per line."""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+import json
+import os
+from pathlib import Path
+import queue
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Optional, TextIO
+
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.scheduler import ProjectPlan
+
+# These steps run even if an earlier step of the project failed
+RESTART_STEPS = ["restart", "post_restart"]
+RSYNC_ARGS = ["-a", "--delete", "--numeric-ids"]
+RSYNC_LONG_ARGS = "rsync_long_args="
+
+
+class ExecutionError(Exception):
+    pass
+
+
+@dataclass
+class StepResult:
+    # Unix time of the start of the run, the same for all steps of a run
+    run: float
+    project: str
+    step: str
+    lane: int
+    # Unix time of the start of the step
+    start: float
+    seconds: float
+    commands: int
+    # ok, failed or skipped
+    status: str
+    error: Optional[str] = None
+
+
+class Executor:
+    def __init__(
+        self,
+        destination: Path,
+        lanes: int = 1,
+        log: Optional[TextIO] = None,
+        rsync: str = "rsync",
+        wrapper: Optional[list[str]] = None,
+    ):
+        """:param wrapper: the command that rsync runs with, e.g. ionice"""
+        self.destination = destination
+        self.lanes = lanes
+        self.log = log
+        self.rsync = rsync
+        self.wrapper = wrapper or []
+        self.results: list[StepResult] = []
+        self.started = time.time()
+        self._lock = threading.Lock()
+
+    def run(self, plans: list[ProjectPlan]) -> bool:
+        """Runs the projects in the given order, as soon as a lane is free.
+        :returns: if every project was backed up without errors"""
+        self.started = time.time()
+        pending: "queue.Queue[ProjectPlan]" = queue.Queue()
+        for plan in plans:
+            pending.put(plan)
+        with ThreadPoolExecutor(self.lanes) as lanes:
+            outcomes = list(
+                lanes.map(lambda lane: self._lane(lane, pending), range(self.lanes))
+            )
+        return all(outcomes)
+
+    def _lane(self, lane: int, pending: "queue.Queue[ProjectPlan]") -> bool:
+        success = True
+        while True:
+            try:
+                plan = pending.get_nowait()
+            except queue.Empty:
+                return success
+            success = self.run_project(plan, lane) and success
+
+    def run_project(self, plan: ProjectPlan, lane: int = 0) -> bool:
+        failed = False
+        for step in DefaultConfig.backupOrder:
+            commands = plan.steps.get(step, [])
+            if not commands:
+                continue
+            if failed and step not in RESTART_STEPS:
+                self._record(
+                    StepResult(
+                        self.started,
+                        plan.name,
+                        step,
+                        lane,
+                        time.time(),
+                        0,
+                        0,
+                        "skipped",
+                    )
+                )
+                continue
+            start = time.time()
+            begin = time.perf_counter()
+            error: Optional[str] = None
+            for command in commands:
+                try:
+                    self.run_command(command)
+                except (ExecutionError, OSError) as e:
+                    error = str(e)
+                    break
+            self._record(
+                StepResult(
+                    self.started,
+                    plan.name,
+                    step,
+                    lane,
+                    start,
+                    time.perf_counter() - begin,
+                    len(commands),
+                    "ok" if error is None else "failed",
+                    error,
+                )
+            )
+            failed = failed or error is not None
+        return not failed
+
+    def run_command(self, command: str) -> None:
+        """Runs one line of the plan, in the format of the rsnapshot config"""
+        fields = command.split("\t")
+        if fields[0] == "backup_exec" and len(fields) >= 2:
+            _check(subprocess.run(fields[1], shell=True, check=False), fields[1])
+        elif fields[0] == "backup" and len(fields) >= 3:
+            self._sync(fields[1], fields[2], _long_args(fields[3:]))
+        elif fields[0] == "backup_script" and len(fields) >= 3:
+            with tempfile.TemporaryDirectory() as work_dir:
+                _check(
+                    subprocess.run(fields[1], shell=True, cwd=work_dir, check=False),
+                    fields[1],
+                )
+                self._sync(work_dir + "/", fields[2], [])
+        else:
+            raise ExecutionError("Unknown command {}".format(command))
+
+    def _sync(self, source: str, destination: str, args: list[str]) -> None:
+        target = self.destination / destination
+        target.mkdir(parents=True, exist_ok=True)
+        if os.path.isdir(source) and not source.endswith("/"):
+            source += "/"
+        cmd = [
+            *self.wrapper,
+            self.rsync,
+            *RSYNC_ARGS,
+            *args,
+            source,
+            str(target) + "/",
+        ]
+        _check(subprocess.run(cmd, check=False), " ".join(cmd))
+
+    def _record(self, result: StepResult) -> None:
+        with self._lock:
+            self.results.append(result)
+            if self.log is not None:
+                self.log.write(json.dumps(asdict(result)) + "\n")
+                self.log.flush()
+
+
+def _check(result: "subprocess.CompletedProcess[bytes]", cmd: str) -> None:
+    if result.returncode != 0:
+        raise ExecutionError("{} returned {}".format(cmd, result.returncode))
+
+
+def _long_args(options: list[str]) -> list[str]:
+    """The rsync args of the options of a backup line, e.g.
+    ``+rsync_long_args=--include=*.yml,+rsync_long_args=--include=*.yaml``"""
+    args: list[str] = []
+    for option in ",".join(options).split(","):
+        option = option.strip().lstrip("+")
+        if option.startswith(RSYNC_LONG_ARGS):
+            args.extend(option[len(RSYNC_LONG_ARGS) :].split())
+    return args
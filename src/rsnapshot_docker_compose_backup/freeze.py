@@ -0,0 +1,290 @@
+"""How a container is kept from writing to its volumes while they are backed up.
+stop: the stopContainer action stops the project for the whole backup.
+pause: the project is paused with docker compose pause instead.
+snapshot: the project is stopped for a copy on write snapshot of its volumes
+only and the volumes are backed up from the snapshots.
+none: the volumes are backed up while the project runs.
+
+The strategy is set with ``freeze`` in the main section of the global config or
+of a service. The snapshots are taken by a backend, that only creates the
+commands, so they run when rsnapshot runs the config."""
+
+from abc import ABC, abstractmethod
+import os
+import re
+import shlex
+from typing import Mapping
+
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+STRATEGIES = ["stop", "pause", "snapshot", "none"]
+# The options of the main sections that configure the strategy
+OPTIONS = ["freeze", "snapshot_backend", "snapshot_dir", "snapshot_size"]
+# The action that the stop strategy uses
+STOP_ACTION = "stopcontainer"
+DEFAULT_SNAPSHOT_BACKEND = "reflink"
+DEFAULT_SNAPSHOT_SIZE = "1G"
+LVM_MOUNT_DIR = "/mnt/rsnapshot-docker-compose-backup"
+COMPOSE = "cd {}; /usr/bin/docker-compose {}"
+
+
+class SnapshotBackend(ABC):
+    """Creates the commands that take and remove the snapshot of a volume"""
+
+    def __init__(self, options: Mapping[str, str]):
+        self.options = options
+
+    @abstractmethod
+    def snapshot_path(self, volume: Volume) -> str:
+        """The path of the files of the volume in the snapshot"""
+
+    @abstractmethod
+    def create(self, volume: Volume) -> list[str]:
+        """Shell commands that take the snapshot, an old snapshot of a failed
+        run has to be replaced"""
+
+    @abstractmethod
+    def remove(self, volume: Volume) -> list[str]:
+        pass
+
+    def _sibling(self, volume: Volume) -> str:
+        """A dir on the same file system as the volume"""
+        snapshot_dir = self.options.get("snapshot_dir")
+        if snapshot_dir:
+            return os.path.join(snapshot_dir, _tag(volume))
+        return "{}.snapshot".format(volume.path.rstrip("/"))
+
+
+class ReflinkBackend(SnapshotBackend):
+    """Copies the files with reflinks, the file system has to support them
+    (btrfs, XFS) and the snapshot dir has to be on it"""
+
+    def snapshot_path(self, volume: Volume) -> str:
+        return self._sibling(volume)
+
+    def create(self, volume: Volume) -> list[str]:
+        path = shlex.quote(self.snapshot_path(volume))
+        return [
+            "rm -rf {0} && mkdir -p {0} && cp -a --reflink=always {1}/. {0}".format(
+                path, shlex.quote(volume.path)
+            )
+        ]
+
+    def remove(self, volume: Volume) -> list[str]:
+        return ["rm -rf {}".format(shlex.quote(self.snapshot_path(volume)))]
+
+
+class BtrfsBackend(SnapshotBackend):
+    """The volume has to be a btrfs subvolume"""
+
+    def snapshot_path(self, volume: Volume) -> str:
+        return self._sibling(volume)
+
+    def create(self, volume: Volume) -> list[str]:
+        path = shlex.quote(self.snapshot_path(volume))
+        return [
+            "if [ -d {0} ]; then btrfs subvolume delete {0}; fi; "
+            "mkdir -p {1} && btrfs subvolume snapshot -r {2} {0}".format(
+                path,
+                shlex.quote(os.path.dirname(self.snapshot_path(volume))),
+                shlex.quote(volume.path),
+            )
+        ]
+
+    def remove(self, volume: Volume) -> list[str]:
+        return [
+            "btrfs subvolume delete {}".format(shlex.quote(self.snapshot_path(volume)))
+        ]
+
+
+class ZfsBackend(SnapshotBackend):
+    """Snapshots the dataset that the volume is on, the files are read from
+    the .zfs dir of the dataset"""
+
+    def snapshot_path(self, volume: Volume) -> str:
+        mount_point = _mount_point(volume.path)
+        return os.path.join(
+            mount_point,
+            ".zfs",
+            "snapshot",
+            _tag(volume),
+            os.path.relpath(os.path.realpath(volume.path), mount_point),
+        )
+
+    def _snapshot(self, volume: Volume) -> str:
+        return '"$(findmnt -no SOURCE --target {})@{}"'.format(
+            shlex.quote(_mount_point(volume.path)), _tag(volume)
+        )
+
+    def create(self, volume: Volume) -> list[str]:
+        snapshot = self._snapshot(volume)
+        return [
+            "zfs destroy {0} 2>/dev/null; zfs snapshot {0}".format(snapshot),
+        ]
+
+    def remove(self, volume: Volume) -> list[str]:
+        return ["zfs destroy {}".format(self._snapshot(volume))]
+
+
+class LvmBackend(SnapshotBackend):
+    """Snapshots the logical volume that the volume is on and mounts the
+    snapshot read only. snapshot_size is the space for the changes during the
+    backup"""
+
+    def _mount_dir(self) -> str:
+        return self.options.get("snapshot_dir") or LVM_MOUNT_DIR
+
+    def snapshot_path(self, volume: Volume) -> str:
+        mount_point = _mount_point(volume.path)
+        return os.path.join(
+            self._mount_dir(),
+            _tag(volume),
+            os.path.relpath(os.path.realpath(volume.path), mount_point),
+        )
+
+    def _group(self, volume: Volume) -> str:
+        return (
+            '"$(lvs --noheadings -o vg_name "$(findmnt -no SOURCE --target {})" '
+            "| tr -d ' ')\"".format(shlex.quote(_mount_point(volume.path)))
+        )
+
+    def create(self, volume: Volume) -> list[str]:
+        mount_dir = shlex.quote(os.path.join(self._mount_dir(), _tag(volume)))
+        return [
+            "umount {0} 2>/dev/null; lvremove -qf {1}/{2} 2>/dev/null; "
+            'lvcreate -q -s -n {2} -L {3} "$(findmnt -no SOURCE --target {4})" '
+            "&& mkdir -p {0} && mount -o ro {1}/{2} {0}".format(
+                mount_dir,
+                "/dev/" + self._group(volume),
+                _tag(volume),
+                shlex.quote(self.options.get("snapshot_size", DEFAULT_SNAPSHOT_SIZE)),
+                shlex.quote(_mount_point(volume.path)),
+            )
+        ]
+
+    def remove(self, volume: Volume) -> list[str]:
+        return [
+            "umount {}; lvremove -qf {}/{}".format(
+                shlex.quote(os.path.join(self._mount_dir(), _tag(volume))),
+                self._group(volume),
+                _tag(volume),
+            )
+        ]
+
+
+BACKENDS: dict[str, type[SnapshotBackend]] = {
+    "reflink": ReflinkBackend,
+    "btrfs": BtrfsBackend,
+    "zfs": ZfsBackend,
+    "lvm": LvmBackend,
+}
+
+
+def register_backend(name: str, backend: type[SnapshotBackend]) -> None:
+    BACKENDS[name] = backend
+
+
+class Strategy:
+    """The stop strategy, it leaves the quiescing to the stopContainer action"""
+
+    name = "stop"
+    uses_stop_action = True
+    # If the commands need the volumes, they are only looked up then
+    uses_volumes = False
+
+    def volumes(self, volumes: list[Volume]) -> list[Volume]:
+        """The volumes that $volumes is set to"""
+        return volumes
+
+    def commands(self, step: str, folder: str, volumes: list[Volume]) -> list[str]:
+        """The commands that are added to the step, volumes are the volumes
+        that the service backs up"""
+        return []
+
+
+class NoFreeze(Strategy):
+    name = "none"
+    uses_stop_action = False
+
+
+class Pause(Strategy):
+    name = "pause"
+    uses_stop_action = False
+
+    def commands(self, step: str, folder: str, volumes: list[Volume]) -> list[str]:
+        if step == "stop":
+            return [_exec(COMPOSE.format(folder, "pause"))]
+        if step == "restart":
+            return [_exec(COMPOSE.format(folder, "unpause"))]
+        return []
+
+
+class Snapshot(Strategy):
+    """The project is started again before the backups. The restart step
+    starts it too and removes the snapshots, it also runs if a snapshot or a
+    backup failed and the other steps were given up."""
+
+    name = "snapshot"
+    uses_stop_action = False
+    uses_volumes = True
+
+    def __init__(self, backend: SnapshotBackend):
+        self.backend = backend
+
+    def volumes(self, volumes: list[Volume]) -> list[Volume]:
+        return [Volume(v.name, self.backend.snapshot_path(v), v.size) for v in volumes]
+
+    def commands(self, step: str, folder: str, volumes: list[Volume]) -> list[str]:
+        # Without volumes there is nothing to freeze
+        if not volumes:
+            return []
+        if step == "stop":
+            return [_exec(COMPOSE.format(folder, "stop"))] + [
+                _exec(command) for v in volumes for command in self.backend.create(v)
+            ]
+        if step == "pre_backup":
+            return [_exec(COMPOSE.format(folder, "start"))]
+        if step == "restart":
+            return [_exec(COMPOSE.format(folder, "start"))] + [
+                _exec(command) for v in volumes for command in self.backend.remove(v)
+            ]
+        return []
+
+
+def strategy(options: Mapping[str, str]) -> Strategy:
+    """The strategy of the freeze options of a service"""
+    name = options.get("freeze", "stop").strip().lower()
+    if name == "stop":
+        return Strategy()
+    if name == "pause":
+        return Pause()
+    if name == "none":
+        return NoFreeze()
+    if name == "snapshot":
+        backend_name = options.get("snapshot_backend", DEFAULT_SNAPSHOT_BACKEND)
+        backend = BACKENDS.get(backend_name.strip().lower())
+        if backend is None:
+            raise Exception("Unknown snapshot backend {}".format(backend_name))
+        return Snapshot(backend(options))
+    raise Exception(
+        "Unknown freeze strategy {}, use one of {}".format(name, ", ".join(STRATEGIES))
+    )
+
+
+def _exec(command: str) -> str:
+    return "backup_exec\t{}".format(command)
+
+
+def _tag(volume: Volume) -> str:
+    """A name for the snapshot of the volume, for file systems that name them"""
+    return "rsnapshot-{}".format(re.sub(r"[^A-Za-z0-9_.-]", "_", volume.name))
+
+
+def _mount_point(path: str) -> str:
+    path = os.path.realpath(path)
+    while not os.path.ismount(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return path
@@ -2,9 +2,12 @@ import os
 from pathlib import Path
 from typing import Optional
 
-
 folder: Path = Path(os.getcwd())
 config_file: Optional[Path] = None
+# Can be "auto", "api" or "cli"
+docker_backend: str = "auto"
+# Can be "labels" or "compose"
+discovery: str = "labels"
 
 
 def set_folder(path: Path) -> None:
@@ -17,3 +20,15 @@ def set_config_file(file: Optional[Path]) -> None:
     # pylint: disable=global-statement
     global config_file
     config_file = file
+
+
+def set_docker_backend(backend: str) -> None:
+    # pylint: disable=global-statement
+    global docker_backend
+    docker_backend = backend
+
+
+def set_discovery(mode: str) -> None:
+    # pylint: disable=global-statement
+    global discovery
+    discovery = mode
@@ -0,0 +1,345 @@
+"""History of how long the steps of the backups took, stored in SQLite.
+The durations are imported from the rsnapshot log, using the logged
+``/bin/date +%s`` commands of the logTime setting and the config that rsnapshot
+ran, or from the step log of --execute.
+
+    rsnapshot-docker-compose-history import --config backup.conf --log rsnapshot.log
+    rsnapshot-docker-compose-history report
+    rsnapshot-docker-compose-history trend nextcloud"""
+
+import argparse
+from dataclasses import dataclass
+from datetime import datetime
+import json
+import os
+from pathlib import Path
+import re
+import sqlite3
+import statistics
+from typing import Iterable, Optional
+
+from rsnapshot_docker_compose_backup.config.abstract_config import AbstractConfig
+
+DATE_COMMAND = "backup_exec\t/bin/date +%s"
+# rsnapshot logs every command with its time, e.g. [2024-01-05T03:00:01]
+LOG_LINE = re.compile(r"^\[(?P<time>[^\]]+)\] (?P<message>.*)$")
+LOG_TIME_FORMATS = ["%Y-%m-%dT%H:%M:%S", "%d/%b/%Y:%H:%M:%S"]
+PROJECT_HEADER = re.compile(
+    r"^##Start (?:backup|runtime backup) for compose project (?P<project>\S+) - "
+    r"services? (?P<service>.*)$"
+)
+# How many of the last runs the estimates are based on
+ESTIMATE_RUNS = 5
+# A step is flagged if it took this much longer than usual
+REGRESSION_FACTOR = 2.0
+# Shorter steps aren't flagged, they are too noisy
+REGRESSION_MIN_SECONDS = 10.0
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY,
+    started REAL NOT NULL,
+    source TEXT NOT NULL,
+    UNIQUE (started, source)
+);
+CREATE TABLE IF NOT EXISTS durations (
+    run INTEGER NOT NULL REFERENCES runs (id),
+    project TEXT NOT NULL,
+    service TEXT NOT NULL,
+    step TEXT NOT NULL,
+    volume TEXT NOT NULL,
+    seconds REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS durations_project ON durations (project, step);
+"""
+
+
+def data_dir() -> Path:
+    base = os.environ.get("XDG_DATA_HOME") or os.path.join(
+        os.path.expanduser("~"), ".local", "share"
+    )
+    return Path(base) / "rsnapshot-docker-compose-backup"
+
+
+def default_database() -> Path:
+    return data_dir() / "history.sqlite"
+
+
+@dataclass
+class Duration:
+    project: str
+    service: str
+    step: str
+    # The destination of a backup, empty for other commands
+    volume: str
+    seconds: float
+
+
+class History:
+    def __init__(self, database: Path):
+        database.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(str(database))
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def add_run(self, started: float, source: str, durations: list[Duration]) -> bool:
+        """Stores the durations of a run.
+        :returns: False if the run was already imported"""
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT OR IGNORE INTO runs (started, source) VALUES (?, ?)",
+                (started, source),
+            )
+            if cursor.rowcount == 0:
+                return False
+            self.connection.executemany(
+                "INSERT INTO durations VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (
+                        cursor.lastrowid,
+                        d.project,
+                        d.service,
+                        d.step,
+                        d.volume,
+                        d.seconds,
+                    )
+                    for d in durations
+                ],
+            )
+        return True
+
+    def project_runs(
+        self, project: str, steps: Optional[list[str]] = None
+    ) -> list[tuple[float, float]]:
+        """The start and the seconds of the steps of the project, for every run"""
+        query = (
+            "SELECT runs.started, SUM(seconds) FROM durations "
+            "JOIN runs ON runs.id = durations.run WHERE project = ?"
+        )
+        params: list[str] = [project]
+        if steps is not None:
+            query += " AND step IN ({})".format(", ".join("?" for _ in steps))
+            params.extend(steps)
+        query += " GROUP BY runs.id ORDER BY runs.started"
+        return [(row[0], row[1]) for row in self.connection.execute(query, params)]
+
+    def estimates(self, steps: Optional[list[str]] = None) -> dict[str, float]:
+        """The median seconds of the steps of every project in the last runs"""
+        projects = [
+            row[0]
+            for row in self.connection.execute("SELECT DISTINCT project FROM durations")
+        ]
+        result: dict[str, float] = {}
+        for project in projects:
+            runs = self.project_runs(project, steps)[-ESTIMATE_RUNS:]
+            if runs:
+                result[project] = statistics.median(s for _, s in runs)
+        return result
+
+    def step_runs(self) -> dict[tuple[str, str], list[float]]:
+        """The seconds of every step of every project, oldest run first"""
+        result: dict[tuple[str, str], list[float]] = {}
+        for project, step, seconds in self.connection.execute(
+            "SELECT project, step, SUM(seconds) FROM durations "
+            "JOIN runs ON runs.id = durations.run "
+            "GROUP BY runs.id, project, step ORDER BY runs.started"
+        ):
+            result.setdefault((project, step), []).append(seconds)
+        return result
+
+    def regressions(
+        self,
+        factor: float = REGRESSION_FACTOR,
+        min_seconds: float = REGRESSION_MIN_SECONDS,
+    ) -> list[str]:
+        """The steps that took much longer in the last run than in the runs
+        before, at least three runs are needed for a comparison"""
+        result: list[str] = []
+        for (project, step), runs in sorted(self.step_runs().items()):
+            if len(runs) < 3:
+                continue
+            usual = statistics.median(runs[-ESTIMATE_RUNS - 1 : -1])
+            if runs[-1] >= min_seconds and runs[-1] > usual * factor:
+                result.append(
+                    "{} of {} took {:.0f}s, usually {:.0f}s".format(
+                        step, project, runs[-1], usual
+                    )
+                )
+        return result
+
+
+def parse_rsnapshot_log(lines: Iterable[str]) -> list[float]:
+    """The times of the logged date commands of the last run in the log"""
+    times: list[float] = []
+    for line in lines:
+        match = LOG_LINE.match(line.rstrip("\n"))
+        if match is None:
+            continue
+        message = match.group("message")
+        if message.endswith(": started"):
+            times = []
+        elif message.strip() == "/bin/date +%s":
+            times.append(_parse_log_time(match.group("time")))
+    return times
+
+
+def _parse_log_time(text: str) -> float:
+    for time_format in LOG_TIME_FORMATS:
+        try:
+            return datetime.strptime(text, time_format).timestamp()
+        except ValueError:
+            continue
+    raise Exception("Unknown time in the rsnapshot log: {}".format(text))
+
+
+def durations_from_config(config: Iterable[str], times: list[float]) -> list[Duration]:
+    """Matches the logged date commands with the date commands of the config.
+    A command took the time between the date commands before and after it."""
+    durations: list[Duration] = []
+    project = service = step = ""
+    marker = -1
+    measured: Optional[Duration] = None
+    for line in config:
+        line = line.rstrip("\n")
+        header = PROJECT_HEADER.match(line)
+        if header is not None:
+            project, service = header.group("project"), header.group("service")
+        elif line == DATE_COMMAND:
+            marker += 1
+            if marker >= len(times):
+                raise Exception("The rsnapshot log doesn't match the config")
+            if measured is not None:
+                measured.seconds = times[marker] - times[marker - 1]
+                durations.append(measured)
+            measured = None
+        elif line.startswith("#") and line[1:] in AbstractConfig.backupOrder:
+            step = line[1:]
+        elif line and not line.startswith("#") and marker >= 0:
+            fields = line.split("\t")
+            volume = fields[2] if fields[0] == "backup" and len(fields) > 2 else ""
+            measured = Duration(project, service, step, volume, 0)
+    if marker + 1 != len(times):
+        raise Exception("The rsnapshot log doesn't match the config")
+    return durations
+
+
+def runs_from_step_log(lines: Iterable[str]) -> dict[float, list[Duration]]:
+    """The durations of the runs in the step log of --execute"""
+    runs: dict[float, list[Duration]] = {}
+    for line in lines:
+        if not line.strip():
+            continue
+        entry = json.loads(line)
+        if entry["status"] == "skipped":
+            continue
+        runs.setdefault(entry["run"], []).append(
+            Duration(entry["project"], "", entry["step"], "", entry["seconds"])
+        )
+    return runs
+
+
+def import_files(
+    history: History,
+    config: Optional[Path] = None,
+    log: Optional[Path] = None,
+    steps: Optional[Path] = None,
+) -> int:
+    """:returns: how many new runs were imported"""
+    imported = 0
+    if config is not None and log is not None:
+        with open(log, encoding="UTF-8") as log_file:
+            times = parse_rsnapshot_log(log_file)
+        if times:
+            with open(config, encoding="UTF-8") as config_file:
+                durations = durations_from_config(config_file, times)
+            imported += history.add_run(times[0], "rsnapshot", durations)
+    if steps is not None:
+        with open(steps, encoding="UTF-8") as steps_file:
+            runs = runs_from_step_log(steps_file)
+        for started, durations in runs.items():
+            imported += history.add_run(started, "execute", durations)
+    return imported
+
+
+def report(history: History) -> str:
+    lines = [
+        "{:<30} {:<15} {:>5} {:>10} {:>10}".format(
+            "project", "step", "runs", "median s", "last s"
+        )
+    ]
+    for (project, step), runs in sorted(history.step_runs().items()):
+        lines.append(
+            "{:<30} {:<15} {:>5} {:>10.1f} {:>10.1f}".format(
+                project, step, len(runs), statistics.median(runs), runs[-1]
+            )
+        )
+    for regression in history.regressions():
+        lines.append("Slower: {}".format(regression))
+    return "\n".join(lines)
+
+
+def trend(history: History, project: str, step: Optional[str] = None) -> str:
+    lines: list[str] = []
+    previous: Optional[float] = None
+    for started, seconds in history.project_runs(
+        project, [step] if step is not None else None
+    ):
+        change = ""
+        if previous:
+            change = "{:+.0%}".format(seconds / previous - 1)
+        lines.append(
+            "{} {:>10.1f}s {:>6}".format(
+                datetime.fromtimestamp(started).isoformat(timespec="minutes"),
+                seconds,
+                change,
+            )
+        )
+        previous = seconds
+    return "\n".join(lines)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    ap = argparse.ArgumentParser(prog="rsnapshot-docker-compose-history")
+    ap.add_argument(
+        "--database",
+        help="The history database",
+        default=str(default_database()),
+    )
+    commands = ap.add_subparsers(dest="command", required=True)
+    import_command = commands.add_parser("import", help="Import the durations of a run")
+    import_command.add_argument(
+        "--config", help="The config that rsnapshot ran, needs --log"
+    )
+    import_command.add_argument("--log", help="The rsnapshot log, needs --config")
+    import_command.add_argument("--steps", help="The step log of --execute")
+    commands.add_parser("report", help="The usual and last duration of every step")
+    trend_command = commands.add_parser(
+        "trend", help="The duration of a project in every run"
+    )
+    trend_command.add_argument("project")
+    trend_command.add_argument("--step", default=None)
+    args = ap.parse_args(argv)
+    history = History(Path(args.database))
+    try:
+        if args.command == "import":
+            if (args.config is None) != (args.log is None):
+                ap.error("--config and --log are needed together")
+            imported = import_files(
+                history,
+                Path(args.config) if args.config else None,
+                Path(args.log) if args.log else None,
+                Path(args.steps) if args.steps else None,
+            )
+            print("Imported {} runs".format(imported))
+        elif args.command == "report":
+            print(report(history))
+        elif args.command == "trend":
+            print(trend(history, args.project, args.step))
+    finally:
+        history.close()
+
+
+if __name__ == "__main__":
+    main()
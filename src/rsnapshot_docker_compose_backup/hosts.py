@@ -0,0 +1,247 @@
+"""Creates one config for the compose projects of several docker hosts.
+The hosts are discovered concurrently, each with its own timeout, and the
+output of every host is namespaced, so the backups of the hosts don't
+overwrite each other."""
+
+import asyncio
+from dataclasses import dataclass
+from pathlib import Path, PurePosixPath
+import posixpath
+import re
+import shlex
+import sys
+from typing import Iterator, Optional
+
+from rsnapshot_docker_compose_backup import metrics, scheduler
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache
+from rsnapshot_docker_compose_backup.docker import docker, docker_compose, host
+from rsnapshot_docker_compose_backup.docker.host import DockerHost
+from rsnapshot_docker_compose_backup.scanner import ScanOptions
+
+# Seconds until the discovery of a host is given up
+DEFAULT_HOST_TIMEOUT = 300.0
+# The executables of the commands that are run against the host
+DOCKER_EXECUTABLES = ["docker", "docker-compose"]
+# The separators of the commands of a shell line
+COMMAND_SEPARATOR = re.compile(r"[;&|()\n]")
+
+
+@dataclass
+class HostCaches:
+    discovery: Optional[DiscoveryCache] = None
+    dir_index: Optional[DiscoveryCache] = None
+
+
+@dataclass
+class HostResult:
+    host: DockerHost
+    projects: list[docker_compose.ProjectInfo]
+    # Why the host couldn't be discovered
+    error: Optional[str] = None
+
+
+def iter_lines(
+    docker_hosts: list[DockerHost],
+    caches: Optional[dict[str, HostCaches]] = None,
+    jobs: int = docker_compose.DEFAULT_JOBS,
+    timeout: float = DEFAULT_HOST_TIMEOUT,
+    scan_options: Optional[ScanOptions] = None,
+    schedule: str = "container",
+) -> Iterator[str]:
+    """Yields the config of all hosts, in the order of the hosts.
+    A host that fails or times out is left out with a comment."""
+    if caches is None:
+        caches = {}
+    with metrics.span("discovery"):
+        results = asyncio.run(
+            discover_hosts_async(docker_hosts, caches, jobs, timeout, scan_options)
+        )
+    for result in results:
+        yield from host_lines(
+            result, caches.get(result.host.name, HostCaches()), schedule
+        )
+
+
+async def discover_hosts_async(
+    docker_hosts: list[DockerHost],
+    caches: dict[str, HostCaches],
+    jobs: int = docker_compose.DEFAULT_JOBS,
+    timeout: float = DEFAULT_HOST_TIMEOUT,
+    scan_options: Optional[ScanOptions] = None,
+) -> list[HostResult]:
+    names = [docker_host.name for docker_host in docker_hosts]
+    if len(set(names)) != len(names):
+        raise Exception("The names of the hosts have to be unique: {}".format(names))
+    return list(
+        await asyncio.gather(
+            *[
+                _discover_with_timeout(
+                    docker_host,
+                    caches.get(docker_host.name, HostCaches()),
+                    jobs,
+                    timeout,
+                    scan_options,
+                )
+                for docker_host in docker_hosts
+            ]
+        )
+    )
+
+
+async def _discover_with_timeout(
+    docker_host: DockerHost,
+    caches: HostCaches,
+    jobs: int,
+    timeout: float,
+    scan_options: Optional[ScanOptions],
+) -> HostResult:
+    try:
+        projects = await asyncio.wait_for(
+            discover_host_async(docker_host, caches, jobs, scan_options), timeout
+        )
+    except asyncio.TimeoutError:
+        error = "The discovery timed out after {}s".format(timeout)
+    # A broken host must not stop the backup of the others
+    except Exception as e:  # pylint: disable=broad-except
+        error = "The discovery failed: {}".format(e)
+    else:
+        return HostResult(docker_host, projects)
+    print("Host {}: {}".format(docker_host.name, error), file=sys.stderr)
+    return HostResult(docker_host, [], error)
+
+
+async def discover_host_async(
+    docker_host: DockerHost,
+    caches: HostCaches,
+    jobs: int = docker_compose.DEFAULT_JOBS,
+    scan_options: Optional[ScanOptions] = None,
+) -> list[docker_compose.ProjectInfo]:
+    """Discovers the projects of one host. The host is only selected for this
+    task, the other hosts are discovered at the same time."""
+    host.select(docker_host)
+    docker.reset_api()
+    docker.reset_fleet()
+    limit = asyncio.Semaphore(jobs)
+    with metrics.span("host", concurrent=True, host=docker_host.name):
+        await docker.fleet_async(limit)
+        if docker_host.root.is_dir():
+            loop = asyncio.get_running_loop()
+            docker_dirs = await loop.run_in_executor(
+                None,
+                docker_compose.find_docker_dirs,
+                docker_host.root,
+                scan_options,
+                caches.dir_index,
+            )
+        else:
+            # The compose root is only on the remote host
+            docker_dirs = labelled_dirs(docker_host.root)
+        return await docker_compose.discover_dirs_async(
+            docker_dirs, caches.discovery, limit
+        )
+
+
+def labelled_dirs(root: Path) -> list[Path]:
+    """The working dirs of the containers of the current host below the root"""
+    root_path = PurePosixPath(root)
+    working_dirs: set[Path] = set()
+    for state in docker.fleet().containers.values():
+        working_dir = state.labels.get(docker.COMPOSE_WORKING_DIR_LABEL)
+        if working_dir is None:
+            continue
+        path = PurePosixPath(working_dir)
+        if path == root_path or root_path in path.parents:
+            working_dirs.add(Path(working_dir))
+    return sorted(working_dirs)
+
+
+def host_lines(
+    result: HostResult, caches: HostCaches, schedule: str = "container"
+) -> Iterator[str]:
+    docker_host = result.host
+    yield "##Start backup for host {}".format(docker_host.name)
+    if result.error is not None:
+        yield "#{}".format(result.error)
+    if schedule == "project":
+        # The schedule needs all projects of the host at once
+        groups = [result.projects]
+    else:
+        groups = [[project] for project in result.projects]
+    for projects in groups:
+        # The host is only selected while the containers are created, so it
+        # doesn't leak to the caller between the yields
+        with host.use(docker_host):
+            lines = [
+                namespace(line, docker_host)
+                for line in _render(projects, caches.discovery, schedule)
+            ]
+        yield from lines
+    yield "##End backup for host {}".format(docker_host.name)
+    yield ""
+
+
+def _render(
+    projects: list[docker_compose.ProjectInfo],
+    cache: Optional[DiscoveryCache],
+    schedule: str,
+) -> Iterator[str]:
+    containers = (
+        container
+        for project in projects
+        for container in docker_compose.project_containers(project, cache)
+    )
+    if schedule == "project":
+        yield from scheduler.iter_schedule(containers)
+    else:
+        for container in containers:
+            yield from container.iter_backup()
+
+
+def namespace(line: str, docker_host: DockerHost) -> str:
+    """Puts the destination of a backup below the name of the host.
+    Sources are read over ssh and docker commands are run against the host,
+    other commands like the logged times stay on the backup host."""
+    fields = line.split("\t")
+    if len(fields) >= 3 and fields[0] in ("backup", "backup_script"):
+        fields[2] = _prefix(docker_host.name, fields[2])
+    if len(fields) < 2:
+        return line
+    if fields[0] == "backup":
+        if docker_host.ssh is not None and fields[1].startswith("/"):
+            fields[1] = "{}:{}".format(docker_host.ssh, fields[1])
+    elif fields[0] in ("backup_exec", "backup_script") and _runs_docker(fields[1]):
+        if fields[0] == "backup_exec" and docker_host.ssh is not None:
+            # The commands can use the files of the project on the host
+            fields[1] = "ssh {} {}".format(docker_host.ssh, shlex.quote(fields[1]))
+        else:
+            fields[1] = _with_environment(docker_host, fields[1])
+    return "\t".join(fields)
+
+
+def _runs_docker(cmd: str) -> bool:
+    """If one of the commands of the shell line runs docker, by the name of
+    its executable, so other paths that contain docker stay local"""
+    for part in COMMAND_SEPARATOR.split(cmd):
+        words = [word for word in part.split() if "=" not in word]
+        if words and posixpath.basename(words[0]) in DOCKER_EXECUTABLES:
+            return True
+    return False
+
+
+def _prefix(name: str, destination: str) -> str:
+    prefixed = posixpath.normpath(posixpath.join(name, destination))
+    if destination.endswith("/"):
+        prefixed += "/"
+    return prefixed
+
+
+def _with_environment(docker_host: DockerHost, cmd: str) -> str:
+    if docker_host.context is not None:
+        return "export DOCKER_CONTEXT={}; {}".format(
+            shlex.quote(docker_host.context), cmd
+        )
+    if docker_host.docker_host is not None:
+        return "export DOCKER_HOST={}; {}".format(
+            shlex.quote(docker_host.docker_host), cmd
+        )
+    return cmd
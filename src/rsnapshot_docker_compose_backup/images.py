@@ -0,0 +1,275 @@
+"""Store of the exported images, by the id of the image.
+The id is the digest of the image config, so an image is only exported again
+if it changed. With --layers the export is unpacked and every file of it is
+stored once by its digest, so layers that several images share (e.g. their
+base image) take up space once. Images that weren't used for the retention
+time are removed by the garbage collection.
+
+    rsnapshot-docker-compose-images export --store /var/cache/images nginx:latest
+    rsnapshot-docker-compose-images gc --store /var/cache/images --retention-days 30
+
+An image is restored with ``docker load -i image.tar`` or, if it was stored
+with --layers, with ``tar -C <dir> -c . | docker load``."""
+
+import argparse
+import contextlib
+import fcntl
+import hashlib
+import os
+from pathlib import Path
+import shutil
+import subprocess
+import tarfile
+import tempfile
+import time
+from typing import IO, Iterator, Optional
+
+IMAGE_FILE = "image.tar"
+DEFAULT_RETENTION_DAYS = 30.0
+CHUNK_SIZE = 1024 * 1024
+
+
+class ImageStore:
+    """images/<id>/ holds the export of an image, blobs/ the files of the
+    unpacked exports and used/<id> is touched whenever an image is used"""
+
+    def __init__(self, root: Path):
+        self.root = root
+
+    def image_dir(self, image_id: str) -> Path:
+        return self.root / "images" / _digest(image_id)
+
+    def has(self, image_id: str) -> bool:
+        return self.image_dir(image_id).is_dir()
+
+    @contextlib.contextmanager
+    def lock(self) -> Iterator[None]:
+        """Exports and the garbage collection of several backups don't run at
+        the same time"""
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "w", encoding="UTF-8") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def add(self, image_id: str, export: IO[bytes], layers: bool = False) -> None:
+        """Stores the output of docker save. The image dir is only created
+        when the export is complete."""
+        (self.root / "images").mkdir(parents=True, exist_ok=True)
+        partial = Path(tempfile.mkdtemp(dir=self.root / "images", prefix=".partial-"))
+        try:
+            if layers:
+                self._unpack(export, partial)
+            else:
+                with open(partial / IMAGE_FILE, "wb") as image_file:
+                    shutil.copyfileobj(export, image_file, CHUNK_SIZE)
+            os.rename(partial, self.image_dir(image_id))
+        except BaseException:
+            shutil.rmtree(partial, ignore_errors=True)
+            raise
+        self.touch(image_id)
+
+    def _unpack(self, export: IO[bytes], target: Path) -> None:
+        blobs = self.root / "blobs"
+        blobs.mkdir(parents=True, exist_ok=True)
+        with tarfile.open(fileobj=export, mode="r|") as archive:
+            for member in archive:
+                path = target / _member_path(member.name)
+                if member.isdir():
+                    path.mkdir(parents=True, exist_ok=True)
+                    continue
+                path.parent.mkdir(parents=True, exist_ok=True)
+                if member.issym():
+                    os.symlink(member.linkname, path)
+                    continue
+                source = archive.extractfile(member)
+                if source is None:
+                    continue
+                blob = self._store_blob(source, blobs)
+                os.link(blob, path)
+
+    def _store_blob(self, source: IO[bytes], blobs: Path) -> Path:
+        digest = hashlib.sha256()
+        fd, tmp_name = tempfile.mkstemp(dir=blobs, prefix=".partial-")
+        try:
+            with os.fdopen(fd, "wb") as blob_file:
+                for chunk in iter(lambda: source.read(CHUNK_SIZE), b""):
+                    digest.update(chunk)
+                    blob_file.write(chunk)
+            blob = blobs / digest.hexdigest()
+            if blob.exists():
+                os.unlink(tmp_name)
+            else:
+                os.rename(tmp_name, blob)
+            return blob
+        except BaseException:
+            with contextlib.suppress(FileNotFoundError):
+                os.unlink(tmp_name)
+            raise
+
+    def touch(self, image_id: str) -> None:
+        used = self.root / "used" / _digest(image_id)
+        used.parent.mkdir(parents=True, exist_ok=True)
+        used.touch()
+
+    def collect(self, retention: float, now: Optional[float] = None) -> list[str]:
+        """Removes the images that weren't used for retention seconds and the
+        blobs that no image uses anymore.
+        :returns: the ids of the removed images"""
+        limit = (now if now is not None else time.time()) - retention
+        removed: list[str] = []
+        images = self.root / "images"
+        if images.is_dir():
+            for image_dir in sorted(images.iterdir()):
+                if image_dir.name.startswith("."):
+                    # An export that was given up
+                    shutil.rmtree(image_dir, ignore_errors=True)
+                    continue
+                used = self.root / "used" / image_dir.name
+                try:
+                    last_used = used.stat().st_mtime
+                except FileNotFoundError:
+                    last_used = image_dir.stat().st_mtime
+                if last_used < limit:
+                    shutil.rmtree(image_dir)
+                    with contextlib.suppress(FileNotFoundError):
+                        used.unlink()
+                    removed.append(image_dir.name)
+        blobs = self.root / "blobs"
+        if blobs.is_dir():
+            for blob in blobs.iterdir():
+                # The images link to the blobs they use
+                if blob.stat().st_nlink == 1:
+                    blob.unlink()
+        return removed
+
+
+def image_id(image: str) -> str:
+    result = subprocess.run(
+        ["docker", "image", "inspect", "--format", "{{.Id}}", image],
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    if result.returncode != 0:
+        raise Exception("Can't inspect image {}: {}".format(image, result.stderr))
+    return result.stdout.strip()
+
+
+def export(
+    store: ImageStore, image: str, key: Optional[str] = None, layers: bool = False
+) -> bool:
+    """Exports the image if it isn't in the store yet.
+    :param key: the id of the image, if the name may point to a newer image
+    by now or doesn't exist anymore. The image is saved by its name if it
+    still has this id, so the export keeps the name.
+    :returns: if the image was exported"""
+    if key is not None and _touch(store, key):
+        return False
+    name_id: Optional[str] = None
+    if not _is_digest(image):
+        try:
+            name_id = image_id(image)
+        except Exception:  # pylint: disable=broad-except
+            # The tag was removed or renamed, the image is saved by its id
+            if key is None:
+                raise
+    if key is None:
+        key = name_id or image
+    if name_id is not None:
+        reference = image if _digest(name_id) == _digest(key) else key
+    else:
+        reference = image if _is_digest(image) else key
+    with store.lock():
+        if store.has(key):
+            store.touch(key)
+            return False
+        with subprocess.Popen(
+            ["docker", "image", "save", reference], stdout=subprocess.PIPE
+        ) as save:
+            assert save.stdout is not None
+            try:
+                store.add(key, save.stdout, layers)
+            finally:
+                returncode = save.wait()
+            if returncode != 0:
+                # The export may be incomplete
+                shutil.rmtree(store.image_dir(key), ignore_errors=True)
+                raise Exception(
+                    "docker image save {} returned {}".format(key, returncode)
+                )
+    return True
+
+
+def _touch(store: ImageStore, key: str) -> bool:
+    """:returns: if the image is in the store, it is marked as used then"""
+    with store.lock():
+        if store.has(key):
+            store.touch(key)
+            return True
+    return False
+
+
+def _digest(image_id: str) -> str:
+    """The hex digest of an image id, with or without the sha256: prefix"""
+    return image_id.split(":", 1)[-1]
+
+
+def _is_digest(image: str) -> bool:
+    digest = _digest(image)
+    return len(digest) == 64 and all(c in "0123456789abcdef" for c in digest)
+
+
+def _member_path(name: str) -> str:
+    """The path of a member of the export, which can't leave the image dir"""
+    parts = [part for part in name.split("/") if part not in ("", ".", "..")]
+    if not parts:
+        raise Exception("Invalid member {} in the export".format(name))
+    return os.path.join(*parts)
+
+
+def main(argv: Optional[list[str]] = None) -> None:
+    ap = argparse.ArgumentParser(prog="rsnapshot-docker-compose-images")
+    commands = ap.add_subparsers(dest="command", required=True)
+    export_command = commands.add_parser(
+        "export", help="Export an image if it isn't in the store yet"
+    )
+    export_command.add_argument("image", help="The name or the id of the image")
+    export_command.add_argument(
+        "--id",
+        help="The id of the image that the container uses, the store is keyed by it",
+        default=None,
+    )
+    export_command.add_argument(
+        "--layers",
+        action="store_true",
+        help="Store the files of the export by their digest, "
+        "so layers that several images share are stored once",
+    )
+    gc_command = commands.add_parser(
+        "gc", help="Remove the images that weren't used for the retention time"
+    )
+    for command in [export_command, gc_command]:
+        command.add_argument("--store", required=True, help="The dir of the store")
+        command.add_argument(
+            "--retention-days",
+            type=float,
+            help="Remove the images that weren't used for this many days, "
+            "export only collects with this option",
+            default=None if command is export_command else DEFAULT_RETENTION_DAYS,
+        )
+    args = ap.parse_args(argv)
+    store = ImageStore(Path(args.store))
+    if args.command == "export":
+        if export(store, args.image, args.id, args.layers):
+            print("Exported {}".format(args.image))
+    if args.retention_days is not None:
+        with store.lock():
+            for removed in store.collect(args.retention_days * 24 * 3600):
+                print("Removed {}".format(removed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+"""Timings of the phases and docker commands of a run.
+Nothing is recorded unless the registry is enabled, e.g. with --profile."""
+
+import contextlib
+from dataclasses import dataclass, field
+import threading
+import time
+from typing import Any, ContextManager, Iterator, Optional
+
+# Longer command lines are shortened in the report
+MAX_ARGV_LENGTH = 100
+
+
+@dataclass
+class Span:
+    name: str
+    # Seconds since the registry was reset
+    start: float
+    duration: float
+    lane: str
+    args: dict[str, str] = field(default_factory=dict)
+
+
+class Metrics:
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        self.spans: list[Span] = []
+        self._origin = time.perf_counter()
+        self._lock = threading.Lock()
+        self._busy_lanes: set[int] = set()
+
+    @contextlib.contextmanager
+    def span(
+        self, name: str, concurrent: bool = False, **args: Optional[str]
+    ) -> Iterator[None]:
+        """Records the wall time of the block.
+        Concurrent spans (e.g. coroutines that run on the event loop) get their
+        own lane in the trace, so that they don't overlap."""
+        if not self.enabled:
+            yield
+            return
+        lane = self._acquire_lane() if concurrent else None
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            end = time.perf_counter()
+            if lane is None:
+                lane_name = threading.current_thread().name
+            else:
+                lane_name = "tasks {}".format(lane)
+                self._release_lane(lane)
+            span = Span(
+                name,
+                start - self._origin,
+                end - start,
+                lane_name,
+                {k: v for k, v in args.items() if v is not None},
+            )
+            with self._lock:
+                self.spans.append(span)
+
+    def _acquire_lane(self) -> int:
+        with self._lock:
+            lane = 0
+            while lane in self._busy_lanes:
+                lane += 1
+            self._busy_lanes.add(lane)
+            return lane
+
+    def _release_lane(self, lane: int) -> None:
+        with self._lock:
+            self._busy_lanes.discard(lane)
+
+    def phases(self) -> dict[str, dict[str, float]]:
+        result: dict[str, dict[str, float]] = {}
+        for span in self.spans:
+            phase = result.setdefault(span.name, {"calls": 0, "seconds": 0.0})
+            phase["calls"] += 1
+            phase["seconds"] += span.duration
+        return result
+
+    def projects(self) -> dict[str, dict[str, float]]:
+        """The time of the spans of every project, commands are counted in
+        their own phase, as they run during the other phases"""
+        result: dict[str, dict[str, float]] = {}
+        for span in self.spans:
+            if "project" in span.args:
+                project = result.setdefault(span.args["project"], {})
+                project[span.name] = project.get(span.name, 0.0) + span.duration
+        return result
+
+    def slowest_commands(self, count: int = 10) -> list[Span]:
+        commands = [s for s in self.spans if s.name == "command"]
+        return sorted(commands, key=lambda s: s.duration, reverse=True)[:count]
+
+    def report(self) -> dict[str, Any]:
+        return {
+            "phases": self.phases(),
+            "projects": self.projects(),
+            "slowest_commands": [
+                {"seconds": s.duration, **s.args} for s in self.slowest_commands()
+            ],
+        }
+
+    def text_report(self) -> str:
+        lines = ["Phases:"]
+        for name, phase in sorted(
+            self.phases().items(), key=lambda p: p[1]["seconds"], reverse=True
+        ):
+            lines.append(
+                "  {:<20} {:>6} calls {:>9.3f}s".format(
+                    name, int(phase["calls"]), phase["seconds"]
+                )
+            )
+        lines.append("Projects:")
+        for project, phases in sorted(self.projects().items()):
+            lines.append("  {}".format(project))
+            for name, seconds in sorted(phases.items()):
+                lines.append("    {:<18} {:>9.3f}s".format(name, seconds))
+        lines.append("Slowest commands:")
+        for span in self.slowest_commands():
+            lines.append(
+                "  {:>9.3f}s  {}".format(span.duration, span.args.get("argv", ""))
+            )
+        return "\n".join(lines)
+
+    def chrome_trace(self) -> dict[str, Any]:
+        """The spans in the trace event format of chrome://tracing and Perfetto"""
+        lanes: dict[str, int] = {}
+        events: list[dict[str, Any]] = []
+        for span in self.spans:
+            tid = lanes.setdefault(span.lane, len(lanes) + 1)
+            events.append(
+                {
+                    "name": span.name,
+                    "ph": "X",
+                    "ts": span.start * 1e6,
+                    "dur": span.duration * 1e6,
+                    "pid": 1,
+                    "tid": tid,
+                    "args": span.args,
+                }
+            )
+        for lane, tid in lanes.items():
+            events.append(
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": 1,
+                    "tid": tid,
+                    "args": {"name": lane},
+                }
+            )
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+
+def summarize_argv(argv: list[str]) -> str:
+    summary = " ".join(argv)
+    if len(summary) > MAX_ARGV_LENGTH:
+        return summary[: MAX_ARGV_LENGTH - 3] + "..."
+    return summary
+
+
+_registry = Metrics()
+
+
+def registry() -> Metrics:
+    return _registry
+
+
+def reset(enabled: bool = False) -> Metrics:
+    # pylint: disable=global-statement
+    global _registry
+    _registry = Metrics(enabled)
+    return _registry
+
+
+def span(
+    name: str, concurrent: bool = False, **args: Optional[str]
+) -> ContextManager[None]:
+    """Shortcut for a span of the current registry"""
+    return _registry.span(name, concurrent, **args)
@@ -0,0 +1,185 @@
+"""Finds the compose project dirs below the root folder.
+The scan doesn't descend into project dirs, excluded dirs or below the max
+depth, so data folders with many files aren't walked. Listings of unchanged
+dirs can be taken from a DiscoveryCache, that is validated by the mtimes."""
+
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from fnmatch import fnmatch
+import os
+from pathlib import Path, PurePosixPath
+from typing import Any, Iterable, Optional
+
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache
+from rsnapshot_docker_compose_backup.docker.compose_file import COMPOSE_FILES
+
+IGNORE_FILE = ".backupignore"
+
+
+@dataclass
+class ScanOptions:
+    # How many levels below the root are scanned, None is unlimited
+    max_depth: Optional[int] = None
+    # Globs of dirs that aren't scanned, relative to the root or a dir name
+    excludes: list[str] = field(default_factory=list)
+    # Search for projects below other projects
+    nested: bool = False
+    threads: int = 1
+
+
+@dataclass
+class Listing:
+    subdirs: list[str]
+    compose: bool
+    # The patterns of the .backupignore file of the dir
+    ignore: list[str]
+
+
+@dataclass
+class _Pending:
+    directory: Path
+    depth: int
+    # Ignore patterns of the dir and its parents, with the dir they belong to
+    rules: list[tuple[Path, str]]
+
+
+def find_compose_dirs(
+    root: Path,
+    options: Optional[ScanOptions] = None,
+    index: Optional[DiscoveryCache] = None,
+) -> list[Path]:
+    """:returns: the sorted compose dirs below the root, including the root"""
+    if options is None:
+        options = ScanOptions()
+    result: list[Path] = []
+    level = [_Pending(root, 0, [])]
+    executor = ThreadPoolExecutor(options.threads) if options.threads > 1 else None
+    try:
+        while level:
+            directories = [pending.directory for pending in level]
+            listings: Iterable[Listing]
+            if executor is None:
+                listings = [list_dir(d, index) for d in directories]
+            else:
+                listings = executor.map(lambda d: list_dir(d, index), directories)
+            next_level: list[_Pending] = []
+            for pending, listing in zip(level, listings):
+                next_level.extend(_descend(root, pending, listing, options, result))
+            level = next_level
+    finally:
+        if executor is not None:
+            executor.shutdown()
+    return sorted(result)
+
+
+def _descend(
+    root: Path,
+    pending: _Pending,
+    listing: Listing,
+    options: ScanOptions,
+    result: list[Path],
+) -> list[_Pending]:
+    if listing.compose:
+        result.append(pending.directory)
+        if not options.nested:
+            return []
+    if options.max_depth is not None and pending.depth >= options.max_depth:
+        return []
+    rules = pending.rules + [(pending.directory, p) for p in listing.ignore]
+    children: list[_Pending] = []
+    for name in listing.subdirs:
+        child = pending.directory / name
+        if not _excluded(root, child, options.excludes, rules):
+            children.append(_Pending(child, pending.depth + 1, rules))
+    return children
+
+
+def _excluded(
+    root: Path, directory: Path, excludes: list[str], rules: list[tuple[Path, str]]
+) -> bool:
+    for base, pattern in [(root, p) for p in excludes] + rules:
+        relative = PurePosixPath(directory.relative_to(base))
+        pattern = pattern.strip("/")
+        if fnmatch(str(relative), pattern) or fnmatch(directory.name, pattern):
+            return True
+    return False
+
+
+def list_dir(directory: Path, index: Optional[DiscoveryCache] = None) -> Listing:
+    """Lists a dir, unreadable dirs are empty like in os.walk"""
+    try:
+        mtime = str(os.stat(directory).st_mtime_ns)
+    except OSError:
+        return Listing([], False, [])
+    if index is not None:
+        cached = index.get(str(directory), mtime)
+        if cached is not None:
+            return _cached_listing(directory, index, mtime, cached)
+    subdirs: list[str] = []
+    compose = False
+    ignore_mtime: Optional[int] = None
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.name in COMPOSE_FILES:
+                    compose = True
+                elif entry.name == IGNORE_FILE:
+                    ignore_mtime = entry.stat().st_mtime_ns
+    except OSError:
+        return Listing([], False, [])
+    subdirs.sort()
+    listing = Listing(subdirs, compose, [])
+    if ignore_mtime is not None:
+        listing.ignore = read_ignore_file(directory / IGNORE_FILE)
+    if index is not None:
+        _store(directory, index, mtime, listing, ignore_mtime)
+    return listing
+
+
+def _cached_listing(
+    directory: Path, index: DiscoveryCache, mtime: str, cached: Any
+) -> Listing:
+    listing = Listing(cached["subdirs"], cached["compose"], cached["ignore"])
+    if cached["ignore_mtime"] is not None:
+        # Changing the content of a file doesn't change the mtime of its dir
+        try:
+            ignore_mtime = os.stat(directory / IGNORE_FILE).st_mtime_ns
+        except OSError:
+            ignore_mtime = None
+        if ignore_mtime != cached["ignore_mtime"]:
+            listing.ignore = []
+            if ignore_mtime is not None:
+                listing.ignore = read_ignore_file(directory / IGNORE_FILE)
+            _store(directory, index, mtime, listing, ignore_mtime)
+    return listing
+
+
+def _store(
+    directory: Path,
+    index: DiscoveryCache,
+    mtime: str,
+    listing: Listing,
+    ignore_mtime: Optional[int],
+) -> None:
+    index.put(
+        str(directory),
+        mtime,
+        {
+            "subdirs": listing.subdirs,
+            "compose": listing.compose,
+            "ignore": listing.ignore,
+            "ignore_mtime": ignore_mtime,
+        },
+    )
+
+
+def read_ignore_file(file: Path) -> list[str]:
+    """One glob per line, empty lines and lines starting with # are ignored"""
+    try:
+        with open(file, encoding="UTF-8") as ignore_file:
+            lines = [line.strip() for line in ignore_file]
+    except OSError:
+        return []
+    return [line for line in lines if line and not line.startswith("#")]
@@ -0,0 +1,126 @@
+"""Schedules the steps of all containers by project instead of by container.
+The runtime backups of all projects run first, while every service is still
+up. Then every project is stopped once for the backups of all its services,
+instead of once per service, and the projects with the shortest stop window
+go first, so most projects are running again as early as possible."""
+
+from dataclasses import dataclass, field
+import math
+from pathlib import Path
+from typing import Iterable, Iterator, Mapping, Optional
+
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.structure.container import Container
+
+RUNTIME_STEP = "runtime_backup"
+STOP_STEP = "stop"
+# The steps that run while the project is stopped
+WINDOW_STEPS = ["pre_backup", "backup", "post_backup"]
+# The steps that the project is down for
+STOPPED_STEPS = [STOP_STEP] + WINDOW_STEPS + ["restart"]
+
+
+@dataclass
+class ProjectPlan:
+    name: str
+    folder: Path
+    services: list[str] = field(default_factory=list)
+    # The commands of every step, without duplicates
+    steps: dict[str, list[str]] = field(default_factory=dict)
+
+    def add(self, container: Container) -> None:
+        self.services.append(container.service_name)
+        for step in container.config.backupOrder:
+            commands = self.steps.setdefault(step, [])
+            for command in container.config.step_commands(step):
+                # e.g. the stop of the project is the same for every service
+                if command and command not in commands:
+                    commands.append(command)
+
+    @property
+    def stops(self) -> bool:
+        return bool(self.steps.get(STOP_STEP))
+
+    @property
+    def window(self) -> int:
+        """How many commands run while the project is stopped"""
+        if not self.stops:
+            return 0
+        return sum(len(self.steps.get(step, [])) for step in WINDOW_STEPS)
+
+
+def plan_projects(containers: Iterable[Container]) -> list[ProjectPlan]:
+    """Groups the containers by project, in the order of the containers.
+    Skipped containers aren't part of the plan."""
+    plans: dict[Path, ProjectPlan] = {}
+    for container in containers:
+        if container.config.skipped():
+            continue
+        plan = plans.get(container.folder)
+        if plan is None:
+            plan = ProjectPlan(container.project_name, container.folder)
+            plans[container.folder] = plan
+        plan.add(container)
+    return list(plans.values())
+
+
+def order_projects(
+    plans: list[ProjectPlan],
+    seconds: Optional[Mapping[str, float]] = None,
+    longest_first: bool = False,
+) -> list[ProjectPlan]:
+    """Orders the projects by their stop window, projects with the same
+    estimate keep their order. If the seconds of the projects are known from
+    earlier runs, they are used instead and unknown projects come last
+    (or first if the longest projects come first)."""
+    if seconds is None:
+        return sorted(plans, key=lambda plan: plan.window, reverse=longest_first)
+    known = seconds
+    return sorted(
+        plans,
+        key=lambda plan: known.get(plan.name, math.inf),
+        reverse=longest_first,
+    )
+
+
+def iter_schedule(
+    containers: Iterable[Container],
+    windows: Optional[Mapping[str, float]] = None,
+) -> Iterator[str]:
+    """:param windows: the seconds of the stop windows of earlier runs"""
+    plans = plan_projects(containers)
+    for plan in plans:
+        yield from _block(plan, "runtime backup", [RUNTIME_STEP])
+    for plan in order_projects(plans, windows):
+        steps = [step for step in DefaultConfig.backupOrder if step != RUNTIME_STEP]
+        seconds = windows.get(plan.name) if windows is not None else None
+        yield from _block(plan, "backup", steps, seconds)
+
+
+def _block(
+    plan: ProjectPlan, kind: str, steps: list[str], seconds: Optional[float] = None
+) -> Iterator[str]:
+    if not any(plan.steps.get(step) for step in steps):
+        return
+    yield "##Start {} for compose project {} - services {}".format(
+        kind, plan.name, ", ".join(plan.services)
+    )
+    if plan.stops and STOP_STEP in steps:
+        window = "{} command{}".format(plan.window, "" if plan.window == 1 else "s")
+        if seconds is not None:
+            window += ", about {:.0f}s".format(seconds)
+        yield "#Expected stop window: {}".format(window)
+    log_time = DefaultConfig.get_instance().settings["logTime"]
+    for step in steps:
+        commands = plan.steps.get(step)
+        if not commands:
+            continue
+        yield "#{}".format(step)
+        for command in commands:
+            if log_time:
+                yield "backup_exec\t/bin/date +%s"
+            yield command
+    if log_time:
+        yield "backup_exec\t/bin/date +%s"
+    yield "##End {} for compose project {}".format(kind, plan.name)
+    yield ""
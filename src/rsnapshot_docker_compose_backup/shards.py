@@ -0,0 +1,66 @@
+"""Splits the projects into groups with about the same amount of data, e.g.
+for several rsnapshot configs that run at the same time. A project is never
+split, so it is stopped and started only once."""
+
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable
+
+from rsnapshot_docker_compose_backup.structure.container import Container
+
+
+@dataclass
+class Shard:
+    index: int
+    containers: list[Container] = field(default_factory=list)
+    size: int = 0
+
+    @property
+    def projects(self) -> list[Path]:
+        return list(dict.fromkeys(container.folder for container in self.containers))
+
+
+def project_sizes(containers: Iterable[Container]) -> dict[Path, int]:
+    """The bytes of the volumes that every project backs up, volumes that
+    several services use are counted once. Shared volumes that another
+    project backs up aren't counted."""
+    volumes: dict[Path, dict[str, int]] = {}
+    for container in containers:
+        project = volumes.setdefault(container.folder, {})
+        for volume in container.config.owned_volumes():
+            project[volume.name] = volume.size or 0
+    return {folder: sum(sizes.values()) for folder, sizes in volumes.items()}
+
+
+def pack(containers: list[Container], count: int) -> list[Shard]:
+    """Puts the biggest project into the smallest shard until all projects
+    are distributed. The containers keep their order within a shard."""
+    shards = [Shard(index) for index in range(count)]
+    sizes = project_sizes(containers)
+    owner: dict[Path, Shard] = {}
+    for folder in sorted(sizes, key=lambda f: sizes[f], reverse=True):
+        smallest = min(shards, key=lambda shard: (shard.size, shard.index))
+        smallest.size += sizes[folder]
+        owner[folder] = smallest
+    for container in containers:
+        owner[container.folder].containers.append(container)
+    return shards
+
+
+def shard_file(output: Path, index: int) -> Path:
+    """e.g. docker.conf becomes docker.0.conf"""
+    return output.with_name("{}.{}{}".format(output.stem, index, output.suffix))
+
+
+def stale_files(output: Path, count: int) -> list[Path]:
+    """The files of shards that an earlier run with more shards wrote"""
+    result: list[Path] = []
+    for file in output.parent.glob("{}.*{}".format(output.stem, output.suffix)):
+        index = file.name[len(output.stem) + 1 : len(file.name) - len(output.suffix)]
+        if (
+            index.isdigit()
+            and int(index) >= count
+            and file == shard_file(output, int(index))
+        ):
+            result.append(file)
+    return sorted(result)
@@ -0,0 +1,160 @@
+"""Estimates how much data the volumes hold.
+The volume dirs are walked by walk_levels, which lists the dirs of a level in
+parallel and also walks them for the fingerprints of the changes module. The
+sizes of the files of a dir are cached with the mtime of the dir, so dirs that
+didn't change aren't listed again. Files that only grow in place don't change
+the mtime of their dir, so the sizes are estimates. Alternatively the
+sizes are taken from ``docker system df -v``."""
+
+from concurrent.futures import ThreadPoolExecutor
+import json
+import os
+import re
+from typing import Callable, Iterable, Optional, TypeVar
+
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+from rsnapshot_docker_compose_backup.utils import command
+
+DEFAULT_THREADS = 8
+# docker prints the sizes with decimal units, e.g. 1.2GB
+SIZE_PATTERN = re.compile(r"^\s*([\d.]+)\s*([kKMGTP]?)B\s*$")
+SIZE_UNITS = {
+    "": 1,
+    "k": 1000,
+    "K": 1000,
+    "M": 1000**2,
+    "G": 1000**3,
+    "T": 1000**4,
+    "P": 1000**5,
+}
+
+T = TypeVar("T")
+
+
+def walk_levels(
+    roots: Iterable[str],
+    list_dir: Callable[[str], Optional[tuple[T, list[str]]]],
+    threads: int = DEFAULT_THREADS,
+) -> dict[str, Optional[list[tuple[str, T]]]]:
+    """Lists the dirs below the roots level by level, the dirs of a level are
+    listed in parallel.
+    :param list_dir: the value of a dir and the names of its subdirs,
+        None if the dir can't be read
+    :returns: the relative path and the value of every dir below a root,
+        None if a dir of the root can't be read"""
+    result: dict[str, Optional[list[tuple[str, T]]]] = {
+        root: [] for root in dict.fromkeys(roots)
+    }
+    # The root that a dir belongs to and the dir relative to the root
+    level = [(root, "") for root in result]
+    with ThreadPoolExecutor(max(threads, 1)) as executor:
+        while level:
+            listings = executor.map(
+                lambda item: list_dir(os.path.join(item[0], item[1])), level
+            )
+            next_level: list[tuple[str, str]] = []
+            for (root, relative), listing in zip(level, listings):
+                values = result[root]
+                if values is None:
+                    continue
+                if listing is None:
+                    result[root] = None
+                    continue
+                value, subdirs = listing
+                values.append((relative, value))
+                next_level.extend(
+                    (root, os.path.join(relative, name)) for name in subdirs
+                )
+            level = next_level
+    return result
+
+
+def scan_sizes(
+    paths: Iterable[str],
+    index: Optional[DiscoveryCache] = None,
+    threads: int = DEFAULT_THREADS,
+) -> dict[str, int]:
+    """:returns: the bytes of the files below every path"""
+    listings = walk_levels(
+        paths, lambda directory: list_sizes(directory, index), threads
+    )
+    # Unreadable dirs are empty, so no path fails
+    return {
+        path: sum(size for _, size in listing or [])
+        for path, listing in listings.items()
+    }
+
+
+def list_sizes(
+    directory: str, index: Optional[DiscoveryCache] = None
+) -> tuple[int, list[str]]:
+    """:returns: the bytes of the files in the dir and its subdirs.
+    Unreadable dirs are empty."""
+    try:
+        mtime = str(os.stat(directory).st_mtime_ns)
+    except OSError:
+        return 0, []
+    if index is not None:
+        cached = index.get(directory, mtime)
+        if cached is not None:
+            return cached[0], cached[1]
+    size = 0
+    subdirs: list[str] = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    subdirs.append(entry.name)
+                elif entry.is_file(follow_symlinks=False):
+                    size += entry.stat(follow_symlinks=False).st_size
+    except OSError:
+        return 0, []
+    if index is not None:
+        index.put(directory, mtime, [size, subdirs])
+    return size, subdirs
+
+
+def docker_sizes() -> dict[str, int]:
+    """:returns: the sizes of all volumes by name, as docker reports them"""
+    result = command(["docker", "system", "df", "-v", "--format", "{{json .}}"])
+    sizes: dict[str, int] = {}
+    for volume in json.loads(result.stdout or "{}").get("Volumes") or []:
+        size = parse_size(str(volume.get("Size", "")))
+        if size is not None:
+            sizes[volume["Name"]] = size
+    return sizes
+
+
+def parse_size(text: str) -> Optional[int]:
+    match = SIZE_PATTERN.match(text)
+    if match is None:
+        return None
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+
+def format_size(size: int) -> str:
+    value = float(size)
+    for unit in ["B", "kB", "MB", "GB", "TB"]:
+        if value < 1000:
+            return "{:.1f} {}".format(value, unit)
+        value /= 1000
+    return "{:.1f} PB".format(value)
+
+
+def measure(
+    volumes: Iterable[Volume],
+    source: str = "scan",
+    index: Optional[DiscoveryCache] = None,
+    threads: int = DEFAULT_THREADS,
+) -> None:
+    """Sets the sizes of the volumes, with the sizes of a scan or of docker"""
+    volume_list = list(volumes)
+    if source == "docker":
+        sizes = docker_sizes()
+        for volume in volume_list:
+            volume.size = sizes.get(volume.name)
+        return
+    scanned = scan_sizes({v.path for v in volume_list}, index, threads)
+    for volume in volume_list:
+        volume.size = scanned[volume.path]
@@ -1,19 +1,48 @@
 from pathlib import Path
-from typing import Optional, Union
+from typing import Any, Iterator, Mapping, Optional, Union
 
 import os
 
-from rsnapshot_docker_compose_backup.docker import docker
+from rsnapshot_docker_compose_backup import (
+    changes,
+    excludes,
+    freeze,
+    metrics,
+    throttle,
+)
+from rsnapshot_docker_compose_backup.docker import docker, host
 from rsnapshot_docker_compose_backup.structure.volume import Volume
 from rsnapshot_docker_compose_backup.config.abstract_config import AbstractConfig
 from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.config.template import (
+    compile_template,
+    names_of,
+    prepare_values,
+    used_variables,
+)
+
+# The variables that need docker queries, they are only looked up if a step uses them
+LAZY_VARS = ["$image", "$volumes", "$imageId"]
 
 
 class Container:
-    folder: Path
-    service_name: str
-    config: "ContainerConfig"
-    volumes: list[Volume]
+    """A service and its container. The image and the volumes are looked up
+    when they are used, so containers that are skipped or whose steps don't
+    use them don't need docker queries."""
+
+    __slots__ = (
+        "folder",
+        "service_name",
+        "container_name",
+        "container_id",
+        "project_name",
+        "file_name",
+        "is_running",
+        "loaded_image",
+        "loaded_volumes",
+        "image_id",
+        "config",
+    )
 
     def __init__(
         self,
@@ -22,37 +51,56 @@ class Container:
         container_name: str,
         container_id: str,
         running: bool,
+        image: Optional[str] = None,
+        volumes: Optional[list[Volume]] = None,
+        image_id: Optional[str] = None,
     ):
         self.folder: Path = folder
         self.service_name = service_name
         self.container_name = container_name
         self.container_id = container_id
         self.project_name = os.path.basename(folder)
-        self.image = docker.image(container_id)
         self.file_name: Path = self.folder / "backup.ini"
-        self.volumes = docker.volumes(container_id)
         self.is_running = running
+        # The results of the docker queries, None until they are needed
+        self.loaded_image = image
+        self.loaded_volumes = volumes
+        self.image_id = image_id
         self.config = ContainerConfig(self)
 
+    @property
+    def image(self) -> str:
+        if self.loaded_image is None:
+            self.loaded_image = docker.image(self.container_id)
+        return self.loaded_image
+
+    @property
+    def volumes(self) -> list[Volume]:
+        if self.loaded_volumes is None:
+            self.loaded_volumes = docker.volumes(self.container_id)
+        return self.loaded_volumes
+
+    def resolve_image_id(self) -> str:
+        if self.image_id is None:
+            self.image_id = docker.image_id(self.container_id)
+        return self.image_id
+
     def backup(self) -> str:
-        result: list[str] = []
-        output = self.config.output()
-        if output is None:
-            # print("output is none")
-            return ""
-        result.append(
-            "##Start backup for compose project {} - service {}".format(
-                self.project_name, self.service_name
-            )
+        return "\n".join(self.iter_backup())
+
+    def iter_backup(self) -> Iterator[str]:
+        """Yields the lines of the backup, joined with newlines they are the
+        same as backup(). Nothing is yielded for skipped containers."""
+        if self.config.skipped():
+            return
+        yield "##Start backup for compose project {} - service {}".format(
+            self.project_name, self.service_name
         )
-        result.append(output)
-        result.append(
-            "##End backup for compose project {} - service {}".format(
-                self.project_name, self.service_name
-            )
+        yield from self.config.lines() or [""]
+        yield "##End backup for compose project {} - service {}".format(
+            self.project_name, self.service_name
         )
-        result.append("")
-        return "\n".join(result)
+        yield ""
 
     def __str__(self) -> str:
         return "Container {} in folder {}".format(self.service_name, self.folder)
@@ -69,51 +117,182 @@ class ContainerConfig(AbstractConfig):
         self.vars["$containerID"] = container.container_id
         self.vars["$containerName"] = container.container_name
         self.vars["$projectFolder"] = str(container.folder)
-        self.vars["$volumes"] = container.volumes
-        self.vars["$image"] = container.image
         self.vars["$projectName"] = container.project_name
+        docker_host = host.current()
+        # Only with --host. The variables are matched by prefix, so the name
+        # isn't the start of shell variables like $HOSTNAME
+        if docker_host is not None:
+            self.vars["$dockerHost"] = docker_host.name
+        self._container = container
         self._is_running = container.is_running
+        self._folder = container.folder
+        self._label = "{}/{}".format(container.project_name, container.service_name)
+        # The project and service that back up a volume instead, by path
+        self._owners: Mapping[str, str] = {}
+        options = dict(self.default_config.freeze_options)
+        options.update(self.freeze_options)
+        self.freeze = freeze.strategy(options)
+        self._exclude_options = dict(self.default_config.exclude_options)
+        self._exclude_options.update(self.exclude_options)
+        # The volumes and their exclude rules, by the path that is backed up
+        self._rules: Optional[dict[str, tuple[Volume, list[excludes.Rule]]]] = None
+        self._used_vars: Optional[frozenset[str]] = None
+        # Why the stop and the backup are skipped, None if they aren't
+        self._unchanged: Optional[tuple[Optional[str]]] = None
+        # The volumes that another service backs up
+        self._references: list[str] = []
+        self._steps: Mapping[str, str] = {}
+        self._values: Optional[tuple[dict[str, Any], tuple[str, ...]]] = None
         self.add_action_content()
 
-    def _all_vars(self) -> dict[str, Union[str, list[Volume]]]:
+    def _static_vars(self) -> dict[str, Union[str, list[Volume]]]:
         variables: dict[str, Union[str, list[Volume]]] = {}
         variables.update(self.default_config.vars)
         variables.update(self.vars)
         return variables
 
+    def _all_vars(self) -> dict[str, Union[str, list[Volume]]]:
+        variables = self._static_vars()
+        used = self.used_vars()
+        if "$image" in used:
+            variables["$image"] = self._container.image
+        if "$volumes" in used:
+            variables["$volumes"] = self.freeze.volumes(self.owned_volumes())
+        if "$imageid" in used:
+            variables["$imageId"] = self._container.resolve_image_id()
+        return variables
+
+    def used_vars(self) -> frozenset[str]:
+        """The lower case names of the variables that the steps use"""
+        if self._used_vars is None:
+            variables = self._static_vars()
+            for name in LAZY_VARS:
+                variables[name] = ""
+            self._used_vars = used_variables(self._steps.values(), variables)
+        return self._used_vars
+
+    def skipped(self) -> bool:
+        return bool(
+            self.default_config.settings["onlyRunning"] and not self._is_running
+        )
+
     def output(self) -> Optional[str]:
-        if self.default_config.settings["onlyRunning"] and not self._is_running:
+        if self.skipped():
             return None
-        result: list[str] = []
+        return "\n".join(self.lines())
+
+    def lines(self) -> list[str]:
+        """The rendered lines of one container, they are few enough to keep"""
+        with metrics.span("render", project=str(self._folder)):
+            return list(self.iter_output())
 
+    def iter_output(self) -> Iterator[str]:
+        reason = self.unchanged()
+        if reason is not None:
+            yield "#Skipped the stop and the backup, {}".format(reason)
+        yield from self._references
         for step in self.backupOrder:
-            backup_action = self.get_step(step)
-            if backup_action:
-                result.append("#{}".format(step))
-                for line in backup_action.splitlines():
-                    script_command = self._resolve_vars(line, self._all_vars()).strip(
-                        "\n"
+            commands = self.step_commands(step)
+            if commands:
+                yield "#{}".format(step)
+                for command in commands:
+                    yield from self._log_time()
+                    yield command
+        yield from self._log_time()
+
+    def step_commands(self, step: str) -> list[str]:
+        """The rendered commands of a step, without the logged times"""
+        if step in changes.SKIPPED_STEPS and self.unchanged() is not None:
+            return []
+        # The freeze strategy adds its commands after the configured ones
+        frozen = self.freeze.commands(
+            step,
+            str(self._folder),
+            self.owned_volumes() if self.freeze.uses_volumes else [],
+        )
+        backup_action = self.get_step(step)
+        if not backup_action:
+            return throttle.apply(
+                step, frozen, self._folder, self._container.project_name
+            )
+        if self._values is None:
+            # The values are the same for every line, the templates of the
+            # lines are compiled once and shared by all containers
+            values = prepare_values(self._all_vars())
+            self._values = (values, names_of(values))
+        values, names = self._values
+        commands: list[str] = []
+        for line in backup_action.splitlines():
+            script_command = compile_template(line, names).render(values).strip("\n")
+            commands.extend(script_command.split("\n"))
+        if excludes.configured(self._exclude_options):
+            commands = [self._add_rules(command) for command in commands]
+        return throttle.apply(
+            step, commands + frozen, self._folder, self._container.project_name
+        )
+
+    def _add_rules(self, command: str) -> str:
+        """Adds the exclude rules to the backup lines of the volumes"""
+        fields = command.split("\t")
+        if fields[0] != "backup" or len(fields) < 3:
+            return command
+        entry = self.volume_rules().get(os.path.normpath(fields[1]))
+        if entry is None:
+            return command
+        return excludes.add_args(command, entry[1])
+
+    def volume_rules(self) -> Mapping[str, tuple[Volume, list[excludes.Rule]]]:
+        """The volumes that the service backs up and their exclude rules, by
+        the path that is backed up. The volumes are only scanned once."""
+        if self._rules is None:
+            self._rules = {}
+            if excludes.configured(self._exclude_options):
+                owned = self.owned_volumes()
+                for volume, backed_up in zip(owned, self.freeze.volumes(owned)):
+                    rules = excludes.volume_rules(
+                        volume, self._exclude_options, self._container.project_name
                     )
-                    single_commands: list[str] = []
-                    if "\n" in script_command:
-                        single_commands = script_command.split("\n")
-                    else:
-                        single_commands.append(script_command)
-                    for command in single_commands:
-                        self._log_time(result)
-                        result.append(command)
-        self._log_time(result)
-        return "\n".join(result)
-
-    def _log_time(self, result: list[str]) -> None:
+                    self._rules[os.path.normpath(backed_up.path)] = (volume, rules)
+        return self._rules
+
+    def reference_volumes(self, owners: Mapping[str, str]) -> None:
+        """Leaves the volumes out that another service backs up
+        :param owners: the project and service of the owner, by volume path"""
+        self._owners = owners
+        for volume in self._container.volumes:
+            owner = owners.get(os.path.normpath(volume.path))
+            if owner is not None:
+                self._references.append(
+                    "#Volume {} is backed up by {}".format(volume.name, owner)
+                )
+        self._values = None
+
+    def owned_volumes(self) -> list[Volume]:
+        """The volumes that the container backs up, without the ones that
+        another service backs up"""
+        return [
+            volume
+            for volume in self._container.volumes
+            if os.path.normpath(volume.path) not in self._owners
+        ]
+
+    def unchanged(self) -> Optional[str]:
+        """Why the stop and the backup of the container can be skipped,
+        the volumes are only compared once"""
+        if self._unchanged is None:
+            reason = None
+            if changes.current() is not None:
+                reason = changes.skip_reason(self._label, self._container.volumes)
+            self._unchanged = (reason,)
+        return self._unchanged[0]
+
+    def _log_time(self) -> Iterator[str]:
         log_time = self.default_config.settings["logTime"]
         if log_time:
-            result.append("backup_exec\t/bin/date +%s")
+            yield "backup_exec\t/bin/date +%s"
 
     def get_step(self, step: str) -> str:
-        if self.backup_steps.get(step, ""):
-            return self.backup_steps.get(step, "")
-        return self.default_config.get_step(step)
+        return self._steps.get(step, "")
 
     def get_enabled_actions(self) -> dict[str, bool]:
         merged_dict = self.default_config.enabled_actions.copy()
@@ -121,8 +300,10 @@ class ContainerConfig(AbstractConfig):
         return merged_dict
 
     def add_action_content(self) -> None:
-        for action, enabled in sorted(self.get_enabled_actions().items()):
-            if enabled:
-                commands = self.default_config.get_action(action)
-                for step in commands:
-                    self.backup_steps[step] += commands[step].strip() + "\n"
+        enabled_actions = self.enabled_actions
+        if not self.freeze.uses_stop_action:
+            enabled_actions = dict(enabled_actions)
+            enabled_actions[freeze.STOP_ACTION] = False
+        self._steps = self.default_config.merged_steps(
+            self.backup_steps, enabled_actions
+        )
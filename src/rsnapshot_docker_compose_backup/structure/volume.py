@@ -1,7 +1,12 @@
+from typing import Optional
+
+
 class Volume:
-    def __init__(self, name: str, path: str):
+    def __init__(self, name: str, path: str, size: Optional[int] = None):
         self.name = name
         self.path = path
+        # Estimated bytes, None if the volume wasn't measured
+        self.size = size
 
     def __lt__(self, other: "Volume") -> bool:
         return self.name < other.name
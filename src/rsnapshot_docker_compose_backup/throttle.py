@@ -0,0 +1,180 @@
+"""Throttles the I/O of the generated backup commands, so backups that run
+while the services serve traffic don't take all the bandwidth of the disks.
+The budget is set in the settings section of the global config::
+
+    [settings]
+    # Bytes per second for all backups, K, M and G are powers of 1024 and a
+    # number without a unit is KiB like for rsync --bwlimit
+    ioBudget = 50M
+    # A fixed budget for one project, by its name
+    ioBudget.nextcloud = 20M
+    # The I/O class of the backup commands: idle or best-effort
+    ioNice = idle
+    nice = 10
+    # How many projects --execute backs up at the same time at most
+    ioConcurrency = 2
+
+The budget is divided by the projects that are backed up at the same time.
+If the sizes of the volumes are known, a project gets a share of the budget
+proportional to its size, so the projects that run together finish together.
+The backup lines get ``+rsync_long_args=--bwlimit=...`` and the commands of
+backup_exec and backup_script run with ionice and nice. Only the runtime
+backup and the backup are throttled, the stop windows aren't made longer."""
+
+from dataclasses import dataclass, field
+import re
+import shlex
+from pathlib import Path
+from typing import Mapping, Optional
+
+from rsnapshot_docker_compose_backup.utils import add_long_args
+
+# The options of the settings section, ioBudget can also be set per project
+OPTIONS = ["iobudget", "ionice", "nice", "ioconcurrency"]
+THROTTLED_STEPS = ["runtime_backup", "backup"]
+IONICE_CLASSES = {"idle": ["-c", "3"], "best-effort": ["-c", "2", "-n", "7"]}
+# rsnapshot wants the full path of the scripts
+IONICE = "/usr/bin/ionice"
+NICE = "/usr/bin/nice"
+SHELL = "/bin/sh"
+RATE_PATTERN = re.compile(r"^\s*(\d+(?:\.\d+)?)\s*([kKmMgG]?)i?[bB]?\s*$")
+RATE_UNITS = {"": 1024, "k": 1024, "m": 1024**2, "g": 1024**3}
+# The smallest share of a project, relative to the share of the biggest one
+MIN_SHARE = 0.1
+
+
+def parse_rate(text: str) -> int:
+    """:returns: the bytes per second of a rate like 50M"""
+    match = RATE_PATTERN.match(text)
+    if match is None:
+        raise Exception("Invalid I/O budget {}".format(text))
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2).lower()])
+
+
+@dataclass
+class Budget:
+    # Bytes per second, None if the bandwidth isn't limited
+    total: Optional[int] = None
+    # The fixed budgets of projects, by their name in lower case
+    projects: dict[str, int] = field(default_factory=dict)
+    ionice: Optional[str] = None
+    nice: Optional[int] = None
+    # The most projects that run at the same time, None if it isn't capped
+    concurrency: Optional[int] = None
+
+    @property
+    def limited(self) -> bool:
+        return bool(
+            self.total is not None
+            or self.projects
+            or self.ionice is not None
+            or self.nice is not None
+            or self.concurrency is not None
+        )
+
+
+def parse_budget(options: Mapping[str, str]) -> Budget:
+    """The budget of the throttle options of the settings section"""
+    budget = Budget()
+    for name, value in options.items():
+        name = name.lower()
+        if name == "iobudget":
+            budget.total = parse_rate(value)
+        elif name.startswith("iobudget."):
+            budget.projects[name[len("iobudget.") :]] = parse_rate(value)
+        elif name == "ionice":
+            if value.strip().lower() not in IONICE_CLASSES:
+                raise Exception(
+                    "Unknown I/O class {}, use one of {}".format(
+                        value, ", ".join(IONICE_CLASSES)
+                    )
+                )
+            budget.ionice = value.strip().lower()
+        elif name == "nice":
+            budget.nice = int(value)
+        elif name == "ioconcurrency":
+            budget.concurrency = max(int(value), 1)
+    return budget
+
+
+class Throttle:
+    def __init__(self, budget: Budget, concurrency: int = 1):
+        """:param concurrency: how many projects are backed up at the same time"""
+        self.budget = budget
+        self.concurrency = max(concurrency, 1)
+        # The proportional shares of the projects, by their folder
+        self.shares: dict[Path, int] = {}
+
+    def lane_budget(self) -> Optional[int]:
+        if self.budget.total is None:
+            return None
+        return self.budget.total // self.concurrency
+
+    def assign(self, sizes: Mapping[Path, int]) -> None:
+        """Divides the budget proportional to the sizes of the projects. The
+        shares grow with the size, so the biggest projects that can run at the
+        same time get the whole budget together and any other projects that
+        run together get less."""
+        if self.budget.total is None or not any(size > 0 for size in sizes.values()):
+            return
+        floor = max(sizes.values()) * MIN_SHARE
+        weights = {folder: max(size, floor) for folder, size in sizes.items()}
+        together = sum(sorted(weights.values(), reverse=True)[: self.concurrency])
+        for folder, weight in weights.items():
+            self.shares[folder] = int(self.budget.total * weight / together)
+
+    def rate(self, folder: Path, project_name: str) -> Optional[int]:
+        """The bytes per second of a project, None if it isn't limited"""
+        fixed = self.budget.projects.get(project_name.lower())
+        if fixed is not None:
+            return fixed
+        return self.shares.get(folder, self.lane_budget())
+
+    def wrapper(self) -> list[str]:
+        """The ionice and nice command that the throttled commands run with"""
+        prefix: list[str] = []
+        if self.budget.ionice is not None:
+            prefix += [IONICE, *IONICE_CLASSES[self.budget.ionice]]
+        if self.budget.nice is not None:
+            prefix += [NICE, "-n", str(self.budget.nice)]
+        return prefix
+
+    def apply(
+        self, step: str, commands: list[str], folder: Path, project_name: str
+    ) -> list[str]:
+        """Throttles the commands of a step of a project"""
+        if step not in THROTTLED_STEPS:
+            return commands
+        rate = self.rate(folder, project_name)
+        bwlimit = [] if rate is None else ["--bwlimit={}".format(max(rate // 1024, 1))]
+        prefix = " ".join(self.wrapper())
+        result: list[str] = []
+        for command in commands:
+            fields = command.split("\t")
+            if fields[0] == "backup" and len(fields) >= 3:
+                command = add_long_args(command, bwlimit)
+            elif fields[0] in ["backup_exec", "backup_script"] and prefix:
+                fields[1] = "{} {} -c {}".format(prefix, SHELL, shlex.quote(fields[1]))
+                command = "\t".join(fields)
+            result.append(command)
+        return result
+
+
+_throttle: Optional[Throttle] = None
+
+
+def use(throttle: Optional[Throttle]) -> None:
+    # pylint: disable=global-statement
+    global _throttle
+    _throttle = throttle
+
+
+def current() -> Optional[Throttle]:
+    return _throttle
+
+
+def apply(step: str, commands: list[str], folder: Path, project_name: str) -> list[str]:
+    """:returns: the commands, throttled if a budget is set"""
+    if _throttle is None:
+        return commands
+    return _throttle.apply(step, commands, folder, project_name)
@@ -1,10 +1,14 @@
 from __future__ import annotations
+import asyncio
 from pathlib import Path
 from re import Match, Pattern
 
 import subprocess
 from typing import Optional
 
+from rsnapshot_docker_compose_backup import metrics
+from rsnapshot_docker_compose_backup.docker import host
+
 
 class CaseInsensitiveRe:
     def __init__(self, regex: Pattern[str]):
@@ -25,6 +29,20 @@ class CaseInsensitiveMatch:
         return self.match.group(name).lower()
 
 
+def add_long_args(line: str, args: list[str]) -> str:
+    """Adds rsync args to the options of a backup line of the rsnapshot config,
+    e.g. ``+rsync_long_args=--exclude=tmp/``"""
+    if not args:
+        return line
+    options = ",".join("+rsync_long_args={}".format(arg) for arg in args)
+    fields = line.split("\t")
+    if len(fields) > 3 and fields[3]:
+        fields[3] = "{},{}".format(fields[3], options)
+    else:
+        fields[3:] = [options]
+    return "\t".join(fields)
+
+
 def command(
     cmd: str | list[str], path: Optional[Path] = None
 ) -> subprocess.CompletedProcess[str]:
@@ -32,6 +50,17 @@ def command(
         split_cmd = cmd
     else:
         split_cmd = cmd.split()
+    with metrics.span(
+        "command",
+        argv=metrics.summarize_argv(split_cmd),
+        project=str(path) if path is not None else None,
+    ):
+        return _run(split_cmd, path)
+
+
+def _run(
+    split_cmd: list[str], path: Optional[Path]
+) -> subprocess.CompletedProcess[str]:
     if path is not None:
         res = subprocess.run(
             split_cmd,
@@ -39,6 +68,7 @@ def command(
             universal_newlines=True,
             stdout=subprocess.PIPE,
             check=False,
+            env=host.environment(),
         )
     else:
         res = subprocess.run(
@@ -46,5 +76,52 @@ def command(
             universal_newlines=True,
             stdout=subprocess.PIPE,
             check=False,
+            env=host.environment(),
         )
     return res
+
+
+async def async_command(
+    cmd: str | list[str],
+    path: Optional[Path] = None,
+    limit: Optional[asyncio.Semaphore] = None,
+) -> subprocess.CompletedProcess[str]:
+    """Like command, but doesn't block the event loop.
+    The limit caps how many commands run at the same time."""
+    if isinstance(cmd, list):
+        split_cmd = cmd
+    else:
+        split_cmd = cmd.split()
+    if limit is None:
+        return await _run_async(split_cmd, path)
+    async with limit:
+        return await _run_async(split_cmd, path)
+
+
+async def _run_async(
+    split_cmd: list[str], path: Optional[Path]
+) -> subprocess.CompletedProcess[str]:
+    with metrics.span(
+        "command",
+        concurrent=True,
+        argv=metrics.summarize_argv(split_cmd),
+        project=str(path) if path is not None else None,
+    ):
+        process = await asyncio.create_subprocess_exec(
+            *split_cmd,
+            cwd=path,
+            stdout=asyncio.subprocess.PIPE,
+            env=host.environment(),
+        )
+        try:
+            stdout, _ = await process.communicate()
+        except asyncio.CancelledError:
+            # e.g. the host timed out, the command must not keep running
+            process.kill()
+            await process.wait()
+            raise
+    return subprocess.CompletedProcess(
+        split_cmd,
+        process.returncode if process.returncode is not None else -1,
+        stdout=stdout.decode().replace("\r\n", "\n"),
+    )
@@ -0,0 +1,125 @@
+"""Index of the volumes of all containers, by the path of the volume.
+A volume that several services mount (e.g. an app and its workers) is backed
+up by one of them, its owner. The other services leave it out and reference
+the owner instead. Volumes whose paths are inside the path of another volume
+are reported, their files are backed up twice."""
+
+from dataclasses import dataclass, field
+import os
+import sys
+from typing import Iterable, Optional, TextIO
+
+from rsnapshot_docker_compose_backup.docker import docker
+from rsnapshot_docker_compose_backup.docker.compose_file import normalize_project_name
+from rsnapshot_docker_compose_backup.structure.container import Container
+
+# copy backs up a shared volume with every service, like without an index
+POLICIES = ["copy", "first", "project"]
+
+
+@dataclass
+class IndexEntry:
+    path: str
+    name: str
+    # The containers that mount the volume, in the order of the discovery
+    users: list[Container] = field(default_factory=list)
+    owner: Optional[Container] = None
+
+
+class VolumeIndex:
+    def __init__(self, containers: Iterable[Container]):
+        self.entries: dict[str, IndexEntry] = {}
+        for container in containers:
+            # Skipped containers don't back up anything, so they can't own a volume
+            if container.config.skipped():
+                continue
+            for volume in container.volumes:
+                path = os.path.normpath(volume.path)
+                entry = self.entries.get(path)
+                if entry is None:
+                    entry = IndexEntry(path, volume.name)
+                    self.entries[path] = entry
+                if container not in entry.users:
+                    entry.users.append(container)
+
+    def assign(self, policy: str) -> None:
+        """Chooses the owner of every volume.
+        first: the first service that was discovered.
+        project: the first service of the project that created the volume,
+        compose prefixes the names of the volumes with the project name."""
+        if policy not in POLICIES:
+            raise Exception("Unknown volume policy {}".format(policy))
+        for entry in self.entries.values():
+            entry.owner = entry.users[0]
+            if policy == "project":
+                for container in entry.users:
+                    if any(
+                        entry.name.lower().startswith(name + "_")
+                        for name in _project_names(container)
+                    ):
+                        entry.owner = container
+                        break
+
+    def overlaps(self) -> list[tuple[IndexEntry, IndexEntry]]:
+        """The volumes that are inside the path of another volume, with the
+        volume they are in"""
+        result: list[tuple[IndexEntry, IndexEntry]] = []
+        for path, entry in sorted(self.entries.items()):
+            parent = os.path.dirname(path)
+            while parent and parent != os.path.dirname(parent):
+                outer = self.entries.get(parent)
+                if outer is not None:
+                    result.append((entry, outer))
+                    break
+                parent = os.path.dirname(parent)
+        return result
+
+    def apply(self) -> None:
+        """Leaves the shared volumes out of the services that don't own them"""
+        owners: dict[Container, dict[str, str]] = {}
+        for entry in self.entries.values():
+            if entry.owner is None:
+                continue
+            for container in entry.users:
+                if container is not entry.owner:
+                    owners.setdefault(container, {})[entry.path] = _label(entry.owner)
+        for container, references in owners.items():
+            container.config.reference_volumes(references)
+
+
+def _project_names(container: Container) -> set[str]:
+    """The lower case names that compose can prefix the volumes of the project
+    with: the normalized name of the dir and the name of the compose project,
+    which can be set in the compose file"""
+    names = {normalize_project_name(container.project_name)}
+    state = docker.fleet().get(container.container_id)
+    if state is not None and state.labels.get(docker.COMPOSE_PROJECT_LABEL):
+        names.add(state.labels[docker.COMPOSE_PROJECT_LABEL].lower())
+    return names
+
+
+def _label(container: Container) -> str:
+    return "{}/{}".format(container.project_name, container.service_name)
+
+
+def share_volumes(
+    containers: Iterable[Container], policy: str, log: Optional[TextIO] = None
+) -> list[Container]:
+    """Gives every volume one owner and reports overlapping volumes.
+    :returns: the containers, the index needs all of them at once"""
+    container_list = list(containers)
+    index = VolumeIndex(container_list)
+    for entry, outer in index.overlaps():
+        print(
+            "Volume {} ({}) is inside volume {} ({}), it is backed up twice".format(
+                entry.name,
+                ", ".join(_label(c) for c in entry.users),
+                outer.name,
+                ", ".join(_label(c) for c in outer.users),
+            ),
+            file=log if log is not None else sys.stderr,
+        )
+    if policy != "copy":
+        index.assign(policy)
+        index.apply()
+    return container_list
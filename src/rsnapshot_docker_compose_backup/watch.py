@@ -0,0 +1,288 @@
+"""Watch mode: the config is built once and then only the projects that are
+affected by docker events are discovered and rendered again.
+The config file is only rewritten if its content changes, and the current
+config can be served over a unix socket."""
+
+from abc import ABC, abstractmethod
+import asyncio
+import json
+import os
+from pathlib import Path
+import queue
+import socket
+import socketserver
+import subprocess
+import threading
+from typing import Any, Iterator, Optional
+
+from rsnapshot_docker_compose_backup import metrics
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache, write_atomic
+from rsnapshot_docker_compose_backup.docker import docker, docker_compose
+from rsnapshot_docker_compose_backup.scanner import ScanOptions
+
+CONTAINER_ACTIONS = {"create", "start", "stop", "die", "destroy", "pause", "unpause"}
+VOLUME_ACTIONS = {"create", "destroy", "remove"}
+# Events that arrive within this time are handled together
+DEBOUNCE_SECONDS = 1.0
+
+Event = dict[str, Any]
+
+
+class EventSource(ABC):
+    @abstractmethod
+    def batches(self) -> Iterator[list[Event]]:
+        """Yields the events in batches, the events of a batch are handled
+        together"""
+
+
+class ScriptedEventSource(EventSource):
+    """Returns fixed batches of events, e.g. for tests.
+    The callback is called before every batch, so that it can change the
+    state that the events describe."""
+
+    def __init__(self, batches: list[list[Event]], callback: Any = None):
+        self._batches = batches
+        self._callback = callback
+
+    def batches(self) -> Iterator[list[Event]]:
+        for index, batch in enumerate(self._batches):
+            if self._callback is not None:
+                self._callback(index)
+            yield batch
+
+
+class DockerEventSource(EventSource):
+    """Reads the events from ``docker events``"""
+
+    command = [
+        "docker",
+        "events",
+        "--format",
+        "{{json .}}",
+        "--filter",
+        "type=container",
+        "--filter",
+        "type=volume",
+    ]
+
+    def __init__(self, debounce: float = DEBOUNCE_SECONDS):
+        self.debounce = debounce
+
+    def batches(self) -> Iterator[list[Event]]:
+        with subprocess.Popen(
+            self.command, stdout=subprocess.PIPE, universal_newlines=True
+        ) as process:
+            events: "queue.Queue[Optional[Event]]" = queue.Queue()
+            reader = threading.Thread(
+                target=self._read, args=(process, events), daemon=True
+            )
+            reader.start()
+            try:
+                while True:
+                    event = events.get()
+                    if event is None:
+                        break
+                    batch = [event]
+                    try:
+                        while True:
+                            event = events.get(timeout=self.debounce)
+                            if event is None:
+                                break
+                            batch.append(event)
+                    except queue.Empty:
+                        pass
+                    yield batch
+                    if event is None:
+                        break
+            finally:
+                process.terminate()
+        raise Exception("docker events stopped with {}".format(process.returncode))
+
+    @staticmethod
+    def _read(
+        process: "subprocess.Popen[str]", events: "queue.Queue[Optional[Event]]"
+    ) -> None:
+        assert process.stdout is not None
+        for line in process.stdout:
+            if line.strip():
+                events.put(json.loads(line))
+        events.put(None)
+
+
+class Watcher:
+    def __init__(
+        self,
+        root_folder: Path,
+        output: Optional[Path] = None,
+        cache: Optional[DiscoveryCache] = None,
+        jobs: int = docker_compose.DEFAULT_JOBS,
+        scan_options: Optional[ScanOptions] = None,
+        dir_index: Optional[DiscoveryCache] = None,
+    ):
+        self.root_folder = root_folder
+        self.output = output
+        self.cache = cache
+        self.jobs = jobs
+        self.scan_options = scan_options
+        self.dir_index = dir_index
+        # The rendered lines and volume names of every project dir
+        self.projects: dict[Path, list[str]] = {}
+        self.volumes: dict[Path, set[str]] = {}
+        # The real paths of dirs below the root with containers that a build
+        # didn't find, e.g. excluded dirs, so they don't cause more builds
+        self.rejected: set[str] = set()
+        self.plan = ""
+        self.rewrites = 0
+
+    def build(self) -> None:
+        """Discovers all projects below the root folder"""
+        docker_dirs = docker_compose.find_docker_dirs(
+            self.root_folder, self.scan_options, self.dir_index
+        )
+        self.projects = {}
+        self.volumes = {}
+        self.refresh(docker_dirs)
+
+    def refresh(self, docker_dirs: list[Path]) -> None:
+        """Discovers and renders the projects in the docker dirs again"""
+        docker.reset_fleet()
+        with metrics.span("discovery"):
+            projects = asyncio.run(self._discover(docker_dirs))
+        for project in projects:
+            containers = list(docker_compose.project_containers(project, self.cache))
+            self.projects[project.directory] = [
+                line for container in containers for line in container.iter_backup()
+            ]
+            # Skipped containers aren't in the config, their volumes aren't
+            # looked up
+            self.volumes[project.directory] = {
+                volume.name
+                for container in containers
+                if not container.config.skipped()
+                for volume in container.volumes
+            }
+        if self.cache is not None:
+            self.cache.save()
+        if self.dir_index is not None:
+            self.dir_index.save()
+        self._publish()
+
+    async def _discover(
+        self, docker_dirs: list[Path]
+    ) -> list[docker_compose.ProjectInfo]:
+        return await docker_compose.discover_dirs_async(
+            docker_dirs, self.cache, asyncio.Semaphore(self.jobs)
+        )
+
+    def handle(self, events: list[Event]) -> None:
+        affected = self.affected(events)
+        if affected is None:
+            self.build()
+            known = {os.path.realpath(d) for d in self.projects}
+            self.rejected -= known
+            self.rejected.update(
+                d for d in map(_working_dir, events) if d is not None and d not in known
+            )
+        elif affected:
+            self.refresh(sorted(affected))
+
+    def affected(self, events: list[Event]) -> Optional[set[Path]]:
+        """The project dirs that the events change.
+        None means that all projects have to be discovered again, because a
+        project dir changed or an unknown project below the root got containers.
+        Dirs that a build didn't find are ignored."""
+        affected: set[Path] = set()
+        known = {os.path.realpath(d): d for d in self.projects}
+        root = os.path.realpath(self.root_folder)
+        for event in events:
+            action = str(event.get("Action", "")).split(":")[0]
+            actor = event.get("Actor", {})
+            if event.get("Type") == "container" and action in CONTAINER_ACTIONS:
+                working_dir = _working_dir(event)
+                if working_dir is None:
+                    continue
+                directory = known.get(working_dir)
+                if directory is None:
+                    if (
+                        working_dir.startswith(root + os.sep)
+                        and working_dir not in self.rejected
+                    ):
+                        return None
+                    continue
+                if not directory.is_dir():
+                    return None
+                affected.add(directory)
+            elif event.get("Type") == "volume" and action in VOLUME_ACTIONS:
+                name = actor.get("ID")
+                affected.update(d for d, v in self.volumes.items() if name in v)
+        return affected
+
+    def _publish(self) -> None:
+        plan = "".join(
+            line + "\n"
+            for directory in sorted(self.projects)
+            for line in self.projects[directory]
+        )
+        if plan == self.plan and self.rewrites:
+            return
+        self.plan = plan
+        self.rewrites += 1
+        if self.output is not None:
+            write_atomic(self.output, plan)
+
+    def follow(self, source: EventSource) -> None:
+        """Handles the events until the source ends"""
+        for batch in source.batches():
+            self.handle(batch)
+
+
+def _working_dir(event: Event) -> Optional[str]:
+    """The real path of the project dir of a container event"""
+    if event.get("Type") != "container":
+        return None
+    attributes = event.get("Actor", {}).get("Attributes", {})
+    working_dir = attributes.get(docker.COMPOSE_WORKING_DIR_LABEL)
+    if working_dir is None:
+        return None
+    return os.path.realpath(str(working_dir))
+
+
+class PlanServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    """Sends the current config of the watcher to every client"""
+
+    daemon_threads = True
+
+    def __init__(self, path: Path, watcher: Watcher):
+        if path.is_socket():
+            path.unlink()
+        self.watcher = watcher
+        super().__init__(str(path), _PlanHandler)
+
+    def start(self) -> None:
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+        Path(str(self.server_address)).unlink(missing_ok=True)
+
+
+class _PlanHandler(socketserver.StreamRequestHandler):
+    server: PlanServer
+
+    def handle(self) -> None:
+        self.wfile.write(self.server.watcher.plan.encode())
+
+
+def fetch_plan(path: Path, timeout: float = 5) -> str:
+    """Reads the config from the socket of a running watcher"""
+    chunks: list[bytes] = []
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.settimeout(timeout)
+        client.connect(str(path))
+        while True:
+            chunk = client.recv(65536)
+            if not chunk:
+                break
+            chunks.append(chunk)
+    return b"".join(chunks).decode()
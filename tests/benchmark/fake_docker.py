@@ -0,0 +1,160 @@
+#!/usr/bin/env python3
+"""Stand-in for the docker and docker-compose executables.
+It answers the commands that the discovery uses from the fixture of fleet.py.
+
+The first argument is the name of the executable (docker or docker-compose),
+fleet.install_fake_docker creates wrappers that pass it.
+
+Environment:
+FAKE_DOCKER_FIXTURE: the fixture file (required)
+FAKE_DOCKER_LATENCY: seconds every call sleeps, to simulate a slow daemon
+FAKE_DOCKER_LOG: every call is appended to this file
+FAKE_DOCKER_CONTEXTS: a json file with the fixture and latency of every
+docker context, that is used instead if DOCKER_CONTEXT is set"""
+
+import hashlib
+import json
+import os
+import sys
+import time
+from typing import Any, NoReturn
+
+
+def labels(container: dict[str, Any]) -> dict[str, str]:
+    return {
+        "com.docker.compose.project": container["project"],
+        "com.docker.compose.service": container["service"],
+        "com.docker.compose.project.working_dir": container["working_dir"],
+        "com.docker.compose.container-number": "1",
+        "com.docker.compose.oneoff": "False",
+    }
+
+
+def status(container: dict[str, Any]) -> str:
+    return "Up 2 hours" if container["running"] else "Exited (0) 1 hour ago"
+
+
+def inspect_info(container: dict[str, Any]) -> dict[str, Any]:
+    return {
+        "Id": container["id"],
+        "Name": "/" + container["name"],
+        "Created": "2024-01-01T00:00:00Z",
+        "State": {
+            "Status": "running" if container["running"] else "exited",
+            "Running": container["running"],
+        },
+        "Image": "sha256:" + hashlib.sha256(container["image"].encode()).hexdigest(),
+        "Config": {"Image": container["image"], "Labels": labels(container)},
+        "Mounts": [
+            {"Type": "volume", "Name": name, "Source": source, "Destination": "/data"}
+            for name, source in container["volumes"]
+        ],
+    }
+
+
+def ps(fixture: dict[str, Any], args: list[str]) -> None:
+    output_format = args[args.index("--format") + 1] if "--format" in args else ""
+    if not output_format:
+        print("CONTAINER ID   IMAGE     COMMAND   CREATED   STATUS    PORTS     NAMES")
+    for container in fixture["containers"]:
+        if not output_format:
+            print(
+                '{}   {}   "cmd"   2 hours ago   {}     {}'.format(
+                    container["id"][:12],
+                    container["image"],
+                    status(container),
+                    container["name"],
+                )
+            )
+            continue
+        container_labels: Any = labels(container)
+        if ".Label " not in output_format:
+            container_labels = ",".join(
+                "{}={}".format(k, v) for k, v in container_labels.items()
+            )
+        entry = {
+            "ID": container["id"] if "--no-trunc" in args else container["id"][:12],
+            "Names": container["name"],
+            "Image": container["image"],
+            "Status": status(container),
+            "State": "running" if container["running"] else "exited",
+            "CreatedAt": "2024-01-01 00:00:00 +0000 UTC",
+            "Labels": container_labels,
+        }
+        print(json.dumps(entry))
+
+
+def inspect(fixture: dict[str, Any], ids: list[str]) -> int:
+    result = []
+    for container_id in ids:
+        for container in fixture["containers"]:
+            if container["id"].startswith(container_id) or (
+                container["name"] == container_id
+            ):
+                result.append(inspect_info(container))
+    print(json.dumps(result))
+    return 0 if result else 1
+
+
+def compose(fixture: dict[str, Any], args: list[str]) -> int:
+    if not args:
+        return 0
+    directory = os.getcwd()
+    project = fixture["projects"].get(os.path.basename(directory), {})
+    services: dict[str, Any] = project.get("services", {})
+    if args[:2] == ["config", "--services"]:
+        print("\n".join(services))
+        return 0
+    if args[:3] == ["config", "--format", "json"]:
+        service = args[3]
+        print(
+            json.dumps({"services": {service: {"container_name": services[service]}}})
+        )
+        return 0
+    if args[:3] == ["ps", "--all", "-q"]:
+        for container in fixture["containers"]:
+            if (
+                container["working_dir"] == directory
+                and container["service"] == args[3]
+            ):
+                print(container["id"][:12])
+        return 0
+    return 1
+
+
+def main() -> NoReturn:
+    fixture_path = os.environ["FAKE_DOCKER_FIXTURE"]
+    latency = float(os.environ.get("FAKE_DOCKER_LATENCY", "0"))
+    context = os.environ.get("DOCKER_CONTEXT")
+    if context:
+        with open(os.environ["FAKE_DOCKER_CONTEXTS"], encoding="UTF-8") as file:
+            contexts: dict[str, Any] = json.load(file)
+        if context not in contexts:
+            print("context {} not found".format(context), file=sys.stderr)
+            sys.exit(1)
+        fixture_path = contexts[context]["fixture"]
+        latency = contexts[context]["latency"]
+    with open(fixture_path, encoding="UTF-8") as fixture_file:
+        fixture: dict[str, Any] = json.load(fixture_file)
+    name = sys.argv[1]
+    args = sys.argv[2:]
+    log = os.environ.get("FAKE_DOCKER_LOG")
+    if log:
+        with open(log, "a", encoding="UTF-8") as log_file:
+            prefix = [context + ":"] if context else []
+            log_file.write(" ".join(prefix + [name] + args) + "\n")
+    time.sleep(latency)
+    if name == "docker-compose":
+        sys.exit(compose(fixture, args))
+    if args[:1] == ["compose"]:
+        sys.exit(compose(fixture, args[1:]))
+    if args[:2] == ["ps", "-a"]:
+        ps(fixture, args[2:])
+        sys.exit(0)
+    if args[:1] == ["inspect"]:
+        sys.exit(inspect(fixture, args[1:]))
+    sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,142 @@
+"""Generates a fleet of compose projects for the benchmark and puts the fake
+docker executables on the PATH."""
+
+import contextlib
+from dataclasses import dataclass
+import hashlib
+import json
+import os
+from pathlib import Path
+import sys
+from typing import Any, Iterator, Optional
+
+FAKE_DOCKER = Path(__file__).parent / "fake_docker.py"
+
+
+@dataclass
+class FleetSize:
+    projects: int
+    services: int
+    volumes: int
+
+    @property
+    def containers(self) -> int:
+        return self.projects * self.services
+
+    def __str__(self) -> str:
+        return "{}x{}x{}".format(self.projects, self.services, self.volumes)
+
+
+def container_id(project: str, service: str) -> str:
+    return hashlib.sha256("{}/{}".format(project, service).encode()).hexdigest()
+
+
+def create_fleet(root: Path, size: FleetSize) -> Path:
+    """Creates the compose dirs below root/container and the fixture that the
+    fake docker answers from.
+    :returns: the fixture file"""
+    projects: dict[str, Any] = {}
+    containers: list[dict[str, Any]] = []
+    for p in range(size.projects):
+        project = "project{:05d}".format(p)
+        directory = root / "container" / project
+        directory.mkdir(parents=True)
+        services: dict[str, str] = {}
+        compose_lines = ["services:"]
+        for s in range(size.services):
+            service = "service{:03d}".format(s)
+            services[service] = "{}-{}-1".format(project, service)
+            compose_lines.append("  {}:".format(service))
+            compose_lines.append("    image: bench/{}".format(service))
+            volumes = [
+                "{}_{}_data{}".format(project, service, v) for v in range(size.volumes)
+            ]
+            if volumes:
+                compose_lines.append("    volumes:")
+                compose_lines.extend(
+                    "      - {}:/data{}".format(v.split("_", 1)[1], i)
+                    for i, v in enumerate(volumes)
+                )
+            containers.append(
+                {
+                    "id": container_id(project, service),
+                    "name": services[service],
+                    "image": "bench/{}".format(service),
+                    "project": project,
+                    "service": service,
+                    "working_dir": str(directory),
+                    # Every tenth container is stopped
+                    "running": (p * size.services + s) % 10 != 9,
+                    "volumes": [
+                        [v, "/var/lib/docker/volumes/{}/_data".format(v)]
+                        for v in volumes
+                    ],
+                }
+            )
+        if size.volumes:
+            compose_lines.append("volumes:")
+            compose_lines.extend(
+                "  service{:03d}_data{}:".format(s, v)
+                for s in range(size.services)
+                for v in range(size.volumes)
+            )
+        (directory / "docker-compose.yml").write_text("\n".join(compose_lines) + "\n")
+        projects[project] = {"services": services}
+    fixture = root / "fixture.json"
+    fixture.write_text(json.dumps({"projects": projects, "containers": containers}))
+    return fixture
+
+
+@contextlib.contextmanager
+def fake_docker(
+    root: Path,
+    fixture: Path,
+    latency: float = 0.0,
+    contexts: Optional[dict[str, tuple[Path, float]]] = None,
+) -> Iterator[Path]:
+    """Puts the fake docker and docker-compose executables first on the PATH
+    and points them at the fixture. Every docker context stands for another
+    host, with its own fixture and latency.
+    :returns: the log file with one line per docker call"""
+    bin_dir = root / "bin"
+    bin_dir.mkdir(exist_ok=True)
+    for name in ["docker", "docker-compose"]:
+        wrapper = bin_dir / name
+        wrapper.write_text(
+            '#!/bin/sh\nexec "{}" "{}" {} "$@"\n'.format(
+                sys.executable, FAKE_DOCKER, name
+            )
+        )
+        wrapper.chmod(0o755)
+    log = root / "docker_calls.log"
+    log.write_text("")
+    context_file = root / "contexts.json"
+    context_file.write_text(
+        json.dumps(
+            {
+                name: {"fixture": str(path), "latency": context_latency}
+                for name, (path, context_latency) in (contexts or {}).items()
+            }
+        )
+    )
+    environment = {
+        "PATH": "{}{}{}".format(bin_dir, os.pathsep, os.environ.get("PATH", "")),
+        "FAKE_DOCKER_FIXTURE": str(fixture),
+        "FAKE_DOCKER_LATENCY": str(latency),
+        "FAKE_DOCKER_LOG": str(log),
+        "FAKE_DOCKER_CONTEXTS": str(context_file),
+    }
+    previous = {name: os.environ.get(name) for name in environment}
+    os.environ.update(environment)
+    try:
+        yield log
+    finally:
+        for name, value in previous.items():
+            if value is None:
+                del os.environ[name]
+            else:
+                os.environ[name] = value
+
+
+def docker_calls(log: Path) -> int:
+    return len(log.read_text().splitlines())
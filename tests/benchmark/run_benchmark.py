@@ -0,0 +1,153 @@
+"""Measures how backup_planer.run() scales with the size of the fleet, using the
+fake docker executables instead of a docker daemon.
+
+    python -m tests.benchmark.run_benchmark --save baseline
+    python -m tests.benchmark.run_benchmark --compare baseline
+
+Sizes are given as projects x services x volumes. The results are stored in
+tests/benchmark/results and a comparison fails if a size needs more docker
+calls or gets much slower or bigger than before."""
+
+import argparse
+import json
+from pathlib import Path
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Any, Optional
+
+from rsnapshot_docker_compose_backup import backup_planer
+from rsnapshot_docker_compose_backup.config import parsed_config
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.docker import docker_compose
+
+from tests.benchmark.fleet import FleetSize, create_fleet, docker_calls, fake_docker
+
+RESULTS_DIR = Path(__file__).parent / "results"
+# 10 to 5000 containers
+DEFAULT_SIZES = "5x2x2,50x2x2,500x2x2,2500x2x2"
+# How much slower or bigger a size can get before it counts as a regression
+DEFAULT_TOLERANCE = 1.5
+# Timings below this are too noisy to compare
+MIN_SECONDS = 0.2
+
+
+def parse_size(size: str) -> FleetSize:
+    projects, services, volumes = (int(n) for n in size.lower().split("x"))
+    return FleetSize(projects, services, volumes)
+
+
+def measure(
+    size: FleetSize, latency: float = 0.0, discovery: str = "labels"
+) -> dict[str, Any]:
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = Path(temp_dir)
+        fixture = create_fleet(root, size)
+        with fake_docker(root, fixture, latency) as log:
+            DefaultConfig.reset()
+            parsed_config.clear_cache()
+            docker_compose.get_binary.cache_clear()
+            args = backup_planer.ProgramArgs(
+                folder=root / "container",
+                config=None,
+                docker_backend="cli",
+                discovery=discovery,
+                cache=False,
+            )
+            tracemalloc.start()
+            start = time.perf_counter()
+            output = backup_planer.run(args)
+            seconds = time.perf_counter() - start
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            DefaultConfig.reset()
+            return {
+                "size": str(size),
+                "containers": size.containers,
+                "seconds": seconds,
+                "docker_calls": docker_calls(log),
+                "peak_memory_kib": peak // 1024,
+                "backed_up_containers": output.count("##Start backup"),
+            }
+
+
+def compare(
+    results: list[dict[str, Any]], baseline: list[dict[str, Any]], tolerance: float
+) -> list[str]:
+    """:returns: the regressions compared to the baseline"""
+    regressions: list[str] = []
+    previous = {result["size"]: result for result in baseline}
+    for result in results:
+        old = previous.get(result["size"])
+        if old is None:
+            continue
+        if result["docker_calls"] > old["docker_calls"]:
+            regressions.append(
+                "{}: {} docker calls instead of {}".format(
+                    result["size"], result["docker_calls"], old["docker_calls"]
+                )
+            )
+        if result["seconds"] > max(old["seconds"], MIN_SECONDS) * tolerance:
+            regressions.append(
+                "{}: {:.3f}s instead of {:.3f}s".format(
+                    result["size"], result["seconds"], old["seconds"]
+                )
+            )
+        if result["peak_memory_kib"] > old["peak_memory_kib"] * tolerance:
+            regressions.append(
+                "{}: {} KiB peak memory instead of {} KiB".format(
+                    result["size"], result["peak_memory_kib"], old["peak_memory_kib"]
+                )
+            )
+    return regressions
+
+
+def main(argv: Optional[list[str]] = None) -> int:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default=DEFAULT_SIZES)
+    ap.add_argument("--latency", type=float, default=0.0)
+    ap.add_argument("--discovery", choices=["labels", "compose"], default="labels")
+    ap.add_argument("--save", help="Store the results under this name")
+    ap.add_argument("--compare", help="Compare the results with the stored ones")
+    ap.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = ap.parse_args(argv)
+    results: list[dict[str, Any]] = []
+    print(
+        "{:>12} {:>10} {:>9} {:>12} {:>12}".format(
+            "size", "containers", "seconds", "docker calls", "peak KiB"
+        )
+    )
+    for size in args.sizes.split(","):
+        result = measure(parse_size(size), args.latency, args.discovery)
+        results.append(result)
+        print(
+            "{size:>12} {containers:>10} {seconds:>9.3f} {docker_calls:>12} "
+            "{peak_memory_kib:>12}".format(**result)
+        )
+    if args.save:
+        RESULTS_DIR.mkdir(exist_ok=True)
+        stored = {
+            "python": platform.python_version(),
+            "latency": args.latency,
+            "discovery": args.discovery,
+            "results": results,
+        }
+        (RESULTS_DIR / "{}.json".format(args.save)).write_text(
+            json.dumps(stored, indent=2)
+        )
+    if args.compare:
+        baseline = json.loads(
+            (RESULTS_DIR / "{}.json".format(args.compare)).read_text()
+        )
+        regressions = compare(results, baseline["results"], args.tolerance)
+        for regression in regressions:
+            print("Regression: {}".format(regression), file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
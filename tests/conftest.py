@@ -0,0 +1,95 @@
+"""The planner fixture runs the planner against a fleet of the fake docker of
+the benchmark and resets the global state of the planner afterwards."""
+
+import contextlib
+import json
+from pathlib import Path
+from typing import Any, Callable, Generator, Iterator, Optional, TypeVar
+
+import pytest
+
+from rsnapshot_docker_compose_backup import backup_planer, changes, throttle
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+
+from tests.benchmark.fleet import FleetSize, create_fleet, fake_docker
+
+CONFIG = Path(__file__).parent / "config" / "default_config.ini"
+
+T = TypeVar("T")
+
+
+class Planner:
+    def __init__(self, root: Path, stack: contextlib.ExitStack[Any]):
+        self.root = root
+        self.folder = root / "container"
+        self.fixture = root / "fixture.json"
+        self.log = root / "docker_calls.log"
+        self._stack = stack
+
+    def fleet(self, size: FleetSize) -> Path:
+        """Creates the projects below the root and the fake docker for them
+        :returns: the fixture file"""
+        self.docker(create_fleet(self.root, size))
+        return self.fixture
+
+    def docker(
+        self, fixture: Path, contexts: Optional[dict[str, tuple[Path, float]]] = None
+    ) -> Path:
+        """Puts the fake docker on the PATH until the end of the test
+        :returns: the log of the docker calls"""
+        self.fixture = fixture
+        self.log = self._stack.enter_context(
+            fake_docker(self.root, fixture, contexts=contexts)
+        )
+        return self.log
+
+    @contextlib.contextmanager
+    def containers(self) -> Iterator[list[dict[str, Any]]]:
+        """Changes the containers of the fixture"""
+        content = json.loads(self.fixture.read_text())
+        yield content["containers"]
+        self.fixture.write_text(json.dumps(content))
+
+    def volume_dirs(self, sizes: list[int]) -> list[Path]:
+        """Gives the first volume of the first containers a dir with a file
+        of the size"""
+        paths: list[Path] = []
+        with self.containers() as containers:
+            for container, size in zip(containers, sizes):
+                path = self.root / "volumes" / container["name"]
+                path.mkdir(parents=True)
+                (path / "data").write_bytes(b"x" * size)
+                container["volumes"][0][1] = str(path)
+                paths.append(path)
+        return paths
+
+    def args(self, **options: Any) -> backup_planer.ProgramArgs:
+        """The args of the fleet with the test config, without the cache"""
+        options.setdefault("folder", self.folder)
+        options.setdefault("config", CONFIG)
+        options.setdefault("docker_backend", "cli")
+        options.setdefault("cache", False)
+        return backup_planer.ProgramArgs(**options)
+
+    def call(
+        self, function: Callable[[backup_planer.ProgramArgs], T], **options: Any
+    ) -> T:
+        """Calls the function with the args, the config is read again"""
+        DefaultConfig.reset()
+        return function(self.args(**options))
+
+    def run(self, **options: Any) -> str:
+        """:returns: the config of the fleet"""
+        return self.call(backup_planer.run, **options)
+
+
+@pytest.fixture(name="planner")
+def fixture_planner(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> Generator[Planner, Any, None]:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    with contextlib.ExitStack() as stack:
+        yield Planner(tmp_path, stack)
+    DefaultConfig.reset()
+    changes.use(None)
+    throttle.use(None)
@@ -0,0 +1,95 @@
+"""Small stand-in for the Docker Engine API that listens on a unix socket.
+It answers the requests of the EngineApiClient from a list of inspect results."""
+
+from http.server import BaseHTTPRequestHandler
+import json
+import socketserver
+import threading
+from typing import Any
+from urllib.parse import parse_qs, urlparse
+
+
+class FakeDockerSocket(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path: str, containers: list[dict[str, Any]]):
+        self.containers = containers
+        self.requests: list[str] = []
+        self.connections = 0
+        super().__init__(socket_path, _Handler)
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    def start(self) -> "FakeDockerSocket":
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
+
+    def list_entry(self, container: dict[str, Any]) -> dict[str, Any]:
+        running = container["State"]["Running"]
+        return {
+            "Id": container["Id"],
+            "Names": [container["Name"]],
+            "Image": container["Config"]["Image"],
+            "State": "running" if running else "exited",
+            "Status": "Up 2 hours" if running else "Exited (0) 2 hours ago",
+            "Created": 1721591756,
+            "Labels": container["Config"]["Labels"],
+        }
+
+    def find(self, name: str) -> Any:
+        for container in self.containers:
+            if container["Id"].startswith(name) or container["Name"] == "/" + name:
+                return container
+        return None
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server: FakeDockerSocket
+
+    def setup(self) -> None:
+        super().setup()
+        self.server.connections += 1
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        url = urlparse(self.path)
+        self.server.requests.append(url.path)
+        if url.path == "/_ping":
+            self._send(200, b"OK")
+        elif url.path == "/containers/json":
+            self._send_json(200, self._list(parse_qs(url.query)))
+        elif url.path.startswith("/containers/") and url.path.endswith("/json"):
+            container = self.server.find(url.path[len("/containers/") : -len("/json")])
+            if container is None:
+                self._send_json(404, {"message": "No such container"})
+            else:
+                self._send_json(200, container)
+        else:
+            self._send_json(404, {"message": "page not found"})
+
+    def _list(self, query: dict[str, list[str]]) -> list[Any]:
+        labels: list[str] = []
+        if "filters" in query:
+            labels = json.loads(query["filters"][0]).get("label", [])
+        return [
+            self.server.list_entry(c)
+            for c in self.server.containers
+            if all(label in c["Config"]["Labels"] for label in labels)
+        ]
+
+    def _send_json(self, status: int, body: Any) -> None:
+        self._send(status, json.dumps(body).encode())
+
+    def _send(self, status: int, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format: str, *args: Any) -> None:
+        # pylint: disable=redefined-builtin
+        pass
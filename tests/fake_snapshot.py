@@ -0,0 +1,24 @@
+"""Snapshot backend for the tests, its snapshots are plain copies in a dir,
+so the commands work on every file system."""
+
+import os
+import shlex
+
+from rsnapshot_docker_compose_backup.freeze import SnapshotBackend
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+
+class FakeBackend(SnapshotBackend):
+    def snapshot_path(self, volume: Volume) -> str:
+        return os.path.join(self.options.get("snapshot_dir", "/snapshots"), volume.name)
+
+    def create(self, volume: Volume) -> list[str]:
+        path = shlex.quote(self.snapshot_path(volume))
+        return [
+            "rm -rf {0} && mkdir -p {0} && cp -a {1}/. {0}".format(
+                path, shlex.quote(volume.path)
+            )
+        ]
+
+    def remove(self, volume: Volume) -> list[str]:
+        return ["rm -rf {}".format(shlex.quote(self.snapshot_path(volume)))]
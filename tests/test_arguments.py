@@ -0,0 +1,38 @@
+import pytest
+
+from rsnapshot_docker_compose_backup import backup_planer
+
+
+@pytest.mark.parametrize(
+    "option,other",
+    [
+        ("--jobs", []),
+        ("--scan-threads", []),
+        ("--lanes", ["--execute", "/backup"]),
+        ("--shards", ["--output", "docker.conf"]),
+        ("--size-threads", []),
+    ],
+)
+def test_counts_are_positive(
+    option: str, other: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    for value in ["0", "-1"]:
+        monkeypatch.setattr("sys.argv", ["backup", option, value, *other])
+        with pytest.raises(SystemExit):
+            backup_planer.parse_arguments()
+    monkeypatch.setattr("sys.argv", ["backup", option, "2", *other])
+    assert backup_planer.parse_arguments()
+
+
+@pytest.mark.parametrize(
+    "option,other",
+    [("--max-depth", []), ("--full-every", ["--skip-unchanged"])],
+)
+def test_limits_are_not_negative(
+    option: str, other: list[str], monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr("sys.argv", ["backup", option, "-1", *other])
+    with pytest.raises(SystemExit):
+        backup_planer.parse_arguments()
+    monkeypatch.setattr("sys.argv", ["backup", option, "0", *other])
+    assert backup_planer.parse_arguments()
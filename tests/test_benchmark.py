@@ -0,0 +1,28 @@
+from tests.benchmark.fleet import FleetSize
+from tests.benchmark.run_benchmark import compare, measure
+
+
+def test_docker_calls_dont_grow_with_the_fleet() -> None:
+    small = measure(FleetSize(2, 2, 1))
+    large = measure(FleetSize(10, 2, 1))
+    # Every tenth container is stopped and skipped
+    assert small["backed_up_containers"] == 4
+    assert large["backed_up_containers"] == 18
+    assert large["docker_calls"] == small["docker_calls"]
+
+
+def test_compose_discovery() -> None:
+    result = measure(FleetSize(2, 2, 1), discovery="compose")
+    assert result["backed_up_containers"] == 4
+    # probe, ps and inspect, then config --services and two calls per service
+    assert result["docker_calls"] == 3 + 2 * (1 + 2 * 2)
+
+
+def test_regressions_are_reported() -> None:
+    baseline = [
+        {"size": "1x1x1", "seconds": 1.0, "docker_calls": 2, "peak_memory_kib": 100}
+    ]
+    same = [dict(baseline[0])]
+    assert not compare(same, baseline, 1.5)
+    worse = [dict(baseline[0], docker_calls=3, seconds=2.0)]
+    assert len(compare(worse, baseline, 1.5)) == 2
@@ -0,0 +1,69 @@
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup.cache import (
+    DiscoveryCache,
+    hash_files,
+    open_atomic,
+)
+
+
+@pytest.fixture(name="cache_home")
+def fixture_cache_home(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    return tmp_path
+
+
+def test_entries_are_persisted(cache_home: Path) -> None:
+    cache = DiscoveryCache("test")
+    assert cache.get("project", "key1") is None
+    cache.put("project", "key1", ["value"])
+    cache.put("removed", "key1", ["value"])
+    cache.save()
+
+    cache = DiscoveryCache("test")
+    assert cache.get("project", "key1") == ["value"]
+    assert cache.get("project", "key2") is None
+    assert (cache.stats.hits, cache.stats.misses) == (1, 1)
+    cache.save()
+
+    # Only entries that were used in the last run are kept
+    cache = DiscoveryCache("test")
+    assert cache.get("removed", "key1") is None
+    assert cache.get("project", "key1") == ["value"]
+
+
+def test_refresh_ignores_entries(cache_home: Path) -> None:
+    cache = DiscoveryCache("test")
+    cache.put("project", "key", ["value"])
+    cache.save()
+    assert DiscoveryCache("test", refresh=True).get("project", "key") is None
+
+
+def test_hash_changes_with_content(tmp_path: Path) -> None:
+    compose_file = tmp_path / "compose.yaml"
+    missing_hash = hash_files([compose_file])
+    compose_file.write_text("services: {}")
+    content_hash = hash_files([compose_file])
+    assert missing_hash != content_hash
+    assert content_hash == hash_files([compose_file])
+    assert content_hash != hash_files([compose_file], ["container started"])
+
+
+def test_atomic_file_is_replaced_at_the_end(tmp_path: Path) -> None:
+    file = tmp_path / "backup.conf"
+    file.write_text("old\n")
+    file.chmod(0o644)
+    with open_atomic(file) as output:
+        output.write("new\n")
+        assert file.read_text() == "old\n"
+    assert file.read_text() == "new\n"
+    assert file.stat().st_mode & 0o777 == 0o644
+
+    with pytest.raises(RuntimeError):
+        with open_atomic(file) as output:
+            output.write("half")
+            raise RuntimeError()
+    assert file.read_text() == "new\n"
+    assert [f.name for f in tmp_path.iterdir()] == ["backup.conf"]
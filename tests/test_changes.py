@@ -0,0 +1,77 @@
+import io
+import shlex
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup import changes
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+
+def test_fingerprint_follows_the_tree(tmp_path: Path) -> None:
+    volume = tmp_path / "volume"
+    (volume / "a" / "b").mkdir(parents=True)
+    (volume / "a" / "b" / "file").write_bytes(b"x")
+    first = changes.fingerprints([str(volume)], threads=2)[str(volume)]
+    assert first is not None
+    assert changes.fingerprints([str(volume)])[str(volume)] == first
+    (volume / "a" / "b" / "file").write_bytes(b"xy")
+    assert changes.fingerprints([str(volume)])[str(volume)] != first
+    assert changes.fingerprints([str(tmp_path / "missing")]) == {
+        str(tmp_path / "missing"): None
+    }
+
+
+def test_unchanged_containers_are_skipped(
+    planner: Planner, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr("sys.stderr", io.StringIO())
+    planner.fleet(FleetSize(2, 1, 1))
+    volumes = planner.volume_dirs([1, 1])
+    outputs = []
+    detectors = []
+    for run in range(3):
+        outputs.append(planner.run(skip_unchanged=True, full_every=3))
+        detectors.append(changes.current())
+        _commit(outputs[-1])
+        if run == 0:
+            (volumes[1] / "data").write_bytes(b"changed")
+    assert outputs[0].count("/usr/bin/docker-compose stop") == 2
+    # Only the second project changed after the first run
+    assert outputs[1].count("/usr/bin/docker-compose stop") == 1
+    assert outputs[1].count("#Skipped the stop and the backup") == 1
+    assert "_data0" not in outputs[1].split("project00001")[0]
+    # The third run is a full run
+    assert outputs[2].count("/usr/bin/docker-compose stop") == 2
+    detector = detectors[2]
+    assert detector is not None and detector.full
+
+
+def test_failed_backup_is_repeated(
+    planner: Planner, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr("sys.stderr", io.StringIO())
+    planner.fleet(FleetSize(1, 1, 1))
+    volume = planner.volume_dirs([1])[0]
+    outputs = []
+    for run in range(4):
+        outputs.append(planner.run(skip_unchanged=True, full_every=0))
+        if run == 0:
+            _commit(outputs[-1])
+            (volume / "data").write_bytes(b"changed")
+        # The second run fails, rsnapshot doesn't reach the commit
+        elif run == 2:
+            _commit(outputs[-1])
+    assert outputs[1].count("/usr/bin/docker-compose stop") == 1
+    # The change that the failed run didn't back up is backed up again
+    assert outputs[2].count("/usr/bin/docker-compose stop") == 1
+    assert outputs[3].count("/usr/bin/docker-compose stop") == 0
+
+
+def _commit(output: str) -> None:
+    """Runs the last line of the config like rsnapshot does"""
+    command = output.splitlines()[-1].split("\t")[1]
+    assert command.startswith(changes.COMMIT_COMMAND + " ")
+    changes.commit(Path(shlex.split(command)[-1]))
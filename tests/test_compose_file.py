@@ -0,0 +1,38 @@
+import json
+import os
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup.docker import compose_file
+
+pytest.importorskip("yaml")
+
+corpus = Path(os.path.dirname(os.path.realpath(__file__))) / "compose"
+
+
+@pytest.mark.parametrize(
+    "case", sorted(d.name for d in corpus.iterdir() if d.is_dir()), ids=str
+)
+def test_conformance(case: str) -> None:
+    """Every folder of the corpus contains a compose project and the expected
+    output of docker compose config for it"""
+    with open(corpus / case / "expected.json", encoding="UTF-8") as expected_file:
+        expected = json.load(expected_file)
+    project = compose_file.load_project(
+        corpus / case, environ=expected.get("environment", {})
+    )
+    assert project.name == expected["name"]
+    assert {
+        name: service.container_name for name, service in project.services.items()
+    } == expected["services"]
+
+
+def test_missing_required_variable() -> None:
+    with pytest.raises(compose_file.ComposeFileError):
+        compose_file.load_project(corpus / "env_interpolation", environ={})
+
+
+def test_no_compose_file(tmp_path: Path) -> None:
+    with pytest.raises(compose_file.ComposeFileError):
+        compose_file.load_project(tmp_path, environ={})
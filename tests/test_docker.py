@@ -0,0 +1,183 @@
+import json
+import os
+import subprocess
+from pathlib import Path
+from typing import Any, Generator, Union
+
+import pytest
+
+from rsnapshot_docker_compose_backup.docker import docker, docker_compose
+
+from tests.benchmark.fleet import FleetSize, container_id
+from tests.conftest import Planner
+
+CONTAINER_ID = "3f4e2a1b5c6d" + "0" * 52
+
+
+def inspect_output(container_id: str) -> dict[str, Any]:
+    return {
+        "Id": container_id,
+        "Name": "/heimdall",
+        "Config": {"Labels": {"com.docker.compose.service": "heimdall"}},
+        "Mounts": [
+            {
+                "Type": "volume",
+                "Name": "heimdall_heimdall",
+                "Source": "/var/lib/docker/volumes/heimdall_heimdall/_data",
+            },
+            {"Type": "bind", "Source": "/etc/localtime"},
+        ],
+    }
+
+
+@pytest.fixture(name="fake_cli")
+def fixture_fake_cli(
+    monkeypatch: pytest.MonkeyPatch,
+) -> Generator[list[list[str]], Any, None]:
+    calls: list[list[str]] = []
+
+    def fake_command(
+        cmd: Union[str, list[str]], path: Any = None
+    ) -> subprocess.CompletedProcess[str]:
+        args = cmd if isinstance(cmd, list) else cmd.split()
+        calls.append(args)
+        if args[:2] == ["docker", "ps"]:
+            stdout = json.dumps(
+                {
+                    "ID": CONTAINER_ID,
+                    "Names": "heimdall",
+                    "Image": "linuxserver/heimdall",
+                    "Status": "Exited (0) 2 minutes ago",
+                    "State": "exited",
+                    "CreatedAt": "2024-07-21 19:55:56 +0000 UTC",
+                    "Labels": {
+                        "com.docker.compose.service": "heimdall",
+                        "com.docker.compose.oneoff": "",
+                    },
+                }
+            )
+        elif args[:2] == ["docker", "inspect"]:
+            stdout = json.dumps([inspect_output(i) for i in args[2:]])
+        else:
+            raise AssertionError(f"unexpected command {args}")
+        return subprocess.CompletedProcess(args, 0, stdout=stdout)
+
+    monkeypatch.setattr(docker, "command", fake_command)
+    docker.reset_fleet()
+    yield calls
+    docker.reset_fleet()
+
+
+def test_fleet_is_loaded_once(fake_cli: list[list[str]]) -> None:
+    assert docker.image(CONTAINER_ID[:12]) == "linuxserver/heimdall"
+    assert docker.running(CONTAINER_ID) is False
+    # The inspect data is only loaded when it is needed
+    assert len(fake_cli) == 1
+    volumes = docker.volumes(CONTAINER_ID[:12])
+    assert [(v.name, v.path) for v in volumes] == [
+        ("heimdall_heimdall", "/var/lib/docker/volumes/heimdall_heimdall/_data")
+    ]
+    assert [c[:2] for c in fake_cli] == [["docker", "ps"], ["docker", "inspect"]]
+
+
+def test_fleet_is_reloaded_once_for_missing_containers(
+    fake_cli: list[list[str]],
+) -> None:
+    assert docker.container_state(CONTAINER_ID) is not None
+    for missing in ["a" * 64, "b" * 64, "a" * 64]:
+        assert docker.container_state(missing) is None
+    # The first ps and one reload for all missing containers
+    assert [c[:2] for c in fake_cli] == [["docker", "ps"], ["docker", "ps"]]
+
+
+def test_fleet_lookup_by_prefix(fake_cli: list[list[str]]) -> None:
+    state = docker.fleet().get(CONTAINER_ID[:20])
+    assert state is not None
+    assert state.name == "heimdall"
+    assert state.labels == {"com.docker.compose.service": "heimdall"}
+    assert docker.fleet().get("ffffffffffff") is None
+
+
+def test_only_used_values_are_inspected(planner: Planner) -> None:
+    planner.fleet(FleetSize(1, 10, 1))
+    project = planner.folder / "project00000"
+    planner.run()
+    inspects = [c for c in planner.log.read_text().splitlines() if " inspect " in c]
+    # The stopped container is skipped, so it isn't inspected
+    assert len(inspects) == 1
+    assert container_id("project00000", "service000") in inspects[0]
+    assert container_id("project00000", "service009") not in inspects[0]
+
+    # Without the volume and the image backup nothing is inspected
+    (project / "backup.ini").write_text(
+        "".join(
+            "[service{:03d}.actions]\nvolumebackup = false\n"
+            "imagebackup = false\n".format(s)
+            for s in range(10)
+        )
+    )
+    planner.log.write_text("")
+    output = planner.run()
+    assert " inspect " not in planner.log.read_text()
+    assert output.count("##Start backup") == 9
+
+
+def compose_state(
+    container_id: str, service: str, number: str = "1", oneoff: str = "False"
+) -> docker.ContainerState:
+    return docker.ContainerState(
+        container_id=container_id,
+        name="{}-{}".format(service, number),
+        image="alpine",
+        status="Up 2 hours",
+        labels={
+            "com.docker.compose.project": "app",
+            "com.docker.compose.project.working_dir": "/srv/app",
+            "com.docker.compose.service": service,
+            "com.docker.compose.container-number": number,
+            "com.docker.compose.oneoff": oneoff,
+        },
+    )
+
+
+def test_labelled_services(monkeypatch: pytest.MonkeyPatch) -> None:
+    fleet = docker.Fleet(
+        [
+            compose_state("c" * 64, "worker", number="2"),
+            compose_state("b" * 64, "worker", number="1"),
+            compose_state("a" * 64, "app"),
+            compose_state("d" * 64, "app", oneoff="True"),
+        ]
+    )
+    monkeypatch.setattr(docker, "_states", {None: docker._HostState(fleet)})
+    services = docker_compose.get_labelled_services()
+    assert services == {
+        os.path.realpath("/srv/app"): [
+            docker_compose.ContainerInfo("app", "app-1", "a" * 12),
+            docker_compose.ContainerInfo("worker", "worker-1", "b" * 12),
+        ]
+    }
+
+
+def test_fingerprint_covers_referenced_files(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setattr(docker, "_states", {None: docker._HostState(docker.Fleet([]))})
+    shared = tmp_path / "shared"
+    shared.mkdir()
+    (shared / "base.yml").write_text("services:\n  app:\n    image: app\n")
+    (shared / "db.yml").write_text("services:\n  db:\n    image: db\n")
+    project = tmp_path / "project"
+    project.mkdir()
+    (project / "compose.yaml").write_text(
+        "include:\n  - ../shared/db.yml\n"
+        "services:\n  web:\n    extends:\n"
+        "      file: ../shared/base.yml\n      service: app\n"
+    )
+    fingerprint = docker_compose.project_fingerprint(project)
+    assert docker_compose.project_fingerprint(project) == fingerprint
+    (shared / "db.yml").write_text("services:\n  db:\n    image: db:2\n")
+    included = docker_compose.project_fingerprint(project)
+    assert included != fingerprint
+    (shared / "base.yml").write_text("services:\n  app:\n    image: app:2\n")
+    assert docker_compose.project_fingerprint(project) != included
@@ -0,0 +1,106 @@
+import os
+from pathlib import Path
+import tempfile
+from typing import Any, Generator
+
+import pytest
+
+from rsnapshot_docker_compose_backup import global_values
+from rsnapshot_docker_compose_backup.docker import docker
+from rsnapshot_docker_compose_backup.docker.engine_api import (
+    EngineApiClient,
+    EngineApiError,
+)
+from tests.fake_docker_socket import FakeDockerSocket
+
+CONTAINERS: list[dict[str, Any]] = [
+    {
+        "Id": "a1" * 32,
+        "Name": "/heimdall",
+        "State": {"Running": True},
+        "Config": {
+            "Image": "linuxserver/heimdall",
+            "Labels": {
+                "com.docker.compose.project": "heimdall",
+                "com.docker.compose.service": "heimdall",
+            },
+        },
+        "Mounts": [
+            {
+                "Type": "volume",
+                "Name": "heimdall_heimdall",
+                "Source": "/var/lib/docker/volumes/heimdall_heimdall/_data",
+            }
+        ],
+    },
+    {
+        "Id": "b2" * 32,
+        "Name": "/standalone",
+        "State": {"Running": False},
+        "Config": {"Image": "alpine", "Labels": {}},
+        "Mounts": [],
+    },
+]
+
+
+@pytest.fixture(name="fake_socket")
+def fixture_fake_socket(
+    monkeypatch: pytest.MonkeyPatch,
+) -> Generator[FakeDockerSocket, Any, None]:
+    # unix socket paths are limited to ~100 characters
+    with tempfile.TemporaryDirectory() as temp_dir:
+        socket_path = os.path.join(temp_dir, "docker.sock")
+        server = FakeDockerSocket(socket_path, CONTAINERS).start()
+        monkeypatch.setenv("DOCKER_HOST", "unix://" + socket_path)
+        monkeypatch.delenv("DOCKER_CONTEXT", raising=False)
+        yield server
+        server.stop()
+    global_values.set_docker_backend("auto")
+    docker.reset_api()
+    docker.reset_fleet()
+
+
+def test_connection_is_reused(fake_socket: FakeDockerSocket) -> None:
+    client = EngineApiClient(fake_socket.server_address)  # type: ignore[arg-type]
+    assert client.ping()
+    assert len(client.containers()) == 2
+    assert client.inspect("heimdall")["Id"] == "a1" * 32
+    with pytest.raises(EngineApiError):
+        client.inspect("missing")
+    client.close()
+    assert fake_socket.connections == 1
+
+
+def test_label_filter(fake_socket: FakeDockerSocket) -> None:
+    client = EngineApiClient(fake_socket.server_address)  # type: ignore[arg-type]
+    containers = client.containers(labels=["com.docker.compose.project"])
+    assert [c["Names"] for c in containers] == [["/heimdall"]]
+    client.close()
+
+
+def test_fleet_uses_api(
+    fake_socket: FakeDockerSocket, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def no_cli(*args: Any, **kwargs: Any) -> Any:
+        raise AssertionError("the docker cli shouldn't be used")
+
+    monkeypatch.setattr(docker, "command", no_cli)
+    global_values.set_docker_backend("api")
+    docker.reset_api()
+    docker.reset_fleet()
+    container_id = "a1" * 6
+    assert docker.image(container_id) == "linuxserver/heimdall"
+    assert docker.running(container_id)
+    assert [v.name for v in docker.volumes(container_id)] == ["heimdall_heimdall"]
+    assert fake_socket.connections == 1
+
+
+def test_auto_falls_back_to_cli(monkeypatch: pytest.MonkeyPatch) -> None:
+    monkeypatch.setenv("DOCKER_HOST", "unix://" + str(Path("/nonexistent/sock")))
+    global_values.set_docker_backend("auto")
+    docker.reset_api()
+    assert docker.api() is None
+    monkeypatch.setenv("DOCKER_HOST", "tcp://192.168.1.1:2375")
+    docker.reset_api()
+    assert docker.api() is None
+    docker.reset_api()
@@ -0,0 +1,83 @@
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup import excludes
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+
+def _volume(root: Path) -> Path:
+    (root / "app" / ".cache").mkdir(parents=True)
+    (root / "app" / ".cache" / "entry").write_bytes(b"x" * 1000)
+    (root / "app" / "node_modules" / "lib").mkdir(parents=True)
+    (root / "app" / "node_modules" / "lib" / "index.js").write_bytes(b"x" * 300)
+    (root / "thumbs").mkdir()
+    (root / "thumbs" / excludes.CACHEDIR_TAG).write_bytes(
+        excludes.CACHEDIR_SIGNATURE + b"\n"
+    )
+    (root / "data").mkdir()
+    (root / "data" / "upload.tmp").write_bytes(b"x" * 20)
+    (root / "data" / "keep.tmp").write_bytes(b"x" * 50)
+    return root
+
+
+def test_rules_of_a_volume(tmp_path: Path) -> None:
+    root = _volume(tmp_path / "volume")
+    volume = Volume("app_data", str(root))
+    options = {
+        "exclude": "*.tmp",
+        "include.data": "keep.tmp /app/node_modules/",
+        "exclude.other": "data/",
+        "detect": "all",
+    }
+    rules = excludes.volume_rules(volume, options, "app")
+    assert [rule.option() for rule in rules] == [
+        "--include=keep.tmp",
+        "--include=/app/node_modules/",
+        "--exclude=*.tmp",
+        "--exclude=/thumbs/",
+        "--exclude=/app/.cache/",
+    ]
+    assert rules[3].source == "cachedir_tag"
+    saved = excludes.explain(str(root), rules)
+    assert saved[rules[2]] == 20
+    assert saved[rules[4]] == 1000
+    assert excludes.add_args("backup\t/src\tdest", rules[4:]) == (
+        "backup\t/src\tdest\t+rsync_long_args=--exclude=/app/.cache/"
+    )
+    assert excludes.add_args("backup\t/src\tdest\tone_fs=1", rules[4:]) == (
+        "backup\t/src\tdest\tone_fs=1,+rsync_long_args=--exclude=/app/.cache/"
+    )
+
+
+def test_excludes_are_added_to_the_backup_lines(
+    tmp_path: Path, planner: Planner, capsys: pytest.CaptureFixture[str]
+) -> None:
+    root = _volume(tmp_path / "volume")
+    planner.fleet(FleetSize(1, 2, 1))
+    with planner.containers() as containers:
+        containers[0]["volumes"][0][1] = str(root)
+    (planner.folder / "project00000" / "backup.ini").write_text(
+        "[service000.excludes]\nexclude.service000_data0 = *.tmp\n"
+        "detect = dot_cache\n"
+    )
+    output = planner.run(explain=True)
+    assert (
+        "backup\t{}\t./service000/project00000_service000_data0\t"
+        "+rsync_long_args=--exclude=*.tmp,"
+        "+rsync_long_args=--exclude=/app/.cache/".format(root)
+    ) in output
+    # The other service has no rules
+    assert (
+        "backup\t/var/lib/docker/volumes/project00000_service001_data0/_data\t"
+        "./service001/project00000_service001_data0\n"
+    ) in output
+    err = capsys.readouterr().err
+    assert (
+        "Volume project00000_service000_data0 of project00000/service000: "
+        "--exclude=/app/.cache/ leaves out 1.0 kB (dot_cache)"
+    ) in err
+    assert "The excludes leave out 1.1 kB" in err
@@ -0,0 +1,64 @@
+import io
+import json
+from pathlib import Path
+
+from rsnapshot_docker_compose_backup import backup_planer
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+CONFIG = """[default_config]
+[settings]
+logTime = true
+[default_config.actions]
+stopcontainer = true
+volumebackup = true
+[actions.volumeBackup]
+backup = backup\t$volumes.path\t$serviceName/$volumes.name
+[actions.stopContainer]
+stop = backup_exec\techo stop $projectName >> {log}
+restart = backup_exec\techo start $projectName >> {log}
+"""
+
+# Stands in for rsync, the backups of project00001 fail
+RSYNC = """#!/bin/sh
+echo "$@" >> {log}
+case "$*" in *project00001*) exit 23;; esac
+"""
+
+
+def test_failed_project_is_restarted(tmp_path: Path, planner: Planner) -> None:
+    planner.fleet(FleetSize(3, 2, 1))
+    commands = tmp_path / "commands.log"
+    config = tmp_path / "backup.ini"
+    config.write_text(CONFIG.format(log=commands))
+    rsync = tmp_path / "rsync"
+    rsync.write_text(RSYNC.format(log=tmp_path / "rsync.log"))
+    rsync.chmod(0o755)
+    log = io.StringIO()
+    success = planner.call(
+        lambda args: backup_planer.execute(args, log),
+        config=config,
+        execute=tmp_path / "backup",
+        lanes=2,
+        rsync=str(rsync),
+    )
+    assert not success
+    assert sorted(commands.read_text().splitlines()) == [
+        "start project00000",
+        "start project00001",
+        "start project00002",
+        "stop project00000",
+        "stop project00001",
+        "stop project00002",
+    ]
+    # The second volume of project00001 isn't tried after the first one failed
+    assert len((tmp_path / "rsync.log").read_text().splitlines()) == 5
+    assert (
+        tmp_path / "backup" / "service000" / "project00000_service000_data0"
+    ).is_dir()
+    steps = [json.loads(line) for line in log.getvalue().splitlines()]
+    failed = [(s["project"], s["step"]) for s in steps if s["status"] == "failed"]
+    assert failed == [("project00001", "backup")]
+    assert {s["lane"] for s in steps} <= {0, 1}
+    assert all(s["seconds"] >= 0 for s in steps)
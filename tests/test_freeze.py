@@ -0,0 +1,65 @@
+import pytest
+
+from rsnapshot_docker_compose_backup import freeze
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+from tests.fake_snapshot import FakeBackend
+
+
+def _blocks(output: str) -> dict[str, str]:
+    """The lines of every project"""
+    blocks: dict[str, str] = {}
+    for block in output.split("##Start backup for compose project ")[1:]:
+        blocks[block.split(" ")[0]] = block
+    return blocks
+
+
+def test_strategies(planner: Planner, monkeypatch: pytest.MonkeyPatch) -> None:
+    # The registered backend is dropped after the test
+    monkeypatch.setattr(freeze, "BACKENDS", dict(freeze.BACKENDS))
+    freeze.register_backend("fake", FakeBackend)
+    planner.fleet(FleetSize(3, 1, 1))
+    container = planner.folder
+    (container / "project00000" / "backup.ini").write_text(
+        "[service000]\nfreeze = snapshot\nsnapshot_backend = fake\n"
+        "snapshot_dir = /snap\n"
+    )
+    (container / "project00001" / "backup.ini").write_text(
+        "[service000]\nfreeze = pause\n"
+    )
+    (container / "project00002" / "backup.ini").write_text(
+        "[service000]\nfreeze = none\n"
+    )
+    output = planner.run()
+    blocks = _blocks(output)
+    volume = "project00000_service000_data0"
+    snapshot = blocks["project00000"]
+    steps = [line for line in snapshot.splitlines() if "date" not in line]
+    stop = steps.index("#stop")
+    assert steps[stop + 1].endswith("/usr/bin/docker-compose stop")
+    assert steps[stop + 2] == (
+        "backup_exec\trm -rf /snap/{0} && mkdir -p /snap/{0} && "
+        "cp -a /var/lib/docker/volumes/{0}/_data/. /snap/{0}".format(volume)
+    )
+    assert steps[stop + 4].endswith("/usr/bin/docker-compose start")
+    assert "backup\t/snap/{0}\t./service000/{0}".format(volume) in steps
+    # The restart also runs after a failed backup, so it removes the snapshots
+    restart = steps.index("#restart")
+    assert "backup_exec\trm -rf /snap/{}".format(volume) in steps[restart:]
+    assert snapshot.count("/usr/bin/docker-compose start") == 2
+
+    paused = blocks["project00001"]
+    assert "docker-compose pause" in paused and "docker-compose unpause" in paused
+    assert "docker-compose stop" not in paused
+    unfrozen = blocks["project00002"]
+    assert "docker-compose stop" not in unfrozen and "pause" not in unfrozen
+    assert "/var/lib/docker/volumes/project00002_service000_data0/_data" in unfrozen
+
+
+def test_unknown_strategy() -> None:
+    with pytest.raises(Exception, match="Unknown freeze strategy"):
+        freeze.strategy({"freeze": "hibernate"})
+    backend = freeze.BtrfsBackend({})
+    assert backend.snapshot_path(Volume("data", "/srv/data")) == "/srv/data.snapshot"
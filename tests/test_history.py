@@ -0,0 +1,84 @@
+from pathlib import Path
+
+from rsnapshot_docker_compose_backup import scheduler
+from rsnapshot_docker_compose_backup.history import (
+    Duration,
+    History,
+    durations_from_config,
+    parse_rsnapshot_log,
+    runs_from_step_log,
+)
+
+CONFIG = """##Start backup for compose project web - service app
+#runtime_backup
+backup_exec\t/bin/date +%s
+backup_script\t/usr/bin/docker image save app -o app_image.tar\t./app/image
+#stop
+backup_exec\t/bin/date +%s
+backup_exec\tcd /srv/web; /usr/bin/docker-compose stop
+#backup
+backup_exec\t/bin/date +%s
+backup\t/var/lib/docker/volumes/web_data/_data\t./app/web_data
+backup_exec\t/bin/date +%s
+##End backup for compose project web - service app
+"""
+
+LOG = """[2024-01-04T03:00:00] /usr/bin/rsnapshot daily: started
+[2024-01-04T03:00:00] /bin/date +%s
+[2024-01-05T03:00:00] /usr/bin/rsnapshot daily: started
+[2024-01-05T03:00:00] echo 1234 > /var/run/rsnapshot.pid
+[2024-01-05T03:00:01] /bin/date +%s
+[2024-01-05T03:00:04] /usr/bin/docker image save app -o app_image.tar
+[2024-01-05T03:00:11] /bin/date +%s
+[2024-01-05T03:00:11] cd /srv/web; /usr/bin/docker-compose stop
+[2024-01-05T03:00:13] /bin/date +%s
+[2024-01-05T03:00:13] /usr/bin/rsync -a /var/lib/docker/volumes/web_data/_data
+[2024-01-05T03:01:13] /bin/date +%s
+"""
+
+
+def test_durations_from_rsnapshot_log() -> None:
+    times = parse_rsnapshot_log(LOG.splitlines())
+    assert len(times) == 4
+    assert durations_from_config(CONFIG.splitlines(), times) == [
+        Duration("web", "app", "runtime_backup", "", 10),
+        Duration("web", "app", "stop", "", 2),
+        Duration("web", "app", "backup", "./app/web_data", 60),
+    ]
+
+
+def test_estimates_and_regressions(tmp_path: Path) -> None:
+    history = History(tmp_path / "history.sqlite")
+    for run, seconds in enumerate([30, 32, 28, 90]):
+        durations = [
+            Duration("web", "app", "backup", "./app/web_data", seconds),
+            Duration("db", "db", "backup", "./db/db_data", 100),
+        ]
+        assert history.add_run(run, "rsnapshot", durations)
+    assert not history.add_run(3, "rsnapshot", [])
+    assert history.estimates() == {"web": 31, "db": 100}
+    assert history.regressions() == ["backup of web took 90s, usually 30s"]
+    history.close()
+
+
+def test_step_log_runs() -> None:
+    lines = [
+        '{"run": 1.0, "project": "web", "step": "stop", "lane": 0, "start": 1.5, '
+        '"seconds": 2.0, "commands": 1, "status": "ok", "error": null}',
+        '{"run": 1.0, "project": "web", "step": "backup", "lane": 0, "start": 3.5, '
+        '"seconds": 0, "commands": 0, "status": "skipped", "error": null}',
+        '{"run": 9.0, "project": "web", "step": "stop", "lane": 1, "start": 9.5, '
+        '"seconds": 3.0, "commands": 1, "status": "ok", "error": null}',
+    ]
+    assert runs_from_step_log(lines) == {
+        1.0: [Duration("web", "", "stop", "", 2.0)],
+        9.0: [Duration("web", "", "stop", "", 3.0)],
+    }
+
+
+def test_longest_projects_first() -> None:
+    plans = [scheduler.ProjectPlan(name, Path(name)) for name in ["a", "b", "new"]]
+    ordered = scheduler.order_projects(plans, {"a": 10, "b": 20}, longest_first=True)
+    assert [plan.name for plan in ordered] == ["new", "b", "a"]
+    ordered = scheduler.order_projects(plans, {"a": 10, "b": 20})
+    assert [plan.name for plan in ordered] == ["a", "b", "new"]
@@ -0,0 +1,108 @@
+from pathlib import Path
+import shutil
+
+import pytest
+
+from rsnapshot_docker_compose_backup.docker.host import DockerHost, parse_host
+from rsnapshot_docker_compose_backup.hosts import namespace
+
+from tests.benchmark.fleet import FleetSize, create_fleet, docker_calls
+from tests.conftest import Planner
+
+
+@pytest.fixture(name="contexts")
+def fixture_contexts(tmp_path: Path, planner: Planner) -> Path:
+    web = create_fleet(tmp_path / "web", FleetSize(2, 2, 1))
+    db = create_fleet(tmp_path / "db", FleetSize(1, 1, 1))
+    slow = create_fleet(tmp_path / "slow", FleetSize(1, 1, 1))
+    # The compose files of db are only on the remote host
+    shutil.rmtree(tmp_path / "db" / "container")
+    return planner.docker(
+        web, contexts={"web": (web, 0.0), "db": (db, 0.0), "slow": (slow, 5.0)}
+    )
+
+
+def run(planner: Planner, docker_hosts: list[DockerHost], timeout: float = 30) -> str:
+    return planner.run(folder=planner.root, hosts=docker_hosts, host_timeout=timeout)
+
+
+def test_parse_host() -> None:
+    assert parse_host("context=web,root=/srv") == DockerHost("web", Path("/srv"), "web")
+    assert parse_host("docker-host=ssh://root@db:22,root=/srv") == DockerHost(
+        "db", Path("/srv"), docker_host="ssh://root@db:22", ssh="root@db"
+    )
+    with pytest.raises(Exception):
+        parse_host("context=web")
+    with pytest.raises(Exception):
+        parse_host("context=web,root=/srv,port=1")
+
+
+def test_hosts_are_merged(tmp_path: Path, planner: Planner, contexts: Path) -> None:
+    output = run(
+        planner,
+        [
+            DockerHost("web", tmp_path / "web" / "container", context="web"),
+            DockerHost("db", tmp_path / "db" / "container", context="db"),
+        ],
+    )
+    web, db = output.split("##End backup for host web\n")
+    assert web.count("##Start backup for compose project") == 4
+    assert db.count("##Start backup for compose project") == 1
+    assert "\tweb/service000/project00000_service000_data0\n" in web
+    assert "\tdb/service000/project00000_service000_data0\n" in db
+    assert "export DOCKER_CONTEXT=db; cd {}".format(tmp_path / "db") in db
+    # One ps and one inspect for every host
+    assert docker_calls(contexts) == 4
+
+
+def test_host_variable_keeps_shell_variables(
+    tmp_path: Path, planner: Planner, contexts: Path
+) -> None:
+    (tmp_path / "web" / "container" / "project00000" / "backup.ini").write_text(
+        "[service000]\npre_backup = backup_exec\techo $HOSTNAME $HOST_DIR $dockerHost\n"
+    )
+    output = run(
+        planner, [DockerHost("web", tmp_path / "web" / "container", context="web")]
+    )
+    assert "backup_exec\techo $HOSTNAME $HOST_DIR web\n" in output
+
+
+def test_slow_host_times_out(tmp_path: Path, planner: Planner, contexts: Path) -> None:
+    output = run(
+        planner,
+        [
+            DockerHost("web", tmp_path / "web" / "container", context="web"),
+            DockerHost("slow", tmp_path / "slow" / "container", context="slow"),
+        ],
+        timeout=1,
+    )
+    assert output.count("##Start backup for compose project") == 4
+    assert "##Start backup for host slow\n#The discovery timed out after 1s\n" in output
+
+
+def test_shell_variables_are_kept(planner: Planner) -> None:
+    planner.fleet(FleetSize(1, 1, 1))
+    (planner.folder / "project00000" / "backup.ini").write_text(
+        "[service000]\npre_backup = backup_exec\techo $HOSTNAME\n"
+    )
+    output = planner.run()
+    # $dockerHost is only defined with --host
+    assert "backup_exec\techo $HOSTNAME\n" in output
+
+
+def test_namespace() -> None:
+    remote = DockerHost("db", Path("/srv"), docker_host="ssh://root@db", ssh="root@db")
+    assert (
+        namespace("backup\t/var/lib/data\t./app/data/", remote)
+        == "backup\troot@db:/var/lib/data\tdb/app/data/"
+    )
+    assert (
+        namespace("backup_exec\tcd /srv/app; docker compose stop", remote)
+        == "backup_exec\tssh root@db 'cd /srv/app; docker compose stop'"
+    )
+    assert namespace("backup_exec\t/srv/docker/scripts/notify.sh done", remote) == (
+        "backup_exec\t/srv/docker/scripts/notify.sh done"
+    )
+    assert namespace("backup_exec\t/bin/date +%s", remote) == (
+        "backup_exec\t/bin/date +%s"
+    )
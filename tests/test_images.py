@@ -0,0 +1,99 @@
+import hashlib
+import io
+import os
+from pathlib import Path
+import tarfile
+
+import pytest
+
+from rsnapshot_docker_compose_backup import images
+from rsnapshot_docker_compose_backup.images import ImageStore, export
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+
+def _export(files: dict[str, bytes]) -> io.BytesIO:
+    """An export like the one of docker save"""
+    content = io.BytesIO()
+    with tarfile.open(fileobj=content, mode="w") as archive:
+        for name, data in files.items():
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    content.seek(0)
+    return content
+
+
+def test_shared_layers_are_stored_once(tmp_path: Path) -> None:
+    store = ImageStore(tmp_path / "store")
+    base = b"base layer" * 1000
+    store.add(
+        "sha256:" + "a" * 64, _export({"blobs/1": base, "manifest.json": b"a"}), True
+    )
+    store.add("b" * 64, _export({"blobs/1": base, "manifest.json": b"b"}), True)
+    store.add("c" * 64, _export({"layer.tar": b"c"}))
+    assert store.has("a" * 64) and store.has("sha256:" + "b" * 64)
+    assert (store.image_dir("a" * 64) / "blobs" / "1").read_bytes() == base
+    assert (store.image_dir("c" * 64) / "image.tar").is_file()
+    # The base layer and the two manifests
+    assert len(list((tmp_path / "store" / "blobs").iterdir())) == 3
+
+    store.touch("b" * 64)
+    removed = store.collect(
+        60, now=(tmp_path / "store" / "used" / ("b" * 64)).stat().st_mtime + 3600
+    )
+    assert sorted(removed) == ["a" * 64, "b" * 64, "c" * 64]
+    assert list((tmp_path / "store" / "blobs").iterdir()) == []
+
+
+def test_removed_tag_is_saved_by_id(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    def missing(image: str) -> str:
+        raise Exception("No such image: {}".format(image))
+
+    monkeypatch.setattr(images, "image_id", missing)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    (tmp_path / "export").mkdir()
+    (tmp_path / "export" / "manifest.json").write_text("[]")
+    docker = bin_dir / "docker"
+    docker.write_text(
+        '#!/bin/sh\necho "$@" >> {0}/calls\nexec tar -c -C {0}/export .\n'.format(
+            tmp_path
+        )
+    )
+    docker.chmod(0o755)
+    monkeypatch.setenv("PATH", "{}:{}".format(bin_dir, os.environ["PATH"]))
+    store = ImageStore(tmp_path / "store")
+    key = "sha256:" + "a" * 64
+    assert export(store, "app:old", key)
+    assert (tmp_path / "calls").read_text() == "image save {}\n".format(key)
+    # An image that is in the store isn't inspected or saved again
+    assert not export(store, "app:old", key)
+    assert (tmp_path / "calls").read_text() == "image save {}\n".format(key)
+    with pytest.raises(Exception):
+        export(store, "app:old")
+
+
+def test_image_store_action(planner: Planner) -> None:
+    planner.fleet(FleetSize(1, 1, 1))
+    (planner.folder / "project00000" / "backup.ini").write_text(
+        "[service000.actions]\nimagestore = true\nimagebackup = false\n"
+    )
+    outputs = [planner.run(cache=True) for _ in range(2)]
+    calls = planner.log.read_text()
+    image_id = hashlib.sha256(b"bench/service000").hexdigest()
+    store = "/var/cache/rsnapshot-docker-compose-backup/images"
+    assert (
+        "backup_exec\trsnapshot-docker-compose-images export --store {} --id {} "
+        "--retention-days 30 bench/service000".format(store, image_id)
+    ) in outputs[0]
+    assert "backup\t{}/images/{}/\t./service000/image".format(store, image_id) in (
+        outputs[0]
+    )
+    assert "image save" not in outputs[0]
+    assert outputs[1] == outputs[0]
+    # The id of the image is cached with the other results of the discovery
+    assert calls.count("inspect") == 1
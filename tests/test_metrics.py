@@ -0,0 +1,45 @@
+import asyncio
+import sys
+
+from rsnapshot_docker_compose_backup import metrics
+from rsnapshot_docker_compose_backup.utils import async_command, command
+
+
+def test_disabled_registry_records_nothing() -> None:
+    registry = metrics.reset()
+    with metrics.span("phase"):
+        pass
+    assert not registry.spans
+
+
+def test_commands_and_phases_are_recorded() -> None:
+    registry = metrics.reset(enabled=True)
+    with metrics.span("phase", project="/srv/web"):
+        command([sys.executable, "-c", "pass"])
+    assert registry.phases()["phase"]["calls"] == 1
+    assert registry.phases()["command"]["calls"] == 1
+    assert list(registry.projects()) == ["/srv/web"]
+    assert registry.slowest_commands()[0].args["argv"].startswith(sys.executable)
+    assert "Slowest commands:" in registry.text_report()
+    metrics.reset()
+
+
+def test_concurrent_spans_get_own_lanes() -> None:
+    registry = metrics.reset(enabled=True)
+
+    async def run() -> None:
+        await asyncio.gather(
+            *[async_command([sys.executable, "-c", "pass"]) for _ in range(3)]
+        )
+
+    asyncio.run(run())
+    trace = registry.chrome_trace()["traceEvents"]
+    lanes = {e["tid"] for e in trace if e["ph"] == "X"}
+    assert len(lanes) == 3
+    metrics.reset()
+
+
+def test_long_argv_is_shortened() -> None:
+    summary = metrics.summarize_argv(["docker", "inspect"] + ["a" * 64] * 5)
+    assert len(summary) == metrics.MAX_ARGV_LENGTH
+    assert summary.endswith("...")
@@ -0,0 +1,49 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup import global_values
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.config.parsed_config import load_config
+
+CONFIG_FOLDER = Path(__file__).parent / "config"
+
+
+def test_file_is_parsed_once(tmp_path: Path) -> None:
+    file = tmp_path / "backup.ini"
+    file.write_text("[Web]\nbackup = first\n")
+    parsed = load_config(file)
+    assert load_config(file) is parsed
+    assert parsed.steps("web", ["backup", "stop"]) == {"backup": "first\n"}
+    with pytest.raises(TypeError):
+        parsed.section("web")["backup"] = "changed"  # type: ignore
+
+    file.write_text("[web]\nbackup = second one\n")
+    os.utime(file, ns=(0, 0))
+    assert load_config(file).get("web", "backup") == "second one"
+
+
+def test_missing_file_has_no_sections(tmp_path: Path) -> None:
+    assert not load_config(tmp_path / "backup.ini").sections
+
+
+def test_settings_are_per_instance() -> None:
+    global_values.set_config_file(CONFIG_FOLDER / "not_running.ini")
+    DefaultConfig.reset()
+    assert DefaultConfig.get_instance().settings["onlyRunning"] is False
+    global_values.set_config_file(CONFIG_FOLDER / "default_config.ini")
+    DefaultConfig.reset()
+    assert DefaultConfig.get_instance().settings["onlyRunning"] is True
+    DefaultConfig.reset()
+
+
+def test_merged_steps_are_shared() -> None:
+    global_values.set_config_file(CONFIG_FOLDER / "default_config.ini")
+    DefaultConfig.reset()
+    default_config = DefaultConfig.get_instance()
+    merged = default_config.merged_steps({"backup": ""}, {})
+    assert default_config.merged_steps({"backup": ""}, {}) is merged
+    assert "$volumes.path" in merged["backup"]
+    assert "docker-compose stop" in merged["stop"]
+    DefaultConfig.reset()
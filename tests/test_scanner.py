@@ -0,0 +1,77 @@
+import os
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache
+from rsnapshot_docker_compose_backup.scanner import ScanOptions, find_compose_dirs
+
+
+@pytest.fixture(name="root")
+def fixture_root(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> Path:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    root = tmp_path / "root"
+    for project in ["web", "db", "apps/blog", "apps/blog/plugin", "data/deep/app"]:
+        (root / project).mkdir(parents=True)
+        (root / project / "compose.yaml").write_text("services: {}\n")
+    (root / "web" / "node_modules" / "pkg").mkdir(parents=True)
+    (root / "web" / "node_modules" / "pkg" / "docker-compose.yml").write_text("")
+    return root
+
+
+def relative(root: Path, dirs: list[Path]) -> list[str]:
+    return [str(d.relative_to(root)) for d in dirs]
+
+
+def test_stops_at_projects(root: Path) -> None:
+    assert relative(root, find_compose_dirs(root)) == [
+        "apps/blog",
+        "data/deep/app",
+        "db",
+        "web",
+    ]
+    assert "apps/blog/plugin" in relative(
+        root, find_compose_dirs(root, ScanOptions(nested=True))
+    )
+
+
+def test_max_depth_and_excludes(root: Path) -> None:
+    assert relative(root, find_compose_dirs(root, ScanOptions(max_depth=1))) == [
+        "db",
+        "web",
+    ]
+    options = ScanOptions(excludes=["data", "apps/*"])
+    assert relative(root, find_compose_dirs(root, options)) == ["db", "web"]
+
+
+def test_backupignore(root: Path) -> None:
+    (root / "apps" / ".backupignore").write_text("# comment\nblog/\n")
+    assert relative(root, find_compose_dirs(root)) == ["data/deep/app", "db", "web"]
+
+
+def test_threads_find_the_same_dirs(root: Path) -> None:
+    assert find_compose_dirs(root, ScanOptions(threads=4)) == find_compose_dirs(root)
+
+
+def test_index_is_validated_by_mtime(root: Path) -> None:
+    index = DiscoveryCache("dirs")
+    find_compose_dirs(root, index=index)
+    index.save()
+
+    index = DiscoveryCache("dirs")
+    assert len(find_compose_dirs(root, index=index)) == 4
+    assert index.stats.misses == 0
+    index.save()
+
+    (root / "cache").mkdir()
+    (root / "cache" / "compose.yaml").write_text("services: {}\n")
+    (root / "apps" / ".backupignore").write_text("blog\n")
+    index = DiscoveryCache("dirs")
+    assert "cache" in relative(root, find_compose_dirs(root, index=index))
+    index.save()
+
+    # Only the content of the ignore file changes, not the dir
+    (root / "apps" / ".backupignore").write_text("nothing\n")
+    os.utime(root / "apps" / ".backupignore", ns=(1, 1))
+    index = DiscoveryCache("dirs")
+    assert "apps/blog" in relative(root, find_compose_dirs(root, index=index))
@@ -0,0 +1,25 @@
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+
+def test_projects_are_stopped_once(planner: Planner) -> None:
+    # The second service of project00004 isn't running
+    planner.fleet(FleetSize(5, 2, 1))
+    output = planner.run(schedule="project")
+    lines = output.splitlines()
+    # All runtime backups run before the first project is stopped
+    assert max(i for i, line in enumerate(lines) if line == "#runtime_backup") < min(
+        i for i, line in enumerate(lines) if line == "#stop"
+    )
+    assert output.count("/usr/bin/docker-compose stop") == 5
+    assert output.count("/usr/bin/docker-compose start") == 5
+    assert output.count("_data0/_data\t") == 9
+    starts = [line for line in lines if line.startswith("##Start backup for")]
+    assert starts[0] == (
+        "##Start backup for compose project project00004 - services service000"
+    )
+    assert starts[1] == (
+        "##Start backup for compose project project00000 - services "
+        "service000, service001"
+    )
+    assert "#Expected stop window: 1 command\n" in output
@@ -0,0 +1,73 @@
+from pathlib import Path
+
+import pytest
+
+from rsnapshot_docker_compose_backup import backup_planer
+from rsnapshot_docker_compose_backup.cache import DiscoveryCache
+from rsnapshot_docker_compose_backup.sizing import parse_size, scan_sizes
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+
+def test_scan_uses_the_mtime_cache(
+    tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    monkeypatch.setenv("XDG_CACHE_HOME", str(tmp_path / "cache"))
+    volume = tmp_path / "volume"
+    (volume / "a" / "b").mkdir(parents=True)
+    (volume / "one").write_bytes(b"x" * 10)
+    (volume / "a" / "b" / "two").write_bytes(b"x" * 5)
+    index = DiscoveryCache("sizes")
+    assert scan_sizes([str(volume)], index) == {str(volume): 15}
+    assert index.stats.misses == 3
+    index.save()
+
+    index = DiscoveryCache("sizes")
+    assert scan_sizes([str(volume)], index) == {str(volume): 15}
+    assert index.stats.hits == 3
+    index.save()
+
+    (volume / "a" / "three").write_bytes(b"x" * 100)
+    index = DiscoveryCache("sizes")
+    assert scan_sizes([str(volume)], index, threads=2) == {str(volume): 115}
+
+
+def test_parse_docker_size() -> None:
+    assert parse_size("1.5GB") == 1500000000
+    assert parse_size("0B") == 0
+    assert parse_size("N/A") is None
+
+
+def test_shards_are_balanced(tmp_path: Path, planner: Planner) -> None:
+    planner.fleet(FleetSize(4, 1, 1))
+    planner.volume_dirs([400, 300, 200, 100])
+    # The files of an earlier run with more shards
+    (tmp_path / "docker.2.conf").write_text("")
+    (tmp_path / "docker.02.conf").write_text("")
+    result = planner.call(
+        backup_planer.write_shards, output=tmp_path / "docker.conf", shards=2
+    )
+    assert [shard.size for shard in result] == [500, 500]
+    first = (tmp_path / "docker.0.conf").read_text()
+    second = (tmp_path / "docker.1.conf").read_text()
+    assert "project00000" in first and "project00003" in first
+    assert "project00001" in second and "project00002" in second
+    assert "project00001" not in first
+    assert not (tmp_path / "docker.2.conf").exists()
+    assert (tmp_path / "docker.02.conf").exists()
+
+
+def test_shared_volumes_are_counted_once(tmp_path: Path, planner: Planner) -> None:
+    planner.fleet(FleetSize(2, 1, 1))
+    planner.volume_dirs([100, 300])
+    with planner.containers() as containers:
+        containers[0]["volumes"].append(containers[1]["volumes"][0])
+    result = planner.call(
+        backup_planer.write_shards,
+        output=tmp_path / "docker.conf",
+        shards=2,
+        shared_volumes="project",
+    )
+    # The volume of project00001 is only backed up by project00001
+    assert [shard.size for shard in result] == [300, 100]
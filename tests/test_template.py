@@ -0,0 +1,73 @@
+from typing import Any
+
+from rsnapshot_docker_compose_backup.config.template import (
+    compile_template,
+    names_of,
+    prepare_values,
+    used_variables,
+)
+from rsnapshot_docker_compose_backup.structure.volume import Volume
+
+
+def render(text: str, variables: dict[str, Any]) -> str:
+    values = prepare_values(variables)
+    return compile_template(text, names_of(values)).render(values)
+
+
+def test_case_insensitive() -> None:
+    variables = {"$serviceName": "web", "$image": "nginx"}
+    assert render("$SERVICENAME uses $Image", variables) == "web uses nginx"
+
+
+def test_longest_name_wins() -> None:
+    variables = {"$tmp": "/tmp", "$tmpFolder": "/var/tmp"}
+    assert render("$tmpFolder $tmp", variables) == "/var/tmp /tmp"
+
+
+def test_volumes_fan_out() -> None:
+    variables = {
+        "$serviceName": "web",
+        "$volumes": [Volume("a", "/data/a"), Volume("b", "/data/b")],
+    }
+    assert (
+        render("$serviceName $volumes.name $volumes.PATH $volumes", variables)
+        == "web a /data/a /data/a\nweb b /data/b /data/b\n"
+    )
+    assert render("backup $volumes", {"$volumes": []}) == ""
+
+
+def test_attribute_of_string_is_kept() -> None:
+    assert render("$file.name", {"$file": "x"}) == "x.name"
+
+
+def test_values_with_variables() -> None:
+    variables = {"$target": "$prefix/$serviceName", "$prefix": "/backup"}
+    variables["$serviceName"] = "web"
+    assert render("rsync $target", variables) == "rsync /backup/web"
+
+
+def test_first_of_same_name_is_used() -> None:
+    variables = {"$servicename": "user", "$serviceName": "builtin"}
+    assert render("$serviceName", variables) == "user"
+
+
+def test_templates_are_shared() -> None:
+    names = ("$a",)
+    assert compile_template("x $a", names) is compile_template("x $a", names)
+    assert compile_template("x $a y", names).variables == {"$a"}
+
+
+def test_used_variables() -> None:
+    variables = {
+        "$target": "$prefix/$serviceName",
+        "$prefix": "/backup",
+        "$serviceName": "web",
+        "$image": "",
+        "$volumes": "",
+    }
+    assert used_variables(["rsync $target", "echo $IMAGE"], variables) == {
+        "$target",
+        "$prefix",
+        "$servicename",
+        "$image",
+    }
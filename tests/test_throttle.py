@@ -0,0 +1,97 @@
+from pathlib import Path
+
+from rsnapshot_docker_compose_backup import backup_planer, throttle
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import CONFIG, Planner
+
+
+def _config(tmp_path: Path, settings: str) -> Path:
+    config = tmp_path / "backup.ini"
+    config.write_text(
+        CONFIG.read_text().replace("[settings]\n", "[settings]\n" + settings, 1)
+    )
+    return config
+
+
+def test_commands_are_throttled() -> None:
+    budget = throttle.parse_budget(
+        {"iobudget": "8M", "iobudget.db": "512", "ionice": "idle", "nice": "10"}
+    )
+    assert budget.total == 8 * 1024**2
+    assert budget.projects == {"db": 512 * 1024}
+    limiter = throttle.Throttle(budget, concurrency=2)
+    commands = [
+        "backup\t/data\t./app/data",
+        "backup\t/etc\t./app/etc\tone_fs=1",
+        "backup_exec\tcd /srv/app; echo 'done'",
+    ]
+    assert limiter.apply("backup", commands, Path("/srv/app"), "app") == [
+        "backup\t/data\t./app/data\t+rsync_long_args=--bwlimit=4096",
+        "backup\t/etc\t./app/etc\tone_fs=1,+rsync_long_args=--bwlimit=4096",
+        "backup_exec\t/usr/bin/ionice -c 3 /usr/bin/nice -n 10 /bin/sh -c "
+        "'cd /srv/app; echo '\"'\"'done'\"'\"''",
+    ]
+    assert limiter.apply("backup", commands[:1], Path("/srv/db"), "db") == [
+        "backup\t/data\t./app/data\t+rsync_long_args=--bwlimit=512"
+    ]
+    # The stop window isn't made longer
+    assert limiter.apply("stop", commands, Path("/srv/app"), "app") == commands
+
+
+def test_budget_is_divided_by_size() -> None:
+    limiter = throttle.Throttle(throttle.Budget(total=8000), concurrency=2)
+    limiter.assign({Path("/big"): 300, Path("/small"): 100, Path("/empty"): 0})
+    assert limiter.rate(Path("/big"), "big") == 6000
+    assert limiter.rate(Path("/small"), "small") == 2000
+    assert limiter.rate(Path("/empty"), "empty") == 600
+    assert limiter.rate(Path("/unknown"), "unknown") == 4000
+
+
+def test_projects_that_run_together_stay_within_the_budget() -> None:
+    total = 100 * 1024**2
+    limiter = throttle.Throttle(throttle.Budget(total=total), concurrency=4)
+    sizes = [100, 100, 100, 100, 1, 1, 1, 1]
+    folders = [Path("/project{}".format(i)) for i in range(len(sizes))]
+    limiter.assign(dict(zip(folders, sizes)))
+    rates = sorted(
+        (limiter.rate(folder, folder.name) or 0 for folder in folders), reverse=True
+    )
+    # The biggest projects run at the same time, with --execute or as shards
+    assert sum(rates[:4]) <= total
+    assert rates[0] == total // 4
+
+
+def test_budget_of_the_settings(tmp_path: Path, planner: Planner) -> None:
+    planner.fleet(FleetSize(2, 1, 1))
+    config = _config(
+        tmp_path, "ioBudget = 8M\nioBudget.project00001 = 1M\nioNice = idle\n"
+    )
+    output = planner.run(config=config)
+    assert (
+        "backup\t/var/lib/docker/volumes/project00000_service000_data0/_data\t"
+        "./service000/project00000_service000_data0\t"
+        "+rsync_long_args=--bwlimit=8192\n"
+    ) in output
+    assert "_data0\t+rsync_long_args=--bwlimit=1024\n" in output
+    assert (
+        "backup_script\t/usr/bin/ionice -c 3 /bin/sh -c "
+        "'/usr/bin/docker image save bench/service000 -o service000_image.tar'\t"
+    ) in output
+    assert "backup_exec\tcd {}; /usr/bin/docker-compose stop\n".format(
+        planner.folder / "project00000"
+    ) in (output)
+
+
+def test_shards_share_the_budget(tmp_path: Path, planner: Planner) -> None:
+    planner.fleet(FleetSize(2, 1, 1))
+    planner.volume_dirs([300, 100])
+    planner.call(
+        backup_planer.write_shards,
+        config=_config(tmp_path, "ioBudget = 8M\n"),
+        output=tmp_path / "docker.conf",
+        shards=2,
+    )
+    # The shards run at the same time, the bigger project gets more of the budget
+    assert "--bwlimit=6144" in (tmp_path / "docker.0.conf").read_text()
+    assert "--bwlimit=2048" in (tmp_path / "docker.1.conf").read_text()
@@ -0,0 +1,52 @@
+import pytest
+
+from tests.benchmark.fleet import FleetSize
+from tests.conftest import Planner
+
+
+def _plan(planner: Planner, policy: str, renamed: bool = False) -> str:
+    planner.fleet(FleetSize(2, 2, 1))
+    shared = "project00001_shared"
+    with planner.containers() as containers:
+        if renamed:
+            # compose names the volumes with the normalized name of the dir
+            shared = "myapp_shared"
+            for old, new, renamed_containers in [
+                ("project00000", "App", containers[:2]),
+                ("project00001", "MyApp", containers[2:]),
+            ]:
+                (planner.folder / old).rename(planner.folder / new)
+                for container in renamed_containers:
+                    container["working_dir"] = str(planner.folder / new)
+                    container["project"] = new.lower()
+        # Three services share a volume of the second project, the last one
+        # mounts a dir inside of it
+        for container in containers[:3]:
+            container["volumes"][0] = [shared, "/srv/shared"]
+        containers[3]["volumes"][0] = ["inner", "/srv/shared/inner"]
+    return planner.run(shared_volumes=policy)
+
+
+def test_shared_volume_is_backed_up_once(
+    planner: Planner, capsys: pytest.CaptureFixture[str]
+) -> None:
+    output = _plan(planner, "project")
+    assert output.count("backup\t/srv/shared\t") == 1
+    assert "backup\t/srv/shared\t./service000/project00001_shared" in output
+    assert output.count("#Volume project00001_shared is backed up by ") == 2
+    assert "is backed up by project00001/service000" in output
+    assert "Volume inner (project00001/service001) is inside volume " in (
+        capsys.readouterr().err
+    )
+
+
+def test_owner_with_normalized_project_name(planner: Planner) -> None:
+    output = _plan(planner, "project", renamed=True)
+    assert output.count("backup\t/srv/shared\t") == 1
+    assert output.count("#Volume myapp_shared is backed up by MyApp/service000") == 2
+
+
+def test_first_service_owns_the_volume(planner: Planner) -> None:
+    output = _plan(planner, "first")
+    assert output.count("backup\t/srv/shared\t") == 1
+    assert "is backed up by project00000/service000" in output
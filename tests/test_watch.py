@@ -0,0 +1,142 @@
+import json
+from pathlib import Path
+from typing import Any
+
+import pytest
+
+from rsnapshot_docker_compose_backup import backup_planer
+from rsnapshot_docker_compose_backup.config.default_config import DefaultConfig
+from rsnapshot_docker_compose_backup.docker import docker
+from rsnapshot_docker_compose_backup.scanner import ScanOptions
+from rsnapshot_docker_compose_backup.watch import (
+    PlanServer,
+    ScriptedEventSource,
+    Watcher,
+    fetch_plan,
+)
+
+from tests.benchmark.fleet import FleetSize, docker_calls
+from tests.conftest import Planner
+
+
+@pytest.fixture(name="fleet")
+def fixture_fleet(planner: Planner) -> tuple[Path, Path, Path]:
+    planner.fleet(FleetSize(3, 2, 1))
+    DefaultConfig.reset()
+    backup_planer.prepare(planner.args(config=None))
+    return planner.folder, planner.fixture, planner.log
+
+
+def container_event(action: str, working_dir: Path) -> dict[str, Any]:
+    return {
+        "Type": "container",
+        "Action": action,
+        "Actor": {
+            "ID": "0" * 64,
+            "Attributes": {docker.COMPOSE_WORKING_DIR_LABEL: str(working_dir)},
+        },
+    }
+
+
+def stop_container(fixture: Path, name: str) -> None:
+    content = json.loads(fixture.read_text())
+    for container in content["containers"]:
+        if container["name"] == name:
+            container["running"] = False
+    fixture.write_text(json.dumps(content))
+
+
+def test_only_affected_projects_are_updated(fleet: tuple[Path, Path, Path]) -> None:
+    root, fixture, log = fleet
+    output = root.parent / "backup.conf"
+    watcher = Watcher(root, output)
+    watcher.build()
+    assert output.read_text().count("##Start backup") == 6
+    assert watcher.rewrites == 1
+
+    project = root / "project00001"
+
+    calls: list[int] = []
+
+    def change(index: int) -> None:
+        if index > 0:
+            calls.append(docker_calls(log))
+        log.write_text("")
+        if index == 0:
+            stop_container(fixture, "project00001-service000-1")
+
+    watcher.follow(
+        ScriptedEventSource(
+            [
+                [container_event("stop", project), container_event("die", project)],
+                [container_event("start", project)],
+                [container_event("start", Path("/elsewhere"))],
+            ],
+            change,
+        )
+    )
+    content = output.read_text()
+    assert content.count("##Start backup") == 5
+    assert "service service000\n" not in content.split("project00001")[1]
+    # The stop changed the config, the start of an unchanged project didn't
+    assert watcher.rewrites == 2
+    # ps and inspect for every refresh, nothing for the unknown project
+    calls.append(docker_calls(log))
+    assert calls == [2, 2, 0]
+
+
+def test_unknown_project_rebuilds(fleet: tuple[Path, Path, Path]) -> None:
+    root, _, _ = fleet
+    watcher = Watcher(root)
+    watcher.build()
+    assert watcher.affected([container_event("create", root / "new")]) is None
+    assert watcher.affected([container_event("create", Path("/other"))]) == set()
+    volume_event = {
+        "Type": "volume",
+        "Action": "destroy",
+        "Actor": {"ID": "project00002_service001_data0"},
+    }
+    assert watcher.affected([volume_event]) == {root / "project00002"}
+
+
+def test_rejected_dir_rebuilds_once(fleet: tuple[Path, Path, Path]) -> None:
+    root, _, log = fleet
+    watcher = Watcher(root, scan_options=ScanOptions(excludes=["project00001"]))
+    watcher.build()
+    assert len(watcher.projects) == 2
+    calls: list[int] = []
+
+    def change(index: int) -> None:
+        if index > 0:
+            calls.append(docker_calls(log))
+        log.write_text("")
+
+    excluded = root / "project00001"
+    watcher.follow(
+        ScriptedEventSource(
+            [
+                [container_event("start", excluded)],
+                [container_event("stop", excluded)],
+                [container_event("start", excluded)],
+            ],
+            change,
+        )
+    )
+    calls.append(docker_calls(log))
+    # The first event rebuilds, the build doesn't find the dir again
+    assert calls[0] > 0
+    assert calls[1:] == [0, 0]
+    assert watcher.affected([container_event("start", excluded)]) == set()
+
+
+def test_plan_is_served(fleet: tuple[Path, Path, Path], planner: Planner) -> None:
+    root, _, _ = fleet
+    watcher = Watcher(root)
+    watcher.build()
+    server = PlanServer(root.parent / "plan.sock", watcher)
+    server.start()
+    try:
+        assert fetch_plan(root.parent / "plan.sock") == watcher.plan
+    finally:
+        server.stop()
+    assert watcher.plan == planner.run(config=None) + "\n"